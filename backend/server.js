@@ -200,7 +200,8 @@ function serializeProjectState(state) {
     tasks: Array.from(state.tasks.values()),
     approvals: Array.from(state.approvals.values()),
     logs: state.logs,
-    tokenUsage: state.tokenUsage || {}
+    tokenUsage: state.tokenUsage || {},
+    usageCost: state.usageCost || {}
   };
 }
 
@@ -256,7 +257,8 @@ function loadProjectFromDisk(projectId) {
     tasks,
     approvals,
     logs: data.logs || [],
-    tokenUsage: data.tokenUsage || {}
+    tokenUsage: data.tokenUsage || {},
+    usageCost: data.usageCost || {}
   };
 
   defaultAgents().forEach((agent) => {
@@ -344,6 +346,115 @@ function ensureBlazorApp(state) {
   return { ok: true };
 }
 
+function applyAgentStatus(state, agentId, status, step) {
+  const agent = state.agents.get(agentId);
+  if (!agent) return;
+  agent.status = status;
+  agent.currentStep = step || 'Working';
+  agent.updatedAt = Date.now();
+  broadcastEvent(state.project.id, 'agent_updated', agent);
+  saveProjectState(state);
+}
+
+function applyAgentTokens(state, agentId, tokens) {
+  state.tokenUsage = state.tokenUsage || {};
+  state.tokenUsage[agentId] = (state.tokenUsage[agentId] || 0) + (Number(tokens) || 0);
+  saveProjectState(state);
+  broadcastEvent(state.project.id, 'costs_updated', computeCosts(state).global);
+}
+
+function applyAgentUsage(state, agentId, costUsd) {
+  if (typeof costUsd !== 'number') return;
+  state.usageCost = state.usageCost || {};
+  state.usageCost[agentId] = (state.usageCost[agentId] || 0) + costUsd;
+  saveProjectState(state);
+  broadcastEvent(state.project.id, 'costs_updated', computeCosts(state).global);
+}
+
+// Version 1 of the runner's JSON-lines event protocol:
+// {"v":1,"seq":n,"ts":ms,"stage":"<agentId>","type":"...","payload":{...}}
+function handleRunnerEvent(state, event, tracker) {
+  if (tracker.lastSeq && event.seq !== tracker.lastSeq + 1) {
+    addLog(state, 'runner', null, `Event stream gap: expected seq ${tracker.lastSeq + 1}, got ${event.seq}.`);
+  }
+  tracker.lastSeq = event.seq;
+  const agentId = event.stage || 'runner';
+  const payload = event.payload || {};
+  switch (event.type) {
+    case 'status':
+      applyAgentStatus(state, agentId, payload.status, payload.step);
+      break;
+    case 'log':
+      addLog(state, agentId, null, payload.message || '');
+      break;
+    case 'tokens':
+      applyAgentTokens(state, agentId, payload.tokens);
+      break;
+    case 'file':
+      addLog(state, agentId, null, `Wrote ${payload.path}`);
+      break;
+    case 'approval_request':
+      handleApprovalRequest(state, payload);
+      break;
+    case 'usage':
+      applyAgentUsage(state, agentId, payload.cost_usd);
+      break;
+    default:
+      break;
+  }
+}
+
+function handleRunnerLine(state, line, tracker) {
+  const trimmed = line.trim();
+  if (!trimmed) return;
+  if (trimmed.startsWith('{')) {
+    let event = null;
+    try {
+      event = JSON.parse(trimmed);
+    } catch (err) {
+      event = null;
+    }
+    if (event && event.v === 1 && typeof event.type === 'string') {
+      handleRunnerEvent(state, event, tracker);
+      return;
+    }
+  }
+  if (trimmed.startsWith('AGENT_STATUS|')) {
+    const parts = trimmed.split('|');
+    applyAgentStatus(state, parts[1], parts[2], parts.slice(3).join('|'));
+  } else if (trimmed.startsWith('AGENT_TOKENS|')) {
+    const parts = trimmed.split('|');
+    applyAgentTokens(state, parts[1], parts[2]);
+  } else if (trimmed.startsWith('AGENT_LOG|')) {
+    const parts = trimmed.split('|');
+    addLog(state, parts[1] || 'runner', null, parts.slice(2).join('|') || '');
+  } else if (trimmed.startsWith('APPROVAL_REQUEST|')) {
+    const payloadText = trimmed.slice('APPROVAL_REQUEST|'.length);
+    try {
+      handleApprovalRequest(state, JSON.parse(payloadText));
+    } catch (err) {
+      addLog(state, 'runner', null, `Invalid approval payload: ${payloadText}`);
+    }
+  } else {
+    addLog(state, 'runner', null, trimmed);
+  }
+}
+
+function attachRunnerOutput(state, child) {
+  // Events arrive in batches, so a line may be split across chunks.
+  const tracker = { lastSeq: 0 };
+  let pending = '';
+  child.stdout.on('data', (chunk) => {
+    const lines = (pending + chunk.toString()).split(/\r?\n/);
+    pending = lines.pop();
+    lines.forEach((line) => handleRunnerLine(state, line, tracker));
+  });
+  child.stdout.on('end', () => {
+    if (pending) handleRunnerLine(state, pending, tracker);
+    pending = '';
+  });
+}
+
 function startProjectRun(state, options = {}) {
   const projectId = state.project.id;
   if (projectRunners.has(projectId)) {
@@ -412,50 +523,7 @@ function startProjectRun(state, options = {}) {
   if (orchestrator) broadcastEvent(projectId, 'agent_updated', orchestrator);
   addLog(state, 'runner', null, 'Run started.');
 
-  child.stdout.on('data', (chunk) => {
-    const text = chunk.toString();
-    text.split(/\r?\n/).forEach((line) => {
-      const trimmed = line.trim();
-      if (!trimmed) return;
-      if (trimmed.startsWith('AGENT_STATUS|')) {
-        const parts = trimmed.split('|');
-        const agentId = parts[1];
-        const status = parts[2];
-        const step = parts.slice(3).join('|') || 'Working';
-        const agent = state.agents.get(agentId);
-        if (agent) {
-          agent.status = status;
-          agent.currentStep = step;
-          agent.updatedAt = Date.now();
-          broadcastEvent(projectId, 'agent_updated', agent);
-          saveProjectState(state);
-        }
-      } else if (trimmed.startsWith('AGENT_TOKENS|')) {
-        const parts = trimmed.split('|');
-        const agentId = parts[1];
-        const tokens = Number(parts[2]) || 0;
-        state.tokenUsage = state.tokenUsage || {};
-        state.tokenUsage[agentId] = (state.tokenUsage[agentId] || 0) + tokens;
-        saveProjectState(state);
-        broadcastEvent(projectId, 'costs_updated', computeCosts(state).global);
-      } else if (trimmed.startsWith('AGENT_LOG|')) {
-        const parts = trimmed.split('|');
-        const agentId = parts[1] || 'runner';
-        const message = parts.slice(2).join('|') || '';
-        addLog(state, agentId, null, message);
-      } else if (trimmed.startsWith('APPROVAL_REQUEST|')) {
-        const payloadText = trimmed.slice('APPROVAL_REQUEST|'.length);
-        try {
-          const payload = JSON.parse(payloadText);
-          handleApprovalRequest(state, payload);
-        } catch (err) {
-          addLog(state, 'runner', null, `Invalid approval payload: ${payloadText}`);
-        }
-      } else {
-        addLog(state, 'runner', null, trimmed);
-      }
-    });
-  });
+  attachRunnerOutput(state, child);
   child.stderr.on('data', (chunk) => {
     const text = chunk.toString();
     text.split(/\r?\n/).forEach((line) => {
@@ -550,50 +618,7 @@ function runSingleTask(state, taskFile) {
 
     projectRunners.set(projectId, child);
 
-    child.stdout.on('data', (chunk) => {
-      const text = chunk.toString();
-      text.split(/\r?\n/).forEach((line) => {
-        const trimmed = line.trim();
-        if (!trimmed) return;
-        if (trimmed.startsWith('AGENT_STATUS|')) {
-          const parts = trimmed.split('|');
-          const agentId = parts[1];
-          const status = parts[2];
-          const step = parts.slice(3).join('|') || 'Working';
-          const agent = state.agents.get(agentId);
-          if (agent) {
-            agent.status = status;
-            agent.currentStep = step;
-            agent.updatedAt = Date.now();
-            broadcastEvent(projectId, 'agent_updated', agent);
-            saveProjectState(state);
-          }
-        } else if (trimmed.startsWith('AGENT_TOKENS|')) {
-          const parts = trimmed.split('|');
-          const agentId = parts[1];
-          const tokens = Number(parts[2]) || 0;
-          state.tokenUsage = state.tokenUsage || {};
-          state.tokenUsage[agentId] = (state.tokenUsage[agentId] || 0) + tokens;
-          saveProjectState(state);
-          broadcastEvent(projectId, 'costs_updated', computeCosts(state).global);
-      } else if (trimmed.startsWith('AGENT_LOG|')) {
-        const parts = trimmed.split('|');
-        const agentId = parts[1] || 'runner';
-        const message = parts.slice(2).join('|') || '';
-        addLog(state, agentId, null, message);
-      } else if (trimmed.startsWith('APPROVAL_REQUEST|')) {
-        const payloadText = trimmed.slice('APPROVAL_REQUEST|'.length);
-        try {
-          const payload = JSON.parse(payloadText);
-          handleApprovalRequest(state, payload);
-        } catch (err) {
-          addLog(state, 'runner', null, `Invalid approval payload: ${payloadText}`);
-        }
-      } else {
-        addLog(state, 'runner', null, trimmed);
-      }
-    });
-  });
+    attachRunnerOutput(state, child);
 
     child.stderr.on('data', (chunk) => {
       const text = chunk.toString();
@@ -929,13 +954,18 @@ function computeCosts(state) {
     totalTokens += count;
   });
 
+  // Priced usage reported by the runner replaces the flat per-1K estimate.
+  const measured = state.usageCost || {};
+  let totalCost = 0;
   Object.values(perAgent).forEach((c) => {
-    c.cost = (c.tokensUsed / 1000) * TOKEN_COST_PER_1K;
+    c.cost =
+      measured[c.agentId] !== undefined ? measured[c.agentId] : (c.tokensUsed / 1000) * TOKEN_COST_PER_1K;
+    totalCost += c.cost;
   });
 
   const global = {
     totalTokens,
-    totalCost: (totalTokens / 1000) * TOKEN_COST_PER_1K
+    totalCost
   };
 
   return { global, perAgent };
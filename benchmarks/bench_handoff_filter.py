@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# Micro-benchmark for the handoff input filter. Builds tool-heavy histories
+# (default 10k items) both as Responses input dicts and as SDK RunItems, with
+# a mix of sequential calls, parallel calls whose outputs arrive interleaved,
+# reasoning items and orphans, then times _grouped_handoff_filter on them.
+#
+#   python benchmarks/bench_handoff_filter.py --items 10000 --repeat 5
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents import Agent  # noqa: E402
+from agents.handoffs import HandoffInputData  # noqa: E402
+from agents.items import ReasoningItem, ToolCallItem, ToolCallOutputItem  # noqa: E402
+from openai.types.responses import ResponseFunctionToolCall, ResponseReasoningItem  # noqa: E402
+
+import multi_agent_workflow as workflow  # noqa: E402
+
+
+def _history(size: int) -> list[dict]:
+    # Repeating 10-item pattern: reasoning + call + output, two parallel calls
+    # with interleaved outputs, a message, and an orphaned call and output.
+    items: list[dict] = []
+    block = 0
+    while len(items) < size:
+        prefix = f"b{block}"
+        items += [
+            {"type": "reasoning", "id": f"rs_{prefix}", "summary": []},
+            {"type": "function_call", "call_id": f"{prefix}_a", "name": "db_query", "arguments": "{}"},
+            {"type": "function_call_output", "call_id": f"{prefix}_a", "output": "ok"},
+            {"type": "function_call", "call_id": f"{prefix}_b", "name": "db_query", "arguments": "{}"},
+            {"type": "function_call", "call_id": f"{prefix}_c", "name": "db_query", "arguments": "{}"},
+            {"type": "function_call_output", "call_id": f"{prefix}_c", "output": "ok"},
+            {"type": "function_call_output", "call_id": f"{prefix}_b", "output": "ok"},
+            {"role": "assistant", "content": f"step {block}"},
+            {"type": "function_call", "call_id": f"{prefix}_orphan", "name": "db_query", "arguments": "{}"},
+            {"type": "function_call_output", "call_id": f"{prefix}_missing", "output": "lost"},
+        ]
+        block += 1
+    return items[:size]
+
+
+def _run_items(history: list[dict], agent: Agent) -> tuple:
+    run_items = []
+    for item in history:
+        item_type = item.get("type")
+        if item_type == "reasoning":
+            run_items.append(ReasoningItem(agent=agent, raw_item=ResponseReasoningItem(**item)))
+        elif item_type == "function_call":
+            run_items.append(ToolCallItem(agent=agent, raw_item=ResponseFunctionToolCall(**item)))
+        elif item_type == "function_call_output":
+            run_items.append(ToolCallOutputItem(agent=agent, raw_item=item, output=item["output"]))
+    return tuple(run_items)
+
+
+def _time(data: HandoffInputData, repeat: int) -> tuple[float, HandoffInputData]:
+    samples = []
+    result = data
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = workflow._grouped_handoff_filter(data)
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the handoff input filter.")
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    agent = Agent(name="bench")
+    history = _history(args.items)
+    cases = {
+        "input_history (dicts)": HandoffInputData(
+            input_history=tuple(history), pre_handoff_items=(), new_items=()
+        ),
+        "new_items (RunItems)": HandoffInputData(
+            input_history=(), pre_handoff_items=(), new_items=_run_items(history, agent)
+        ),
+    }
+    for name, data in cases.items():
+        seconds, result = _time(data, args.repeat)
+        before = len(data.input_history) + len(data.new_items)
+        after = len(result.input_history) + len(result.input_items or ())
+        print(
+            f"{name:<22} {before:>6} items  {seconds * 1000:8.2f} ms  "
+            f"{before / seconds / 1000:8.1f}k items/s  kept {after} ({before - after} removed)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Rate-limit soak test. Starts a local stand-in for the Responses API that
+# enforces a requests- and tokens-per-minute quota (429 with retry-after and
+# x-ratelimit-* headers once it is exceeded) and fails a share of requests
+# with 500/503, then runs several projects through multi_agent_workflow.py
+# against it and reports how the run coped: exit status, wall time, what the
+# server saw and the workflow's own rate-limiting summary. Answers come from
+# the fake model, so no network or API key is needed.
+#
+#   python benchmarks/bench_rate_limit.py --projects 3 --rpm 40 --tpm 120000 --error-rate 0.05
+#   AGENT_MODEL_RETRIES=0 python benchmarks/bench_rate_limit.py   # the old fail-fast behaviour
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKFLOW = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multi_agent_workflow.py")
+SUMMARY_MARKERS = ("Rate limiting:", "Scheduler:", "Batch finished", "Project ")
+
+
+class _Quota:
+    # Sliding one-minute window over granted requests, shared by the server
+    # threads.
+    def __init__(self, rpm: int, tpm: int, error_rate: float) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self.error_rate = error_rate
+        self.granted: collections.deque[tuple[float, int]] = collections.deque()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int) -> tuple[int, dict[str, str]]:
+        with self.lock:
+            now = time.monotonic()
+            while self.granted and self.granted[0][0] <= now - 60:
+                self.granted.popleft()
+            used = sum(amount for _, amount in self.granted)
+            self.counts["requests"] += 1
+            if random.random() < self.error_rate:
+                status = random.choice((500, 503))
+                self.counts[str(status)] += 1
+                return status, {}
+            need_requests = len(self.granted) + 1 - self.rpm
+            need_tokens = used + tokens - self.tpm
+            if need_requests > 0 or need_tokens > 0:
+                # Retry once enough of the window has expired for this request.
+                retry_at = now
+                for granted_at, amount in self.granted:
+                    if need_requests <= 0 and need_tokens <= 0:
+                        break
+                    need_requests -= 1
+                    need_tokens -= amount
+                    retry_at = granted_at + 60
+                self.counts["429"] += 1
+                return 429, self._headers(now, used) | {"retry-after": f"{max(0.05, retry_at - now):.3f}"}
+            self.granted.append((now, tokens))
+            self.counts["200"] += 1
+            return 200, self._headers(now, used + tokens)
+
+    def _headers(self, now: float, used: int) -> dict[str, str]:
+        oldest = self.granted[0][0] if self.granted else now
+        reset = f"{max(0.0, oldest + 60 - now):.3f}s"
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(max(0, self.rpm - len(self.granted))),
+            "x-ratelimit-reset-requests": reset,
+            "x-ratelimit-limit-tokens": str(self.tpm),
+            "x-ratelimit-remaining-tokens": str(max(0, self.tpm - used)),
+            "x-ratelimit-reset-tokens": reset,
+        }
+
+
+def _handler(quota: _Quota, workflow):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("content-length") or 0)) or b"{}")
+            if not self.path.rstrip("/").endswith("/responses"):
+                self._error(404, "not_found", "Only /v1/responses is served here.", {})
+                return
+            instructions, items = body.get("instructions"), body.get("input")
+            status, headers = quota.admit(workflow._request_tokens(instructions, items))
+            if status == 429:
+                self._error(429, "rate_limit_exceeded", "Rate limit reached (stand-in).", headers)
+                return
+            if status != 200:
+                self._error(status, "server_error", "Injected transient failure.", headers)
+                return
+            model = workflow._FakeModel(body.get("model") or workflow.MODEL_NAME)
+            if not body.get("stream"):
+                text, usage = model._respond(instructions, items)
+                payload = model._response(f"resp_{uuid.uuid4().hex[:12]}", text, usage).model_dump_json()
+                self._send(200, "application/json", headers, payload.encode("utf-8"))
+                return
+            self._send(200, "text/event-stream", headers, None)
+
+            async def stream() -> None:
+                async for event in model.stream_response(instructions, items, None, [], None, [], None):
+                    self.wfile.write(f"event: {event.type}\ndata: {event.model_dump_json()}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+            asyncio.run(stream())
+
+        def _error(self, status: int, code: str, message: str, headers: dict[str, str]) -> None:
+            payload = {"error": {"message": message, "type": code, "code": code, "param": None}}
+            self._send(status, "application/json", headers, json.dumps(payload).encode("utf-8"))
+
+        def _send(self, status: int, content_type: str, headers: dict[str, str], data: bytes | None) -> None:
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if data is not None:
+                self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            if data is not None:
+                self.wfile.write(data)
+
+    return Handler
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the workflow against a throttling stand-in API.")
+    parser.add_argument("--projects", type=int, default=3, help="Projects run concurrently in one process.")
+    parser.add_argument("--rpm", type=int, default=40, help="Stand-in requests-per-minute quota.")
+    parser.add_argument("--tpm", type=int, default=120_000, help="Stand-in tokens-per-minute quota.")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Share of requests failed with 500/503.")
+    parser.add_argument("--latency-ms", type=float, default=50, help="Stand-in latency per response.")
+    parser.add_argument("--output-kb", type=float, default=4, help="Stand-in output size per response.")
+    parser.add_argument("--max-model-calls", type=int, default=8)
+    parser.add_argument("--retry-base", type=float, default=0.5, help="AGENT_RETRY_BASE_SECONDS for the run.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated project directories.")
+    args = parser.parse_args()
+
+    os.environ["AGENT_FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["AGENT_FAKE_OUTPUT_KB"] = str(args.output_kb)
+    import multi_agent_workflow as workflow  # noqa: E402  (reads the settings above)
+
+    logging.getLogger().setLevel(logging.ERROR)
+
+    quota = _Quota(args.rpm, args.tpm, args.error_rate)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(quota, workflow))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    env = os.environ.copy()
+    for name in ("AGENT_FAKE_MODEL", "OPENAI_ORG_ID", "OPENAI_PROJECT_ID"):
+        env.pop(name, None)
+    env.update(
+        OPENAI_API_KEY="sk-stand-in",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1",
+        OPENAI_AGENTS_DISABLE_TRACING="1",
+        AGENT_APPROVAL_REQUIRED="0",
+        AGENT_RETRY_BASE_SECONDS=str(args.retry_base),
+    )
+    roots = [tempfile.mkdtemp(prefix="bench_rate_limit_") for _ in range(max(1, args.projects))]
+    cmd = [sys.executable, WORKFLOW, "--no-cache", "--max-model-calls", str(args.max_model_calls)]
+    for root in roots:
+        cmd += ["--project-root", root]
+    try:
+        started = time.perf_counter()
+        process = subprocess.run(cmd, cwd=roots[0], env=env, capture_output=True, text=True)
+        wall = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        if not args.keep:
+            for root in roots:
+                shutil.rmtree(root, ignore_errors=True)
+
+    counts = quota.counts
+    settings = {
+        key: getattr(args, key) for key in ("projects", "rpm", "tpm", "error_rate", "latency_ms", "max_model_calls")
+    }
+    print(f"settings: {json.dumps(settings)}")
+    print(f"workflow exit code {process.returncode} after {wall:.1f}s")
+    print(
+        f"stand-in served {counts['requests']} request(s): {counts['200']} ok, {counts['429']} throttled, "
+        f"{counts['500'] + counts['503']} injected 5xx; {counts['200'] / wall:.2f} ok/s"
+    )
+    for line in (process.stdout + process.stderr).splitlines():
+        if " INFO " in line or " WARNING " in line or " ERROR " in line:
+            if any(marker in line for marker in SUMMARY_MARKERS):
+                print(f"  {line.split(' ', 2)[-1]}")
+    return process.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
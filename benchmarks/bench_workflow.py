@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# End-to-end orchestration benchmark. Runs the full multi_agent_workflow.py
+# pipeline in fresh project directories against the offline fake model and
+# reports wall time, peak RSS, per-stage orchestration overhead (stage time
+# not spent in model turns, queueing or approval) and file-write throughput,
+# taken from each run's Chrome trace. Needs no network or API key.
+#
+#   python benchmarks/bench_workflow.py --runs 5 --json-out bench.json
+#   python benchmarks/bench_workflow.py --baseline bench.json   # exit 1 on regression
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKFLOW = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multi_agent_workflow.py")
+
+
+def _run_once(project_root: str, args: argparse.Namespace) -> dict:
+    env = os.environ.copy()
+    env.pop("OPENAI_API_KEY", None)
+    env.update(
+        AGENT_APPROVAL_REQUIRED="0",
+        AGENT_FAKE_MODEL="1",
+        AGENT_FAKE_LATENCY_MS=str(args.latency_ms),
+        AGENT_FAKE_OUTPUT_KB=str(args.output_kb),
+        AGENT_TRACE="1",
+    )
+    cmd = [sys.executable, WORKFLOW, "--project-root", project_root, "--max-parallel", str(args.max_parallel)]
+    if args.speculative:
+        cmd.append("--speculative")
+    if not args.warm:
+        cmd.append("--no-cache")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, cwd=project_root, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    # wait4 gives the child's own rusage; RUSAGE_CHILDREN would report the
+    # maximum over every run so far.
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - started
+    if process.returncode != 0:
+        raise SystemExit(f"workflow exited with {process.returncode} in {project_root}")
+    traces = sorted(glob.glob(os.path.join(project_root, ".agent_cache", "traces", "*.trace.json")))
+    with open(traces[-1], "r", encoding="utf-8") as handle:
+        events = [event for event in json.load(handle)["traceEvents"] if event["ph"] == "X"]
+    return {"wall_seconds": wall, "peak_rss_mb": usage.ru_maxrss / 1024} | _trace_metrics(events)
+
+
+def _trace_metrics(events: list[dict]) -> dict:
+    stages: dict[str, dict] = {}
+    by_tid = {event["tid"]: event["name"] for event in events if event["cat"] == "stage"}
+    for event in events:
+        stage = by_tid.get(event["tid"])
+        if stage is None:
+            continue
+        entry = stages.setdefault(stage, {"stage_ms": 0.0, "model_ms": 0.0, "wait_ms": 0.0})
+        if event["cat"] == "stage":
+            entry["stage_ms"] += event["dur"] / 1000
+        elif event["cat"] == "model" and event["name"].startswith("turn "):
+            entry["model_ms"] += event["dur"] / 1000
+        elif event["cat"] in {"approval", "scheduler"}:
+            entry["wait_ms"] += event["dur"] / 1000
+    writes = [event for event in events if event["name"] == "write_files"]
+    write_seconds = sum(event["dur"] for event in writes) / 1_000_000
+    write_bytes = sum(event["args"].get("bytes", 0) for event in writes)
+    write_files = sum(event["args"].get("files", 0) for event in writes)
+    return {
+        "stage_overhead_ms": {
+            stage: entry["stage_ms"] - entry["model_ms"] - entry["wait_ms"] for stage, entry in stages.items()
+        },
+        "write_mb_per_s": write_bytes / 1024 / 1024 / write_seconds if write_seconds else 0.0,
+        "write_files_per_s": write_files / write_seconds if write_seconds else 0.0,
+        "written_bytes": write_bytes,
+    }
+
+
+def _summarize(runs: list[dict]) -> dict:
+    stages = sorted({stage for run in runs for stage in run["stage_overhead_ms"]})
+    return {
+        "runs": len(runs),
+        "wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+        "wall_seconds_min": min(run["wall_seconds"] for run in runs),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "stage_overhead_ms": {
+            stage: statistics.median(run["stage_overhead_ms"].get(stage, 0.0) for run in runs) for stage in stages
+        },
+        "write_mb_per_s": statistics.median(run["write_mb_per_s"] for run in runs),
+        "write_files_per_s": statistics.median(run["write_files_per_s"] for run in runs),
+        "written_bytes": runs[-1]["written_bytes"],
+    }
+
+
+def _print_summary(summary: dict, settings: dict) -> None:
+    print(f"settings: {json.dumps(settings)}")
+    print(f"wall time (median of {summary['runs']}): {summary['wall_seconds']:.3f}s (min {summary['wall_seconds_min']:.3f}s)")
+    print(f"peak RSS: {summary['peak_rss_mb']:.1f} MB")
+    print(
+        f"file writes: {summary['write_mb_per_s']:.1f} MB/s, {summary['write_files_per_s']:.0f} files/s "
+        f"({summary['written_bytes']} bytes per run)"
+    )
+    print("orchestration overhead per stage (median ms):")
+    for stage, overhead in summary["stage_overhead_ms"].items():
+        print(f"  {stage:<10} {overhead:8.2f}")
+    print(f"  {'total':<10} {sum(summary['stage_overhead_ms'].values()):8.2f}")
+
+
+def _regressions(summary: dict, baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+    checks = [
+        ("wall_seconds", summary["wall_seconds"], baseline["wall_seconds"]),
+        ("peak_rss_mb", summary["peak_rss_mb"], baseline["peak_rss_mb"]),
+        (
+            "stage_overhead_ms",
+            sum(summary["stage_overhead_ms"].values()),
+            sum(baseline["stage_overhead_ms"].values()),
+        ),
+    ]
+    for name, current, previous in checks:
+        if previous and current > previous * (1 + tolerance):
+            problems.append(f"{name}: {current:.3f} vs baseline {previous:.3f} (+{100 * (current / previous - 1):.0f}%)")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark workflow orchestration against the fake model.")
+    parser.add_argument("--runs", type=int, default=3, help="Measured runs (median is reported).")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Fake model latency per turn.")
+    parser.add_argument("--output-kb", type=float, default=8, help="Fake model output size per turn.")
+    parser.add_argument("--max-parallel", type=int, default=3)
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Reuse one project directory so runs after the first are served from the response cache.",
+    )
+    parser.add_argument("--json-out", default=None, help="Write the summary to this file.")
+    parser.add_argument("--baseline", default=None, help="Summary JSON from an earlier run to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown vs baseline (0.2 = 20%%).")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated project directories.")
+    args = parser.parse_args()
+
+    settings = {
+        "latency_ms": args.latency_ms,
+        "output_kb": args.output_kb,
+        "max_parallel": args.max_parallel,
+        "speculative": args.speculative,
+        "warm": args.warm,
+    }
+    roots: list[str] = []
+    runs = []
+    try:
+        shared_root = tempfile.mkdtemp(prefix="bench_workflow_") if args.warm else None
+        if shared_root:
+            roots.append(shared_root)
+            _run_once(shared_root, args)
+        for _ in range(max(1, args.runs)):
+            root = shared_root or tempfile.mkdtemp(prefix="bench_workflow_")
+            if root not in roots:
+                roots.append(root)
+            runs.append(_run_once(root, args))
+    finally:
+        if not args.keep:
+            for root in roots:
+                shutil.rmtree(root, ignore_errors=True)
+
+    summary = _summarize(runs) | {"settings": settings}
+    _print_summary(summary, settings)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        if baseline.get("settings") != settings:
+            print("warning: baseline was recorded with different settings", file=sys.stderr)
+        problems = _regressions(summary, baseline, args.max_regression)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,27 @@ import os
 import asyncio
 import logging
 import json
+import hashlib
+import heapq
+import math
+import random
 import re
 import argparse
+import contextvars
 import time
 import uuid
-import subprocess
+import shutil
+import signal
+import socket
+import sqlite3
+import sys
+import threading
+import ctypes
+import ctypes.util
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
 from datetime import datetime
+from typing import Awaitable, Callable
 from dotenv import load_dotenv
 from agents import Agent, RunConfig, Runner, WebSearchTool, ModelSettings, function_tool
 from agents.handoffs import HandoffInputData
@@ -15,19 +30,202 @@ from agents.items import (
     HandoffCallItem,
     HandoffOutputItem,
     ReasoningItem,
-    RunItem,
     ToolCallItem,
     ToolCallOutputItem,
 )
 from agents.extensions.handoff_prompt import RECOMMENDED_PROMPT_PREFIX
+from agents.items import ModelResponse
+from agents.models.interface import Model, ModelProvider
+from agents.models.multi_provider import MultiProvider
+from agents.usage import Usage
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseCreatedEvent,
+    ResponseOutputMessage,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
 from openai.types.shared import Reasoning
 
+try:
+    import aiomysql
+except ImportError:  # optional: db_query falls back to the mysql CLI
+    aiomysql = None
+
+try:
+    import tiktoken
+except ImportError:  # optional: token counts fall back to a 4-characters-per-token estimate
+    tiktoken = None
+
 FILE_HEADER_RE = re.compile(r"^### FILE:\s*(.+?)\s*$")
 FENCE_START_RE = re.compile(r"^\s*```[a-zA-Z0-9_-]*\s*$")
 FENCE_END_RE = re.compile(r"^\s*```\s*$")
 MODEL_NAME = "gpt-5.1"
 APPROVAL_REQUIRED = os.environ.get("AGENT_APPROVAL_REQUIRED", "1") != "0"
+APPROVAL_POLL_SECONDS = float(os.environ.get("APPROVAL_POLL_SECONDS", "0.5") or 0.5)
+EVENT_PROTOCOL_VERSION = 1
+DB_QUERY_MAX_BYTES = int(os.environ.get("DB_QUERY_MAX_BYTES", "65536") or 65536)
+DB_FETCH_BATCH = 100
+SQL_LITERAL_RE = re.compile(
+    r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`|--[^\n]*|#[^\n]*|/\*.*?\*/",
+    re.DOTALL,
+)
+SQLITE_SCHEMA_FINGERPRINT_SQL = "PRAGMA schema_version"
+SANDBOX_SCHEMA_FINGERPRINT_SQL = (
+    "SELECT schema_version, user_version FROM pragma_schema_version, pragma_user_version"
+)
+# Column count plus an order-independent checksum of every column definition;
+# avoids GROUP_CONCAT, whose output is silently cut at group_concat_max_len.
+MYSQL_SCHEMA_FINGERPRINT_SQL = (
+    "SELECT COUNT(*), SUM(CRC32(CONCAT_WS(':', table_name, column_name, ordinal_position, "
+    "column_type, column_key, is_nullable))) "
+    "FROM information_schema.columns WHERE table_schema = DATABASE()"
+)
+# FROM/JOIN table lists and the tables that only describe the schema; only
+# queries limited to those (or SHOW/DESCRIBE/EXPLAIN) are cached against a
+# database other processes may write to.
+SQL_TABLE_LIST_RE = re.compile(
+    r"\b(?:from|join)\s+(.+?)(?=\b(?:where|join|on|using|group|order|having|limit|union|window)\b|\)|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+SQL_SCHEMA_TABLE_RE = re.compile(
+    r"^`?(?:information_schema`?\.|sqlite_master\b|sqlite_schema\b|pragma_\w+)", re.IGNORECASE
+)
+SQL_TRAILING_LIMIT_RE = re.compile(
+    r"\blimit\s+(\d+)(?:\s*,\s*(\d+)|\s+offset\s+\d+)?\s*$", re.IGNORECASE
+)
+# Clauses MySQL only accepts after LIMIT.
+SQL_AFTER_LIMIT_RE = re.compile(
+    r"\b(?:for\s+(?:update|share)\b|lock\s+in\s+share\s+mode\b|into\s+(?:outfile\b|dumpfile\b|@)"
+    r"|procedure\s+analyse\b)",
+    re.IGNORECASE,
+)
+SQL_FROM_RE = re.compile(r"\bfrom\b", re.IGNORECASE)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
 MEMORY_DIR = "memory"
+# Bounded agent memory: the prompt gets a summary of older entries plus the
+# newest entries that fit the window; the log is compacted once it holds
+# MEMORY_COMPACT_ENTRIES entries.
+MEMORY_WINDOW_ENTRIES = int(os.environ.get("AGENT_MEMORY_WINDOW", "5") or 5)
+MEMORY_WINDOW_TOKENS = int(os.environ.get("AGENT_MEMORY_WINDOW_TOKENS", "2000") or 2000)
+MEMORY_SUMMARY_TOKENS = int(os.environ.get("AGENT_MEMORY_SUMMARY_TOKENS", "800") or 800)
+MEMORY_COMPACT_ENTRIES = int(os.environ.get("AGENT_MEMORY_COMPACT_ENTRIES", "20") or 20)
+MEMORY_INDEX_VERSION = 1
+MEMORY_DATED_HEADING_RE = re.compile(r"^#{1,6}\s.*\b\d{4}-\d{2}-\d{2}\b")
+MAX_PARALLEL_STAGES = int(os.environ.get("AGENT_MAX_PARALLEL", "3") or 3)
+MAX_MODEL_CALLS = int(os.environ.get("AGENT_MAX_MODEL_CALLS", "8") or 8)
+# Fair-share weights of the priority classes when projects compete for model
+# calls; an interactive project gets 16 slots for every one a batch project
+# gets while both have requests waiting.
+MODEL_PRIORITY_WEIGHTS = {"interactive": 16, "normal": 4, "batch": 1}
+MODEL_PRIORITY = os.environ.get("AGENT_PRIORITY", "normal")
+# Model spend caps for one run; 0 means unlimited. The project caps apply to
+# each project separately, the global ones to all projects in the process.
+PROJECT_TOKEN_BUDGET = int(os.environ.get("AGENT_TOKEN_BUDGET", "0") or 0)
+PROJECT_COST_BUDGET = float(os.environ.get("AGENT_COST_BUDGET_USD", "0") or 0)
+GLOBAL_TOKEN_BUDGET = int(os.environ.get("AGENT_GLOBAL_TOKEN_BUDGET", "0") or 0)
+GLOBAL_COST_BUDGET = float(os.environ.get("AGENT_GLOBAL_COST_BUDGET_USD", "0") or 0)
+# Client-side API quota. Limits of 0 start unlimited and are learned from the
+# x-ratelimit-* response headers. Throttled (429), transient (5xx) and
+# connection failures are retried with full-jitter exponential backoff.
+MODEL_RPM_LIMIT = int(os.environ.get("AGENT_RPM_LIMIT", "0") or 0)
+MODEL_TPM_LIMIT = int(os.environ.get("AGENT_TPM_LIMIT", "0") or 0)
+MODEL_RETRY_ATTEMPTS = int(os.environ.get("AGENT_MODEL_RETRIES", "6") or 6)
+MODEL_RETRY_BASE_SECONDS = float(os.environ.get("AGENT_RETRY_BASE_SECONDS", "1") or 1)
+MODEL_RETRY_MAX_SECONDS = 60.0
+RATE_LIMIT_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+CACHE_DIR = ".agent_cache"
+# Offline fake model (--fake-model or AGENT_FAKE_MODEL=1), for benchmarks.
+FAKE_MODEL_ENABLED = os.environ.get("AGENT_FAKE_MODEL", "").strip().lower() in {"1", "true", "yes"}
+FAKE_MODEL_LATENCY_MS = float(os.environ.get("AGENT_FAKE_LATENCY_MS", "200") or 0)
+FAKE_MODEL_OUTPUT_KB = float(os.environ.get("AGENT_FAKE_OUTPUT_KB", "8") or 0)
+FAKE_MODEL_CACHED_RATIO = float(os.environ.get("AGENT_FAKE_CACHED_RATIO", "0.5") or 0)
+FAKE_MODEL_CHUNK_CHARS = 256
+TRACE_ENABLED = os.environ.get("AGENT_TRACE", "1").strip().lower() not in {"0", "false", "no"}
+# Directories never hashed when a stage declares a whole tree as input.
+MANIFEST_SKIP_DIRS = frozenset({".git", ".agent_cache", "node_modules", "bin", "obj", "__pycache__"})
+RUN_JOURNAL_KEEP = 50
+RESPONSE_CACHE_MAX_MB = int(os.environ.get("AGENT_RESPONSE_CACHE_MB", "256") or 256)
+# USD per million tokens. AGENT_PRICE_TABLE may point at a JSON file with the
+# same shape to add models or override these.
+MODEL_PRICES = {
+    "gpt-5.1": {"input": 1.25, "cached_input": 0.125, "output": 10.0},
+}
+SCHEMA_ADVICE_FILE = "database_schema_advice.txt"
+SCHEMA_ADVICE_TOP_K = int(os.environ.get("SCHEMA_ADVICE_TOP_K", "8") or 8)
+SCHEMA_ADVICE_TOKEN_BUDGET = int(os.environ.get("SCHEMA_ADVICE_TOKEN_BUDGET", "6000") or 6000)
+SCHEMA_CHUNK_CHARS = 1500
+# Token budget for each stage payload (the user message; agent instructions
+# are not counted). AGENT_PROMPT_TOKEN_BUDGETS takes per-role overrides as
+# "role=tokens,role=tokens".
+PROMPT_TOKEN_BUDGET = int(os.environ.get("AGENT_PROMPT_TOKEN_BUDGET", "48000") or 48000)
+PROMPT_MIN_SECTION_TOKENS = 64
+TOKENIZER_ENCODING = os.environ.get("AGENT_TOKENIZER_ENCODING", "o200k_base")
+SCHEMA_INDEX_VERSION = 1
+SCHEMA_QUERY_HINTS = {
+    "pm": "schema tables entities relationships requirements",
+    "doc": "schema tables relationships compatibility rules api endpoints",
+    "data": "create table columns primary key foreign key index constraint migration seed mysql",
+}
+SEARCH_TERM_RE = re.compile(r"[a-z0-9_]+")
+SEARCH_STOPWORDS = frozenset(
+    "a an and are as at be but by can do for from has have how i if in into is it its "
+    "me my no not of on or so that the then there these this to was we what when which "
+    "will with you your".split()
+)
+
+PM_DOCS = ["VISION.md", "ROADMAP.md", "SCOPE_GUARDRAILS.md", "RISKS.md", "GLOSSARY.md"]
+DOC_DOCS = [
+    "VISION.md",
+    "ROADMAP.md",
+    "SCOPE_GUARDRAILS.md",
+    "RISKS.md",
+    "GLOSSARY.md",
+    "DATA_MODEL.md",
+    "RULES_ENGINE.md",
+    "API.md",
+    "REALTIME.md",
+    "UI_UX.md",
+    "DOMAIN_ROTARY.md",
+    "INGESTION.md",
+    "MONETIZATION.md",
+    "RUNBOOK.md",
+]
+DOMAIN_DOCS = ["DOMAIN_ROTARY.md", "WARNINGS.md", "GLOSSARY.md", "SCOPE_GUARDRAILS.md"]
+DATA_DOCS = ["DATA_MODEL.md", "RULES_ENGINE.md", "DOMAIN_ROTARY.md", "SCOPE_GUARDRAILS.md"]
+DESIGNER_DOCS = ["VISION.md", "UI_UX.md", "REALTIME.md", "SCOPE_GUARDRAILS.md"]
+FRONTEND_DOCS = ["UI_UX.md", "API.md", "REALTIME.md", "GLOSSARY.md"]
+BACKEND_DOCS = ["API.md", "DATA_MODEL.md", "RULES_ENGINE.md", "REALTIME.md", "DOMAIN_ROTARY.md"]
+TESTER_DOCS = ["RUNBOOK.md", "API.md", "REALTIME.md", "UI_UX.md"]
+# The role names the PM prompt and the agents themselves use. AGENT_TASKS.md
+# headings match one as whole words ("## Designer (UI/UX)"); a TEST.md owner
+# tag must consist of them ("[Backend]", "[Owner: Frontend, Tester]").
+ROLE_ALIASES = {
+    "doc": ("doc curator", "documentation curator"),
+    "domain": ("domain expert",),
+    "data": ("data modeler",),
+    "designer": ("designer",),
+    "frontend": ("frontend", "frontend developer"),
+    "backend": ("backend", "backend developer"),
+    "tester": ("tester",),
+}
+ROLE_NAMES = {alias: role for role, aliases in ROLE_ALIASES.items() for alias in aliases}
+MARKDOWN_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+OWNER_TAG_RE = re.compile(r"\[(?:owners?\s*:\s*)?([^\]\n]+)\](?!\()", re.IGNORECASE)
+OWNER_TAG_SPLIT_RE = re.compile(r"\s*(?:,|/|&|\band\b)\s*")
+MARKDOWN_LIST_ITEM_RE = re.compile(r"^(?:[-*+]|\d+[.)])\s+")
+
+
+class _ProjectLogFilter(logging.Filter):
+    # Tags each record with the batch project it came from (empty outside
+    # batch mode) for the %(project)s field of the log format.
+    def filter(self, record: logging.LogRecord) -> bool:
+        label = _PROJECT_LABEL.get()
+        record.project = f"[{label}] " if label else ""
+        return True
 
 
 class _SuppressMcpValidationWarnings(logging.Filter):
@@ -48,17 +246,19 @@ def _setup_logging() -> str:
 
     logger.setLevel(logging.DEBUG)
     formatter = logging.Formatter(
-        "%(asctime)s %(levelname)s %(name)s %(message)s",
+        "%(asctime)s %(levelname)s %(name)s %(project)s%(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.DEBUG)
     console_handler.setFormatter(formatter)
+    console_handler.addFilter(_ProjectLogFilter())
 
     file_handler = logging.FileHandler(log_file)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
+    file_handler.addFilter(_ProjectLogFilter())
 
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
@@ -90,13 +290,610 @@ def _build_reasoning_settings() -> Reasoning:
     return Reasoning()
 
 
-def _build_run_config() -> RunConfig:
+class _FakeModel(Model):
+    # Deterministic stand-in for the Responses API, used to measure the
+    # orchestration without network or spend. Every request is answered
+    # with one "### FILE:" block per path named in the agent instructions,
+    # padded to FAKE_MODEL_OUTPUT_KB in total, after FAKE_MODEL_LATENCY_MS.
+    # Token usage is derived from text sizes so accounting, caching and
+    # tracing behave as they do against the real model.
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def _respond(self, system_instructions: str | None, input_items) -> tuple[str, ResponseUsage]:
+        instructions = system_instructions or ""
+        paths = list(dict.fromkeys(re.findall(r"^### FILE:\s*(\S+)\s*$", instructions, re.MULTILINE)))
+        paths = paths or ["fake/output.md"]
+        digest = hashlib.sha256(instructions.encode("utf-8")).hexdigest()
+        per_file = int(FAKE_MODEL_OUTPUT_KB * 1024) // len(paths)
+        blocks = []
+        for path in paths:
+            lines = [f"# {path}"]
+            size = len(lines[0])
+            while size < per_file:
+                lines.append(f"- {path} item {len(lines)}: {digest[len(lines) % 48:][:16]}")
+                size += len(lines[-1]) + 1
+            blocks.append(f"### FILE: {path}\n" + "\n".join(lines) + "\n")
+        text = "".join(blocks)
+        input_tokens = _request_tokens(instructions, input_items)
+        output_tokens = _estimate_tokens(text)
+        usage = ResponseUsage.model_validate(
+            {
+                "input_tokens": input_tokens,
+                "input_tokens_details": {
+                    "cached_tokens": int(input_tokens * FAKE_MODEL_CACHED_RATIO),
+                    "cache_write_tokens": 0,
+                },
+                "output_tokens": output_tokens,
+                "output_tokens_details": {"reasoning_tokens": 0},
+                "total_tokens": input_tokens + output_tokens,
+            }
+        )
+        return text, usage
+
+    def _response(self, response_id: str, text: str | None, usage: ResponseUsage | None) -> Response:
+        output = []
+        if text is not None:
+            output.append(
+                ResponseOutputMessage.model_validate(
+                    {
+                        "id": f"msg_{response_id}",
+                        "type": "message",
+                        "role": "assistant",
+                        "status": "completed",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}],
+                    }
+                )
+            )
+        return Response.model_validate(
+            {
+                "id": response_id,
+                "object": "response",
+                "created_at": time.time(),
+                "model": self.name,
+                "status": "completed" if text is not None else "in_progress",
+                "output": output,
+                "parallel_tool_calls": False,
+                "tool_choice": "auto",
+                "tools": [],
+                "usage": usage,
+            }
+        )
+
+    async def get_response(
+        self,
+        system_instructions,
+        input,
+        model_settings,
+        tools,
+        output_schema,
+        handoffs,
+        tracing,
+        **kwargs,
+    ) -> ModelResponse:
+        text, usage = self._respond(system_instructions, input)
+        await asyncio.sleep(FAKE_MODEL_LATENCY_MS / 1000)
+        response_id = f"fake_{uuid.uuid4().hex[:12]}"
+        return ModelResponse(
+            output=self._response(response_id, text, usage).output,
+            usage=Usage(
+                requests=1,
+                input_tokens=usage.input_tokens,
+                input_tokens_details=usage.input_tokens_details,
+                output_tokens=usage.output_tokens,
+                output_tokens_details=usage.output_tokens_details,
+                total_tokens=usage.total_tokens,
+            ),
+            response_id=response_id,
+        )
+
+    async def stream_response(
+        self,
+        system_instructions,
+        input,
+        model_settings,
+        tools,
+        output_schema,
+        handoffs,
+        tracing,
+        **kwargs,
+    ):
+        text, usage = self._respond(system_instructions, input)
+        response_id = f"fake_{uuid.uuid4().hex[:12]}"
+        yield ResponseCreatedEvent(
+            type="response.created", response=self._response(response_id, None, None), sequence_number=0
+        )
+        await asyncio.sleep(FAKE_MODEL_LATENCY_MS / 1000)
+        sequence = 1
+        for start in range(0, len(text), FAKE_MODEL_CHUNK_CHARS):
+            yield ResponseTextDeltaEvent(
+                type="response.output_text.delta",
+                item_id=f"msg_{response_id}",
+                output_index=0,
+                content_index=0,
+                delta=text[start : start + FAKE_MODEL_CHUNK_CHARS],
+                logprobs=[],
+                sequence_number=sequence,
+            )
+            sequence += 1
+            await asyncio.sleep(0)
+        yield ResponseCompletedEvent(
+            type="response.completed",
+            response=self._response(response_id, text, usage),
+            sequence_number=sequence,
+        )
+
+
+class _FakeModelProvider(ModelProvider):
+    def get_model(self, model_name: str | None) -> Model:
+        return _FakeModel(model_name or MODEL_NAME)
+
+
+class _TokenBucket:
+    # Refills continuously to `capacity` once a minute. A capacity of 0 means
+    # the limit is not known (yet) and nothing is held back.
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # A request larger than the whole bucket waits for a full one.
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount: float) -> None:
+        self._refill(time.monotonic())
+        self.level -= amount
+
+    def observe(self, limit: int | None, remaining: int | None) -> None:
+        # The server's count wins over ours: it includes other clients on the
+        # same key and requests we only estimated.
+        if limit:
+            self.capacity = limit
+        if remaining is not None and self.capacity:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, remaining)
+
+
+class _RateLimiter:
+    # Client-side view of the API quota, shared by every model request in the
+    # process: requests- and tokens-per-minute buckets (seeded from
+    # AGENT_RPM_LIMIT / AGENT_TPM_LIMIT, corrected by the x-ratelimit-*
+    # headers of every response) and a pause until the server's retry-after
+    # once it throttles us.
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.requests = _TokenBucket(rpm)
+        self.tokens = _TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.waited = 0.0
+
+    async def wait(self, tokens: int) -> None:
+        started = time.monotonic()
+        now = started
+        span = None
+        while True:
+            delay = max(
+                self.paused_until - now, self.requests.delay(1, now), self.tokens.delay(tokens, now)
+            )
+            if delay <= 0:
+                break
+            if span is None:
+                span = _trace_start("rate_limit", "scheduler", tokens=tokens)
+            await asyncio.sleep(delay)
+            now = time.monotonic()
+        _trace_end(span)
+        self.waited += now - started
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def settle(self, estimate: int, tokens: int) -> None:
+        self.tokens.take(tokens - estimate)
+
+    def observe(self, status: int, headers) -> None:
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            bucket.observe(
+                _header_int(headers, f"x-ratelimit-limit-{kind}"),
+                _header_int(headers, f"x-ratelimit-remaining-{kind}"),
+            )
+        if status == 429:
+            pause = _retry_after(headers)
+            if pause is None:
+                resets = [
+                    _duration_seconds(headers.get(f"x-ratelimit-reset-{kind}")) for kind in ("requests", "tokens")
+                ]
+                pause = max([reset for reset in resets if reset is not None], default=1.0)
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+
+def _header_int(headers, name: str) -> int | None:
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _duration_seconds(value: str | None) -> float | None:
+    # x-ratelimit-reset-* values look like "20ms", "1s" or "6m0s".
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = RATE_LIMIT_DURATION_RE.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def _retry_after(headers) -> float | None:
+    for name, divisor in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return max(0.0, float(headers.get(name)) / divisor)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def _throttled(error: BaseException | None) -> bool:
+    return isinstance(error, APIStatusError) and error.status_code in (429, 503)
+
+
+def _retry_delay(error: BaseException, attempt: int) -> float | None:
+    # Full-jitter exponential backoff for throttling, transient server errors
+    # and dropped connections; None when the error is final or retries ran
+    # out. An exhausted quota (as opposed to a rate limit) never clears by
+    # waiting.
+    if attempt >= MODEL_RETRY_ATTEMPTS:
+        return None
+    if isinstance(error, APIStatusError):
+        if error.status_code not in (408, 409, 429) and error.status_code < 500:
+            return None
+        if getattr(error, "code", None) == "insufficient_quota":
+            return None
+    elif not isinstance(error, APIConnectionError):
+        return None
+    return random.uniform(0, min(MODEL_RETRY_MAX_SECONDS, MODEL_RETRY_BASE_SECONDS * 2**attempt))
+
+
+class _BudgetExceeded(RuntimeError):
+    pass
+
+
+@dataclass
+class _SchedulerFlow:
+    # One project's share of the model-call slots, or (as _ModelScheduler.total)
+    # all of them together. Spend is what completed requests reported; the
+    # reserved_* fields hold the estimates of requests still in flight.
+    label: str
+    priority: str
+    token_budget: int = 0
+    cost_budget: float = 0.0
+    finish: float = 0.0
+    calls: int = 0
+    tokens: int = 0
+    cost: float = 0.0
+    reserved_tokens: int = 0
+    reserved_cost: float = 0.0
+    waits: list[float] = field(default_factory=list)
+
+    @property
+    def weight(self) -> int:
+        return MODEL_PRIORITY_WEIGHTS[self.priority]
+
+
+class _ModelScheduler:
+    # Admits every model request in the process. Each project is a flow
+    # weighted by its priority class, and queued requests get slots in order
+    # of their virtual finish time (start-time fair queueing over `slots`
+    # servers, a request costing its estimated input tokens). A 17-file
+    # curator prompt from a batch project therefore queues behind the small
+    # turns of an interactive one instead of holding them up, while an idle
+    # interactive project leaves every slot to the batch ones. Budgets are
+    # checked as a request is granted, against completed spend plus what is
+    # still in flight.
+    #
+    # The number of slots is an AIMD window under max_slots: it grows by one
+    # per window's worth of completed requests and halves when the API
+    # throttles us, so throughput backs off under quota pressure instead of
+    # every request failing.
+    def __init__(
+        self,
+        slots: int,
+        prices: dict[str, dict[str, float]],
+        token_budget: int = 0,
+        cost_budget: float = 0.0,
+    ) -> None:
+        self.max_slots = max(1, slots)
+        self.window = float(self.max_slots)
+        self.min_window = self.window
+        self.throttled = 0
+        self.retries = 0
+        self.limits = _RateLimiter(MODEL_RPM_LIMIT, MODEL_TPM_LIMIT)
+        self.prices = prices
+        self.total = _SchedulerFlow("all projects", "normal", token_budget, cost_budget)
+        self.in_flight = 0
+        self.max_depth = 0
+        self._flows: dict[str, _SchedulerFlow] = {}
+        self._queue: list[tuple] = []
+        self._seq = 0
+        self._virtual = 0.0
+        self._decreased_at = 0.0
+
+    @property
+    def slots(self) -> int:
+        return max(1, int(self.window))
+
+    def register(self, priority: str, token_budget: int = 0, cost_budget: float = 0.0) -> None:
+        root = _project_root()
+        label = _PROJECT_LABEL.get() or os.path.basename(root) or root
+        self._flows[root] = _SchedulerFlow(label, priority, token_budget, cost_budget)
+
+    def _flow(self) -> _SchedulerFlow:
+        root = _project_root()
+        if root not in self._flows:
+            self.register(MODEL_PRIORITY)
+        return self._flows[root]
+
+    async def acquire(self, model: str, estimate: int) -> tuple[_SchedulerFlow, tuple, float]:
+        # Returns the ticket to hand back to release().
+        flow = self._flow()
+        start = max(self._virtual, flow.finish)
+        finish = start + estimate / flow.weight
+        request = (model, estimate, _model_cost(self.prices, model, estimate, 0, 0) or 0.0)
+        queued = time.monotonic()
+        if not self._queue and self.in_flight < self.slots:
+            self._admit(flow, start, request)
+            flow.finish = finish
+        else:
+            # Later requests of this flow queue behind this one; the advance
+            # is handed back if it is never granted.
+            flow.finish = finish
+            future = asyncio.get_running_loop().create_future()
+            self._seq += 1
+            heapq.heappush(self._queue, (finish, self._seq, start, flow, request, future))
+            self.max_depth = max(self.max_depth, len(self._queue))
+            try:
+                with _span("model_slot", "scheduler", priority=flow.priority, depth=len(self._queue)):
+                    await future
+            except asyncio.CancelledError:
+                # Granted just before the cancellation landed: the slot is ours
+                # to hand back.
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    self.release((flow, request, time.monotonic()), None)
+                elif future.cancelled():
+                    flow.finish -= estimate / flow.weight
+                raise
+        wait = time.monotonic() - queued
+        flow.waits.append(wait)
+        _EVENTS.emit(
+            "model_slot",
+            None,
+            {
+                "priority": flow.priority,
+                "waitMs": round(wait * 1000, 1),
+                "queueDepth": len(self._queue),
+                "inFlight": self.in_flight,
+                "estimatedTokens": estimate,
+            },
+        )
+        return flow, request, time.monotonic()
+
+    def release(
+        self, ticket: tuple[_SchedulerFlow, tuple, float], usage, error: BaseException | None = None
+    ) -> None:
+        flow, (model, estimate, cost), granted = ticket
+        self.in_flight -= 1
+        tokens = None
+        if usage is not None:
+            input_tokens = int(getattr(usage, "input_tokens", 0) or 0)
+            output_tokens = int(getattr(usage, "output_tokens", 0) or 0)
+            cached_tokens = int(getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0)
+            tokens = input_tokens + output_tokens
+            spent = _model_cost(self.prices, model, input_tokens, cached_tokens, output_tokens) or 0.0
+        for scope in (flow, self.total):
+            scope.reserved_tokens -= estimate
+            scope.reserved_cost -= cost
+            if tokens is not None:
+                scope.calls += 1
+                scope.tokens += tokens
+                scope.cost += spent
+        if tokens is not None:
+            self.limits.settle(estimate, tokens)
+            self.window = min(float(self.max_slots), self.window + 1 / self.window)
+        elif _throttled(error):
+            self.throttled += 1
+            # Halve once per throttling episode: requests granted before the
+            # last decrease were sent at the old window and say nothing new.
+            if granted >= self._decreased_at:
+                self.window = max(1.0, self.window / 2)
+                self.min_window = min(self.min_window, self.window)
+                self._decreased_at = time.monotonic()
+                logging.getLogger(__name__).warning(
+                    "Model API is throttling; model calls in flight reduced to %d of %d",
+                    self.slots,
+                    self.max_slots,
+                )
+        self._dispatch()
+
+    def _admit(self, flow: _SchedulerFlow, start: float, request: tuple) -> None:
+        _, estimate, cost = request
+        for scope in (flow, self.total):
+            used = scope.tokens + scope.reserved_tokens
+            if scope.token_budget and used + estimate > scope.token_budget:
+                raise _BudgetExceeded(
+                    f"Token budget for {scope.label} exhausted: {used} used or in flight, "
+                    f"~{estimate} more requested, budget {scope.token_budget}."
+                )
+            spent = scope.cost + scope.reserved_cost
+            if scope.cost_budget and spent + cost > scope.cost_budget:
+                raise _BudgetExceeded(
+                    f"Cost budget for {scope.label} exhausted: ${spent:.4f} used or in flight, "
+                    f"~${cost:.4f} more requested, budget ${scope.cost_budget:.2f}."
+                )
+        for scope in (flow, self.total):
+            scope.reserved_tokens += estimate
+            scope.reserved_cost += cost
+        self._virtual = max(self._virtual, start)
+        self.in_flight += 1
+
+    def _dispatch(self) -> None:
+        while self._queue and self.in_flight < self.slots:
+            _, _, start, flow, request, future = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            try:
+                self._admit(flow, start, request)
+            except _BudgetExceeded as exc:
+                flow.finish -= request[1] / flow.weight
+                future.set_exception(exc)
+            else:
+                future.set_result(None)
+
+    def report(self) -> list[dict]:
+        rows = []
+        for flow in self._flows.values():
+            waits = sorted(flow.waits)
+            rows.append(
+                {
+                    "project": flow.label,
+                    "priority": flow.priority,
+                    "calls": flow.calls,
+                    "tokens": flow.tokens,
+                    "cost_usd": round(flow.cost, 6),
+                    "wait_p50_ms": round(waits[(len(waits) - 1) // 2] * 1000, 1) if waits else 0.0,
+                    "wait_p95_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1) if waits else 0.0,
+                    "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+                }
+            )
+        return rows
+
+
+class _ScheduledModel(Model):
+    # Holds a scheduler slot for exactly as long as one request is in flight,
+    # so tool calls and file writes between turns do not count against it.
+    # Throttled and transient failures give the slot back, back off and queue
+    # again; a stream is only retried before its first event, since the
+    # runner has already consumed anything after that.
+    def __init__(self, model: Model, model_name: str, scheduler: _ModelScheduler) -> None:
+        self._model = model
+        self._model_name = model_name
+        self._scheduler = scheduler
+
+    async def _backoff(self, error: Exception, attempt: int) -> None:
+        delay = _retry_delay(error, attempt)
+        if delay is None:
+            raise error
+        self._scheduler.retries += 1
+        logging.getLogger(__name__).warning(
+            "Model call failed (%s); retry %d/%d in %.1fs",
+            error,
+            attempt + 1,
+            MODEL_RETRY_ATTEMPTS,
+            delay,
+        )
+        with _span("retry_backoff", "scheduler", attempt=attempt + 1):
+            await asyncio.sleep(delay)
+
+    async def get_response(self, system_instructions, input, *args, **kwargs) -> ModelResponse:
+        estimate = _request_tokens(system_instructions, input)
+        attempt = 0
+        while True:
+            ticket = await self._scheduler.acquire(self._model_name, estimate)
+            usage, error = None, None
+            try:
+                await self._scheduler.limits.wait(estimate)
+                response = await self._model.get_response(system_instructions, input, *args, **kwargs)
+                usage = response.usage
+                return response
+            except Exception as exc:
+                error = exc
+            finally:
+                self._scheduler.release(ticket, usage, error)
+            await self._backoff(error, attempt)
+            attempt += 1
+
+    async def stream_response(self, system_instructions, input, *args, **kwargs):
+        estimate = _request_tokens(system_instructions, input)
+        attempt = 0
+        while True:
+            ticket = await self._scheduler.acquire(self._model_name, estimate)
+            usage, error, started = None, None, False
+            try:
+                await self._scheduler.limits.wait(estimate)
+                async for event in self._model.stream_response(system_instructions, input, *args, **kwargs):
+                    started = True
+                    if event.type == "response.completed":
+                        usage = event.response.usage
+                    yield event
+                return
+            except Exception as exc:
+                error = exc
+                if started:
+                    raise
+            finally:
+                self._scheduler.release(ticket, usage, error)
+            await self._backoff(error, attempt)
+            attempt += 1
+
+
+class _ScheduledModelProvider(ModelProvider):
+    def __init__(self, provider: ModelProvider, scheduler: _ModelScheduler) -> None:
+        self._provider = provider
+        self._scheduler = scheduler
+
+    def get_model(self, model_name: str | None) -> Model:
+        return _ScheduledModel(self._provider.get_model(model_name), model_name or MODEL_NAME, self._scheduler)
+
+    async def aclose(self) -> None:
+        await self._provider.aclose()
+
+
+def _request_tokens(system_instructions: str | None, input_items) -> int:
+    input_text = input_items if isinstance(input_items, str) else json.dumps(input_items, default=str)
+    return _estimate_tokens(system_instructions or "") + _estimate_tokens(input_text)
+
+
+def _openai_client(limits: _RateLimiter) -> AsyncOpenAI:
+    # Retries are ours (_ScheduledModel) so throttling reaches the scheduler;
+    # the response hook feeds every status and x-ratelimit-* header, error or
+    # not, to the shared limiter.
+    async def observe(response) -> None:
+        limits.observe(response.status_code, response.headers)
+
+    return AsyncOpenAI(max_retries=0, http_client=DefaultAsyncHttpxClient(event_hooks={"response": [observe]}))
+
+
+def _build_run_config(fake_model: bool = False, scheduler: _ModelScheduler | None = None) -> RunConfig:
     model_settings = ModelSettings(reasoning=_build_reasoning_settings())
+    provider: ModelProvider
+    if fake_model:
+        provider = _FakeModelProvider()
+    elif scheduler is not None and os.environ.get("OPENAI_API_KEY"):
+        provider = MultiProvider(openai_client=_openai_client(scheduler.limits))
+    else:
+        # Without a key the default client fails on first use, as it always has.
+        provider = MultiProvider()
+    if scheduler is not None:
+        provider = _ScheduledModelProvider(provider, scheduler)
     return RunConfig(
         model=MODEL_NAME,
+        model_provider=provider,
         model_settings=model_settings,
         handoff_input_filter=_grouped_handoff_filter,
         nest_handoff_history=False,
+        # Nothing to export traces to with the fake: it never leaves the process.
+        tracing_disabled=fake_model,
     )
 
 
@@ -106,9 +903,9 @@ def _grouped_handoff_filter(handoff_input_data: HandoffInputData) -> HandoffInpu
     filtered_history = input_history
     removed_history = 0
     if not isinstance(input_history, str):
-        filtered_history, removed_history = _filter_input_item_sequence(list(input_history))
+        filtered_history, removed_history = _pair_tool_items(input_history)
 
-    grouped_items, removed_items = _group_tool_items(handoff_input_data.new_items)
+    grouped_items, removed_items = _pair_tool_items(handoff_input_data.new_items)
     removed_total = removed_history + removed_items
     if removed_total:
         logger.warning(
@@ -124,162 +921,74 @@ def _grouped_handoff_filter(handoff_input_data: HandoffInputData) -> HandoffInpu
     )
 
 
-def _extract_call_id(item: object) -> str | None:
-    if isinstance(item, dict):
-        return item.get("call_id") or item.get("tool_call_id")
-    if isinstance(item, (ToolCallItem, ToolCallOutputItem, HandoffCallItem, HandoffOutputItem)):
-        try:
-            input_item = item.to_input_item()
-        except Exception:
-            return None
-        if isinstance(input_item, dict):
-            return input_item.get("call_id") or input_item.get("tool_call_id")
-    return None
-
-
-def _call_ids_match(call_item: object, output_item: object) -> bool:
-    call_id = _extract_call_id(call_item)
-    if not call_id:
-        return False
-    return call_id == _extract_call_id(output_item)
-
-
-def _filter_input_item_sequence(items: list[dict]) -> tuple[tuple[dict, ...], int]:
-    call_types = {"function_call", "tool_call"}
-    output_types = {"function_call_output", "tool_call_output"}
-    filtered: list[dict] = []
-    removed = 0
-    index = 0
-    while index < len(items):
-        item = items[index]
-        item_type = item.get("type")
-        if item_type == "reasoning":
-            if (
-                index + 2 < len(items)
-                and items[index + 1].get("type") in call_types
-                and items[index + 2].get("type") in output_types
-                and _call_ids_match(items[index + 1], items[index + 2])
-            ):
-                filtered.extend([item, items[index + 1], items[index + 2]])
-                index += 3
-                continue
-            removed += 1
-            index += 1
-            continue
-        if item_type in call_types:
-            if (
-                index + 1 < len(items)
-                and items[index + 1].get("type") in output_types
-                and _call_ids_match(item, items[index + 1])
-            ):
-                filtered.extend([item, items[index + 1]])
-                index += 2
-                continue
-            removed += 1
-            index += 1
-            continue
-        if item_type in output_types:
-            removed += 1
-            index += 1
-            continue
-        filtered.append(item)
-        index += 1
-    return tuple(filtered), removed
-
-
-def _group_tool_items(items: tuple[RunItem, ...]) -> tuple[tuple[RunItem, ...], int]:
-    logger = logging.getLogger(__name__)
-    call_types = (ToolCallItem, HandoffCallItem)
-    output_types = (ToolCallOutputItem, HandoffOutputItem)
-    grouped: list[RunItem] = []
-    removed = 0
-    grouped_pairs = 0
-    kept_singles = 0
-    index = 0
-    while index < len(items):
-        item = items[index]
+TOOL_CALL_TYPES = {"function_call", "tool_call"}
+TOOL_OUTPUT_TYPES = {"function_call_output", "tool_call_output"}
+RUN_ITEM_ROLES = {
+    ReasoningItem: "reasoning",
+    ToolCallItem: "call",
+    HandoffCallItem: "call",
+    ToolCallOutputItem: "output",
+    HandoffOutputItem: "output",
+}
+
+
+def _run_item_role(item: object) -> tuple[str, str | None]:
+    # Run items are classified by exact type (isinstance on them goes through
+    # ABC checks) and read from raw_item directly rather than converted with
+    # to_input_item().
+    role = RUN_ITEM_ROLES.get(type(item))
+    if role is None:
+        role = next((role for cls, role in RUN_ITEM_ROLES.items() if isinstance(item, cls)), "other")
+    if role in {"reasoning", "other"}:
+        return role, None
+    raw_item = item.raw_item
+    return role, _item_field(raw_item, "call_id") or _item_field(raw_item, "tool_call_id")
+
+
+def _pair_tool_items(items) -> tuple[tuple, int]:
+    # Works on input dicts and SDK run items alike. Keeps a tool call only if
+    # an output with the same call id follows it anywhere later, and the first
+    # such output only if its call came earlier, so parallel calls with
+    # interleaved outputs survive. A reasoning item is kept only when the item
+    # right after it is a kept call. Order is preserved; returns the kept
+    # items and the number removed. Call ids are extracted once per item.
+    roles: list[str] = []
+    call_at: dict[str, int] = {}
+    output_at: dict[str, int] = {}
+    for index, item in enumerate(items):
         if isinstance(item, dict):
             item_type = item.get("type")
-            if item_type == "reasoning":
-                if (
-                    index + 2 < len(items)
-                    and isinstance(items[index + 1], dict)
-                    and items[index + 1].get("type") in {"function_call", "tool_call"}
-                    and isinstance(items[index + 2], dict)
-                    and items[index + 2].get("type") in {"function_call_output", "tool_call_output"}
-                    and _call_ids_match(items[index + 1], items[index + 2])
-                ):
-                    grouped.extend([item, items[index + 1], items[index + 2]])
-                    grouped_pairs += 1
-                    index += 3
-                    continue
-                removed += 1
-                index += 1
-                continue
-            if item_type in {"function_call", "tool_call"}:
-                if index + 1 < len(items):
-                    next_item = items[index + 1]
-                    if isinstance(next_item, dict) and next_item.get("type") in {
-                        "function_call_output",
-                        "tool_call_output",
-                    } and _call_ids_match(item, next_item):
-                        grouped.extend([item, next_item])
-                        grouped_pairs += 1
-                        index += 2
-                        continue
-                removed += 1
-                index += 1
-                continue
-            if item_type in {"function_call_output", "tool_call_output"}:
-                removed += 1
-                index += 1
-                continue
-            grouped.append(item)
-            kept_singles += 1
-            index += 1
-            continue
-        if isinstance(item, ReasoningItem):
-            if (
-                index + 2 < len(items)
-                and isinstance(items[index + 1], call_types)
-                and isinstance(items[index + 2], output_types)
-                and _call_ids_match(items[index + 1], items[index + 2])
-            ):
-                grouped.extend([item, items[index + 1], items[index + 2]])
-                grouped_pairs += 1
-                index += 3
-                continue
-            removed += 1
-            index += 1
-            continue
-        if isinstance(item, call_types):
-            if (
-                index + 1 < len(items)
-                and isinstance(items[index + 1], output_types)
-                and _call_ids_match(item, items[index + 1])
-            ):
-                grouped.extend([item, items[index + 1]])
-                grouped_pairs += 1
-                index += 2
-                continue
-            removed += 1
-            index += 1
-            continue
-        if isinstance(item, output_types):
-            removed += 1
-            index += 1
-            continue
-        grouped.append(item)
-        kept_singles += 1
-        index += 1
-    if grouped_pairs or kept_singles or removed:
-        logger.debug(
-            "Grouped tool items: pairs=%s kept=%s removed=%s",
-            grouped_pairs,
-            kept_singles,
-            removed,
-        )
-    return tuple(grouped), removed
+            if item_type in TOOL_CALL_TYPES:
+                role = "call"
+            elif item_type in TOOL_OUTPUT_TYPES:
+                role = "output"
+            else:
+                role = "reasoning" if item_type == "reasoning" else "other"
+            call_id = item.get("call_id") or item.get("tool_call_id") if role in {"call", "output"} else None
+        else:
+            role, call_id = _run_item_role(item)
+        roles.append(role)
+        if call_id:
+            if role == "call":
+                call_at.setdefault(call_id, index)
+            elif role == "output" and call_id in call_at:
+                output_at.setdefault(call_id, index)
+
+    kept_calls = {index for call_id, index in call_at.items() if call_id in output_at}
+    kept_outputs = set(output_at.values())
+    kept = tuple(
+        item
+        for index, (item, role) in enumerate(zip(items, roles))
+        if role == "other"
+        or index in kept_calls
+        or index in kept_outputs
+        or (role == "reasoning" and index + 1 in kept_calls)
+    )
+    removed = len(roles) - len(kept)
+    logging.getLogger(__name__).debug(
+        "Paired tool items: pairs=%s kept=%s removed=%s", len(output_at), len(kept), removed
+    )
+    return kept, removed
 
 
 def _permissions_instructions() -> str:
@@ -292,8 +1001,20 @@ def _permissions_instructions() -> str:
     )
 
 
+# The project a run works on. Every project-relative path goes through
+# _project_root() instead of the process cwd, so one process can run several
+# projects at once; each batch task sets its own value. The label is only set
+# in batch mode and tags log lines and dashboard events.
+_PROJECT_ROOT: contextvars.ContextVar[str | None] = contextvars.ContextVar("project_root", default=None)
+_PROJECT_LABEL: contextvars.ContextVar[str | None] = contextvars.ContextVar("project_label", default=None)
+
+
+def _project_root() -> str:
+    return _PROJECT_ROOT.get() or os.getcwd()
+
+
 def _environment_context() -> str:
-    cwd = os.getcwd()
+    cwd = _project_root()
     shell = os.environ.get("SHELL", "bash")
     return f"<environment_context>\n  <cwd>{cwd}</cwd>\n  <shell>{shell}</shell>\n</environment_context>"
 
@@ -323,25 +1044,170 @@ def _user_message(text: str) -> list[dict]:
     ]
 
 
-def _parse_files_from_output(text: str) -> dict[str, str]:
-    files: dict[str, str] = {}
-    current_path: str | None = None
-    buffer: list[str] = []
+@dataclass
+class _PromptSection:
+    name: str
+    title: str | None
+    body: str
+    # Sections are shrunk lowest priority first until the payload fits.
+    priority: int
+    shrink: Callable[[str, int], str]
+
+    def block(self, body: str) -> str:
+        return f"{self.title}:\n{body}" if self.title else body
+
+
+class _PromptLayout:
+    # Providers cache prompts by exact prefix, so a stage payload is laid out
+    # from most to least stable: sections that only change with the brief
+    # (task list, REQUIREMENTS/AGENT_TASKS, schema excerpts), then files that
+    # earlier stages regenerate, and last the memory block, which changes on
+    # every run.
+    #
+    # render() keeps the payload within the role's token budget. Sections are
+    # shrunk in priority order, and among equal priorities from the end of the
+    # layout backwards so the shared prefix stays intact as long as possible.
+    # Shrinking is deterministic, so an over-budget payload is still the same
+    # bytes on every run and keeps its cache hits.
+    def __init__(self, agent_id: str) -> None:
+        self.agent_id = agent_id
+        self._static: list[_PromptSection] = []
+        self._semi_static: list[_PromptSection] = []
+
+    def static(
+        self,
+        title: str | None,
+        body: str,
+        priority: int = 2,
+        shrink: Callable[[str, int], str] | None = None,
+        name: str | None = None,
+    ) -> None:
+        self._static.append(_PromptSection(name or title or "", title, body, priority, shrink or _truncate_text))
+
+    def semi_static(
+        self,
+        title: str | None,
+        body: str,
+        priority: int = 1,
+        shrink: Callable[[str, int], str] | None = None,
+        name: str | None = None,
+    ) -> None:
+        self._semi_static.append(
+            _PromptSection(name or title or "", title, body, priority, shrink or _truncate_text)
+        )
 
-    for line in text.splitlines():
+    def text(self, title: str) -> str:
+        for section in self._static + self._semi_static:
+            if section.title == title:
+                return section.body
+        return ""
+
+    def render(self) -> str:
+        memory = _MEMORY.view(self.agent_id)
+        sections = self._static + self._semi_static
+        sections.append(
+            _PromptSection(
+                "Agent Memory",
+                f"Agent Memory ({MEMORY_DIR}/{self.agent_id}.md)",
+                memory or "<empty>",
+                1,
+                _truncate_text_tail,
+            )
+        )
+        budget = _PROMPT_BUDGETS.get(self.agent_id, PROMPT_TOKEN_BUDGET)
+        with _span("assemble_payload", "prompt", budget=budget) as span:
+            bodies = [section.body.strip() for section in sections]
+            costs = [_TOKENS.count(section.block(body)) if body else 0 for section, body in zip(sections, bodies)]
+            original = list(costs)
+            over = sum(costs) - budget
+            order = sorted(range(len(sections)), key=lambda index: (sections[index].priority, -index))
+            for index in order:
+                if over <= 0:
+                    break
+                if not bodies[index]:
+                    continue
+                section = sections[index]
+                header = costs[index] - _TOKENS.count(bodies[index])
+                bodies[index] = section.shrink(bodies[index], max(costs[index] - over - header, 0)).strip()
+                cost = _TOKENS.count(section.block(bodies[index])) if bodies[index] else 0
+                over -= costs[index] - cost
+                costs[index] = cost
+            text = "\n\n".join(section.block(body) for section, body in zip(sections, bodies) if body) + "\n"
+            total = _TOKENS.count(text)
+            shrunk = [index for index in range(len(sections)) if costs[index] != original[index]]
+            if span is not None:
+                span["attrs"].update(tokens=total, sections=len(sections), shrunk=len(shrunk))
+        breakdown = ", ".join(
+            f"{section.name}={original[index]}"
+            + (f"->{costs[index]}" if index in shrunk else "")
+            for index, section in enumerate(sections)
+            if original[index]
+        )
+        logger = logging.getLogger(__name__)
+        # Payloads are also built just to fingerprint stages, so only a
+        # payload that had to be shrunk is worth more than a debug line.
+        log = logger.warning if over > 0 else logger.info if shrunk else logger.debug
+        log(
+            "Payload %s: %d/%d tokens (%s)%s",
+            self.agent_id,
+            total,
+            budget,
+            breakdown,
+            " over budget after shrinking every section" if over > 0 else "",
+        )
+        return text
+
+
+class _FileStreamParser:
+    # Splits "### FILE:" blocks out of model text as it arrives. Only the file
+    # currently being received is buffered; each finished block is handed to
+    # on_file as soon as the next header (or the end of the stream) is seen.
+    def __init__(self, on_file: Callable[[str, str], None]) -> None:
+        self.on_file = on_file
+        self._partial = ""
+        self._path: str | None = None
+        self._lines: list[str] = []
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._line(line.rstrip("\r"))
+
+    def reset(self) -> None:
+        self._partial = ""
+        self._path = None
+        self._lines = []
+
+    def close(self) -> None:
+        if self._partial:
+            self._line(self._partial.rstrip("\r"))
+            self._partial = ""
+        self._flush()
+
+    def _line(self, line: str) -> None:
         match = FILE_HEADER_RE.match(line)
         if match:
-            if current_path is not None:
-                files[current_path] = "\n".join(buffer).rstrip() + "\n"
-            current_path = match.group(1)
-            buffer = []
-            continue
-        if current_path is not None:
-            buffer.append(line)
+            self._flush()
+            self._path = match.group(1)
+            return
+        if self._path is not None:
+            self._lines.append(line)
 
-    if current_path is not None:
-        files[current_path] = "\n".join(buffer).rstrip() + "\n"
+    def _flush(self) -> None:
+        if self._path is not None:
+            self.on_file(self._path, "\n".join(self._lines).rstrip() + "\n")
+        self._path = None
+        self._lines = []
 
+
+def _parse_files_from_output(text: str) -> dict[str, str]:
+    files: dict[str, str] = {}
+    parser = _FileStreamParser(files.__setitem__)
+    parser.feed(text)
+    parser.close()
     return files
 
 
@@ -354,72 +1220,699 @@ def _strip_markdown_fences(content: str) -> str:
     return content
 
 
-def _write_files(files: dict[str, str]) -> list[str]:
+class _Tracer:
+    # Collects timed spans for one run. Spans nest through _TRACE_SPAN, so
+    # tasks and tool calls started inside a span become its children. Each
+    # span carries a track (the stage it belongs to), which becomes a thread
+    # lane in the Chrome trace so parallel stages render side by side.
+    def __init__(self) -> None:
+        self.trace_id = uuid.uuid4().hex
+        self.spans: list[dict] = []
+
+    def start(self, name: str, category: str, parent: dict | None, track: str | None = None, **attrs) -> dict:
+        span = {
+            "id": uuid.uuid4().hex[:16],
+            "parent": parent["id"] if parent else None,
+            "name": name,
+            "category": category,
+            "track": track or (parent["track"] if parent else "runner"),
+            "start": time.time_ns(),
+            "end": None,
+            "attrs": attrs,
+            "error": None,
+        }
+        self.spans.append(span)
+        return span
+
+    def end(self, span: dict, error: str | None = None, **attrs) -> None:
+        if span["end"] is None:
+            span["end"] = time.time_ns()
+        span["error"] = span["error"] or error
+        span["attrs"].update(attrs)
+
+    def chrome_trace(self) -> dict:
+        tracks = {"runner": 0}
+        events: list[dict] = []
+        for span in self.spans:
+            tid = tracks.setdefault(span["track"], len(tracks))
+            end = span["end"] or time.time_ns()
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["category"],
+                    "ph": "X",
+                    "ts": span["start"] / 1000,
+                    "dur": (end - span["start"]) / 1000,
+                    "pid": 1,
+                    "tid": tid,
+                    "args": span["attrs"] | ({"error": span["error"]} if span["error"] else {}),
+                }
+            )
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": track}}
+            for track, tid in tracks.items()
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def otlp_trace(self) -> dict:
+        def value(item: object) -> dict:
+            if isinstance(item, bool):
+                return {"boolValue": item}
+            if isinstance(item, int):
+                return {"intValue": str(item)}
+            if isinstance(item, float):
+                return {"doubleValue": item}
+            return {"stringValue": str(item)}
+
+        spans = []
+        for span in self.spans:
+            attrs = span["attrs"] | {"workflow.category": span["category"], "workflow.stage": span["track"]}
+            spans.append(
+                {
+                    "traceId": self.trace_id,
+                    "spanId": span["id"],
+                    "parentSpanId": span["parent"] or "",
+                    "name": span["name"],
+                    "kind": 1,
+                    "startTimeUnixNano": str(span["start"]),
+                    "endTimeUnixNano": str(span["end"] or time.time_ns()),
+                    "attributes": [{"key": key, "value": value(item)} for key, item in attrs.items()],
+                    "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+                }
+            )
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [{"key": "service.name", "value": {"stringValue": "multi-agent-workflow"}}]
+                    },
+                    "scopeSpans": [{"scope": {"name": "multi_agent_workflow"}, "spans": spans}],
+                }
+            ]
+        }
+
+    def write(self, root: str, run_id: str) -> list[str]:
+        directory = os.path.join(root, CACHE_DIR, "traces")
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for suffix, payload in (("trace.json", self.chrome_trace()), ("otlp.json", self.otlp_trace())):
+            path = os.path.join(directory, f"{run_id}.{suffix}")
+            with open(path, "w", encoding="utf-8") as handle:
+                json.dump(payload, handle)
+            paths.append(path)
+        return paths
+
+
+# (tracer, innermost open span) for the running task; None when tracing is off.
+_TRACE_SPAN: contextvars.ContextVar[tuple[_Tracer, dict | None] | None] = contextvars.ContextVar(
+    "trace_span", default=None
+)
+
+
+@contextmanager
+def _span(name: str, category: str, track: str | None = None, **attrs):
+    current = _TRACE_SPAN.get()
+    if current is None:
+        yield None
+        return
+    tracer, parent = current
+    span = tracer.start(name, category, parent, track, **attrs)
+    token = _TRACE_SPAN.set((tracer, span))
+    try:
+        yield span
+    except BaseException as exc:
+        span["error"] = type(exc).__name__
+        raise
+    finally:
+        _TRACE_SPAN.reset(token)
+        tracer.end(span)
+
+
+def _trace_start(name: str, category: str, **attrs) -> tuple[_Tracer, dict] | None:
+    # For spans opened and closed by separate events (model turns, tool
+    # calls); they get the current span as parent but do not become current.
+    current = _TRACE_SPAN.get()
+    if current is None:
+        return None
+    tracer, parent = current
+    return tracer, tracer.start(name, category, parent, **attrs)
+
+
+def _trace_end(handle: tuple[_Tracer, dict] | None, **attrs) -> None:
+    if handle is not None:
+        handle[0].end(handle[1], **attrs)
+
+
+def _clean_rel_path(rel_path: str) -> str:
+    return rel_path.strip().lstrip("./")
+
+
+def _write_files(files: dict[str, str], root: str | None = None) -> list[str]:
     written: list[str] = []
-    for rel_path, content in files.items():
-        rel_path = rel_path.strip().lstrip("./")
-        if not rel_path:
-            continue
-        content = _strip_markdown_fences(content)
-        abs_path = os.path.join(os.getcwd(), rel_path)
-        parent = os.path.dirname(abs_path)
-        if parent:
-            os.makedirs(parent, exist_ok=True)
-        with open(abs_path, "w", encoding="utf-8") as handle:
-            handle.write(content)
-        written.append(rel_path)
+    with _span("write_files", "io", files=len(files), shadow=root is not None) as span:
+        for rel_path, content in files.items():
+            rel_path = _clean_rel_path(rel_path)
+            if not rel_path:
+                continue
+            content = _strip_markdown_fences(content)
+            abs_path = os.path.join(root or _project_root(), rel_path)
+            parent = os.path.dirname(abs_path)
+            if parent:
+                _DOCUMENTS.invalidate_dir(parent)
+                os.makedirs(parent, exist_ok=True)
+            with open(abs_path, "w", encoding="utf-8") as handle:
+                handle.write(content)
+            _DOCUMENTS.invalidate(abs_path)
+            written.append(rel_path)
+            if span is not None:
+                span["attrs"]["bytes"] = span["attrs"].get("bytes", 0) + len(content.encode("utf-8"))
     return written
 
 
+class _DocumentStore:
+    # Process-wide cache of the stripped text of files fed into prompts
+    # (docs, memory, task files). Entries are keyed by absolute path and
+    # checked against (mtime, size) on every read, so edits made outside the
+    # workflow are still seen; writes made by the workflow drop the entry
+    # explicitly, which also covers rewrites within one mtime tick. It also
+    # memoizes _find_repo_root, whose answer can only change when a
+    # directory is created.
+    def __init__(self) -> None:
+        self.hits = 0
+        self.reads = 0
+        self.repo_roots: dict[str, str | None] = {}
+        self._texts: dict[str, tuple[int, int, str]] = {}
+
+    def read(self, path: str) -> str:
+        abs_path = os.path.abspath(os.path.join(_project_root(), path))
+        stat = os.stat(abs_path)
+        cached = self._texts.get(abs_path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            self.hits += 1
+            return cached[2]
+        with open(abs_path, "r", encoding="utf-8") as handle:
+            text = handle.read().strip()
+        self._texts[abs_path] = (stat.st_mtime_ns, stat.st_size, text)
+        self.reads += 1
+        return text
+
+    def invalidate(self, path: str) -> None:
+        self._texts.pop(os.path.abspath(os.path.join(_project_root(), path)), None)
+
+    def invalidate_dir(self, directory: str) -> None:
+        # Called before a write that may create directory; a new docs/ or
+        # tasks/ directory can change which ancestor is the repo root.
+        if self.repo_roots and not os.path.isdir(directory):
+            self.repo_roots.clear()
+
+
+_DOCUMENTS = _DocumentStore()
+
+
 def _read_text(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as handle:
-        return handle.read().strip()
+    return _DOCUMENTS.read(path)
 
 
 def _write_text(path: str, content: str) -> None:
     parent = os.path.dirname(path)
     if parent:
+        _DOCUMENTS.invalidate_dir(parent)
         os.makedirs(parent, exist_ok=True)
     with open(path, "w", encoding="utf-8") as handle:
         handle.write(content)
+    _DOCUMENTS.invalidate(path)
 
 
 def _read_optional_text(path: str) -> str:
-    if not os.path.exists(path):
+    try:
+        return _DOCUMENTS.read(path)
+    except FileNotFoundError:
         return ""
-    return _read_text(path)
 
 
 def _ensure_memory_dir() -> None:
-    os.makedirs(os.path.join(os.getcwd(), MEMORY_DIR), exist_ok=True)
+    os.makedirs(os.path.join(_project_root(), MEMORY_DIR), exist_ok=True)
 
 
-def _memory_path(agent_id: str) -> str:
+def _memory_path(agent_id: str, suffix: str = ".md") -> str:
     safe_id = agent_id.replace(" ", "_").lower()
-    return os.path.join(os.getcwd(), MEMORY_DIR, f"{safe_id}.md")
-
+    return os.path.join(_project_root(), MEMORY_DIR, f"{safe_id}{suffix}")
 
-def _memory_block(agent_id: str) -> str:
-    content = _read_optional_text(_memory_path(agent_id))
-    if not content:
-        return f"Agent Memory ({MEMORY_DIR}/{agent_id}.md): <empty>\n"
-    return f"Agent Memory ({MEMORY_DIR}/{agent_id}.md):\n{content}\n"
 
+def _replace_file(path: str, content: str) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        handle.write(content)
+    os.replace(temp_path, path)
+    _DOCUMENTS.invalidate(path)
+
+
+class _MemoryStore:
+    # Agent memory lives in memory/<role>.jsonl (one entry per run) with
+    # memory/<role>.index.json holding the byte offset of every entry in the
+    # log and a compact summary of entries already folded out of it. Agents
+    # write only the new entry to memory/<role>.md; ingest() moves it into
+    # the log and rewrites the .md as the same bounded view the prompt gets:
+    # the summary plus the newest entries that fit the window. Once the log
+    # reaches MEMORY_COMPACT_ENTRIES, everything outside the window is folded
+    # into the summary and the log is rewritten, so the prompt and the files
+    # stay the same size however many runs there have been.
+    def view(self, agent_id: str) -> str:
+        index = self._index(agent_id)
+        entries = self._entries(agent_id, index, MEMORY_WINDOW_ENTRIES)
+        return self._render(index, self._window(entries))
+
+    def ingest(self, agent_id: str) -> None:
+        index = self._index(agent_id)
+        text = _read_optional_text(_memory_path(agent_id))
+        previous = self._render(index, self._window(self._entries(agent_id, index, MEMORY_WINDOW_ENTRIES)))
+        # Agents following older instructions echo the view back before their
+        # entry; only what follows it is new.
+        if previous and text.startswith(previous):
+            text = text[len(previous) :].strip()
+        last = self._entries(agent_id, index, 1)
+        if text and text != "<empty>" and not (last and last[-1]["text"] == text):
+            entry = {"ts": datetime.utcnow().strftime("%Y-%m-%d %H:%M"), "text": text}
+            log_path = _memory_path(agent_id, ".jsonl")
+            with open(log_path, "ab") as handle:
+                index["offsets"].append(handle.tell())
+                handle.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+            if len(index["offsets"]) >= MEMORY_COMPACT_ENTRIES:
+                self._compact(agent_id, index)
+            _replace_file(_memory_path(agent_id, ".index.json"), json.dumps(index))
+        view = self.view(agent_id)
+        if view != text:
+            _replace_file(_memory_path(agent_id), view + "\n")
+
+    def _index(self, agent_id: str) -> dict:
+        try:
+            with open(_memory_path(agent_id, ".index.json"), "r", encoding="utf-8") as handle:
+                index = json.load(handle)
+            if index.get("version") == MEMORY_INDEX_VERSION:
+                return index
+        except (OSError, ValueError):
+            pass
+        index = {"version": MEMORY_INDEX_VERSION, "offsets": [], "summary": [], "folded": 0}
+        log_path = _memory_path(agent_id, ".jsonl")
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as handle:
+                offset = 0
+                for line in handle:
+                    if line.strip():
+                        index["offsets"].append(offset)
+                    offset += len(line)
+        else:
+            # First use in a project written before memory was bounded: split
+            # the free-form .md at its dated headings into entries.
+            legacy = _read_optional_text(_memory_path(agent_id))
+            entries = self._split_legacy(legacy) if legacy and legacy != "<empty>" else []
+            if entries:
+                self._write_log(agent_id, index, entries)
+                if len(entries) >= MEMORY_COMPACT_ENTRIES:
+                    self._compact(agent_id, index)
+        if index["offsets"] or index["summary"]:
+            _replace_file(_memory_path(agent_id, ".index.json"), json.dumps(index))
+        return index
+
+    def _entries(self, agent_id: str, index: dict, last: int | None = None) -> list[dict]:
+        offsets = index["offsets"][-last:] if last else index["offsets"]
+        if not offsets:
+            return []
+        entries = []
+        with open(_memory_path(agent_id, ".jsonl"), "rb") as handle:
+            for offset in offsets:
+                handle.seek(offset)
+                entries.append(json.loads(handle.readline()))
+        return entries
+
+    @staticmethod
+    def _window(entries: list[dict]) -> list[dict]:
+        # Newest entries first until the window is full; the newest one is
+        # always shown, cut down if it alone exceeds the window.
+        window: list[dict] = []
+        used = 0
+        for entry in reversed(entries[-MEMORY_WINDOW_ENTRIES:]):
+            cost = _TOKENS.count(entry["text"])
+            if window and used + cost > MEMORY_WINDOW_TOKENS:
+                break
+            if not window and cost > MEMORY_WINDOW_TOKENS:
+                entry = entry | {"text": _truncate_text(entry["text"], MEMORY_WINDOW_TOKENS)}
+            window.insert(0, entry)
+            used += cost
+        return window
+
+    @staticmethod
+    def _render(index: dict, window: list[dict]) -> str:
+        blocks = []
+        if index["summary"]:
+            blocks.append(
+                f"Summary of {index['folded']} earlier entries (oldest first):\n" + "\n".join(index["summary"])
+            )
+        # Entries that open with their own heading (usually dated) keep it.
+        blocks += [
+            entry["text"] if entry["text"].startswith("#") else f"### {entry['ts']}\n{entry['text']}"
+            for entry in window
+        ]
+        return "\n\n".join(blocks)
+
+    def _compact(self, agent_id: str, index: dict) -> None:
+        entries = self._entries(agent_id, index)
+        window = self._window(entries)
+        folded = entries[: len(entries) - len(window)]
+        for entry in folded:
+            line = self._summary_line(entry)
+            if line and line not in index["summary"]:
+                index["summary"].append(line)
+        index["folded"] += len(folded)
+        while len(index["summary"]) > 1 and _TOKENS.count("\n".join(index["summary"])) > MEMORY_SUMMARY_TOKENS:
+            index["summary"].pop(0)
+        self._write_log(agent_id, index, entries[len(folded) :])
+
+    @staticmethod
+    def _write_log(agent_id: str, index: dict, entries: list[dict]) -> None:
+        lines = [(json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8") for entry in entries]
+        offsets = []
+        offset = 0
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line)
+        temp_path = _memory_path(agent_id, ".jsonl.tmp")
+        with open(temp_path, "wb") as handle:
+            handle.writelines(lines)
+        os.replace(temp_path, _memory_path(agent_id, ".jsonl"))
+        index["offsets"] = offsets
+
+    @staticmethod
+    def _summary_line(entry: dict) -> str:
+        # Extractive: the entry's first line of prose, which the prompts ask
+        # to be the run summary.
+        for line in entry["text"].splitlines():
+            line = line.strip().lstrip("-*> ").strip()
+            if line and not line.startswith("#"):
+                if len(line) > 200:
+                    line = line[:197].rstrip() + "..."
+                return f"- {entry['ts']}: {line}"
+        return ""
 
-def _read_schema_advice() -> str:
-    repo_root = _find_repo_root(os.getcwd())
+    @staticmethod
+    def _split_legacy(text: str) -> list[dict]:
+        entries: list[str] = []
+        current: list[str] = []
+        for line in text.splitlines():
+            if MEMORY_DATED_HEADING_RE.match(line) and any(part.strip() for part in current):
+                entries.append("\n".join(current).strip())
+                current = []
+            current.append(line)
+        if any(part.strip() for part in current):
+            entries.append("\n".join(current).strip())
+        result = []
+        for body in entries:
+            date = re.search(r"\d{4}-\d{2}-\d{2}", body.splitlines()[0])
+            result.append({"ts": date.group(0) if date else "legacy", "text": body})
+        return result
+
+
+_MEMORY = _MemoryStore()
+
+
+def _schema_advice_path() -> str | None:
+    repo_root = _find_repo_root(_project_root())
     candidates = []
     if repo_root:
-        candidates.append(os.path.join(repo_root, "database_schema_advice.txt"))
-    candidates.append(os.path.join(os.getcwd(), "database_schema_advice.txt"))
+        candidates.append(os.path.join(repo_root, SCHEMA_ADVICE_FILE))
+    candidates.append(os.path.join(_project_root(), SCHEMA_ADVICE_FILE))
     for path in candidates:
         if os.path.exists(path):
-            return _read_text(path)
-    return ""
+            return path
+    return None
+
+
+def _search_terms(text: str) -> list[str]:
+    return [
+        term
+        for term in SEARCH_TERM_RE.findall(text.lower())
+        if len(term) > 1 and term not in SEARCH_STOPWORDS
+    ]
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+class _Tokenizer:
+    # Local token counts for payload budgeting. Uses tiktoken when it is
+    # installed and its encoding loads (tiktoken downloads it on first use),
+    # otherwise the _estimate_tokens heuristic. Counts are memoized by text
+    # because every payload build re-measures the same large sections.
+    MAX_MEMO = 512
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        self._encoder = None
+        self._loaded = False
+        self._counts: dict[str, int] = {}
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            if tiktoken is not None:
+                try:
+                    self._encoder = tiktoken.get_encoding(self.encoding)
+                except Exception as exc:
+                    logging.getLogger(__name__).warning(
+                        "Token counts fall back to an estimate; cannot load %s: %s", self.encoding, exc
+                    )
+        return self._encoder
+
+    def count(self, text: str) -> int:
+        count = self._counts.get(text)
+        if count is None:
+            encoder = self._load()
+            count = len(encoder.encode_ordinary(text)) if encoder else _estimate_tokens(text)
+            if len(self._counts) >= self.MAX_MEMO:
+                self._counts.clear()
+            self._counts[text] = count
+        return count
+
+    def cut(self, text: str, tokens: int, tail: bool = False) -> str:
+        # The first (or last) `tokens` tokens of text, snapped back to a line
+        # boundary when there is one in the second half of the piece.
+        encoder = self._load()
+        if encoder:
+            ids = encoder.encode_ordinary(text)
+            if len(ids) <= tokens:
+                return text
+            piece = encoder.decode(ids[len(ids) - tokens :] if tail else ids[:tokens])
+        else:
+            chars = tokens * 4
+            if len(text) <= chars:
+                return text
+            piece = text[len(text) - chars :] if tail else text[:chars]
+        if tail:
+            newline = piece.find("\n")
+            if 0 <= newline < len(piece) // 2:
+                piece = piece[newline + 1 :]
+        else:
+            newline = piece.rfind("\n")
+            if newline > len(piece) // 2:
+                piece = piece[:newline]
+        return piece
+
+
+_TOKENS = _Tokenizer(TOKENIZER_ENCODING)
+
+
+def _load_prompt_budgets() -> dict[str, int]:
+    budgets: dict[str, int] = {}
+    for entry in os.environ.get("AGENT_PROMPT_TOKEN_BUDGETS", "").split(","):
+        role, _, value = entry.partition("=")
+        if not role.strip():
+            continue
+        try:
+            budgets[role.strip().lower()] = int(value)
+        except ValueError:
+            logging.getLogger(__name__).warning("Ignoring prompt budget %r", entry)
+    return budgets
+
+
+_PROMPT_BUDGETS = _load_prompt_budgets()
+
+
+def _truncate_text(text: str, tokens: int, tail: bool = False) -> str:
+    # Sections too small to be useful are dropped rather than cut.
+    if tokens < PROMPT_MIN_SECTION_TOKENS:
+        return ""
+    total = _TOKENS.count(text)
+    if total <= tokens:
+        return text
+    kept = _TOKENS.cut(text, tokens - 32, tail)
+    marker = f"[... {total - _TOKENS.count(kept)} of {total} tokens omitted to fit the prompt budget ...]"
+    return f"{marker}\n{kept}" if tail else f"{kept}\n{marker}"
+
+
+def _truncate_text_tail(text: str, tokens: int) -> str:
+    return _truncate_text(text, tokens, tail=True)
+
+
+def _outline_text(text: str, tokens: int) -> str:
+    # Summarized fallback for document bundles: headings, bundle headers
+    # ("docs/API.md:") and the first line under each heading, so the agent
+    # still sees what every document covers and which section to ask about.
+    if tokens < PROMPT_MIN_SECTION_TOKENS:
+        return ""
+    lines: list[str] = []
+    want_lead = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("#") or (stripped.startswith("docs/") and stripped.endswith(":")):
+            lines.append(line)
+            want_lead = True
+        elif want_lead and stripped:
+            lines.append(line)
+            want_lead = False
+    outline = "[outline only: full text omitted to fit the prompt budget]\n" + "\n".join(lines)
+    return _truncate_text(outline, tokens)
+
+
+def _chunk_schema_advice(text: str) -> list[dict]:
+    # Paragraphs are packed into chunks of roughly SCHEMA_CHUNK_CHARS. A new
+    # question in the transcript ("You said:") always starts a new chunk.
+    chunks: list[dict] = []
+    buffer: list[str] = []
+    start_line = 1
+
+    def flush() -> None:
+        body = "\n".join(buffer).strip()
+        if body:
+            chunks.append({"line": start_line, "text": body})
+
+    line_no = 0
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        size = sum(len(part) + 1 for part in buffer)
+        boundary = line.strip() == "You said:" or (not line.strip() and size >= SCHEMA_CHUNK_CHARS)
+        if boundary:
+            flush()
+            buffer = []
+            start_line = line_no
+        buffer.append(line)
+    flush()
+    return chunks
+
+
+def _build_schema_index(text: str) -> dict:
+    chunks = _chunk_schema_advice(text)
+    postings: dict[str, list[list[int]]] = {}
+    lengths: list[int] = []
+    for chunk_id, chunk in enumerate(chunks):
+        terms = _search_terms(chunk["text"])
+        lengths.append(len(terms))
+        counts: dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            postings.setdefault(term, []).append([chunk_id, count])
+    return {
+        "version": SCHEMA_INDEX_VERSION,
+        "chunks": chunks,
+        "lengths": lengths,
+        "avg_length": (sum(lengths) / len(lengths)) if lengths else 0.0,
+        "postings": postings,
+    }
+
+
+_SCHEMA_INDEXES: dict[str, dict] = {}
+# Absolute path -> (mtime_ns, size, digest) of the advice file last hashed,
+# so the multi-megabyte file is only read and hashed again once it changes.
+_SCHEMA_DIGESTS: dict[str, tuple[int, int, str]] = {}
+
+
+def _load_schema_index(path: str) -> dict:
+    logger = logging.getLogger(__name__)
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    known = _SCHEMA_DIGESTS.get(abs_path)
+    if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size) and known[2] in _SCHEMA_INDEXES:
+        return _SCHEMA_INDEXES[known[2]]
+    with open(abs_path, "rb") as handle:
+        raw = handle.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    _SCHEMA_DIGESTS[abs_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    if digest in _SCHEMA_INDEXES:
+        return _SCHEMA_INDEXES[digest]
+
+    index_path = os.path.join(
+        os.path.dirname(path), CACHE_DIR, "schema_index", f"{digest[:32]}.json"
+    )
+    index = None
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, "r", encoding="utf-8") as handle:
+                index = json.load(handle)
+        except (OSError, ValueError):
+            index = None
+        if index and index.get("version") != SCHEMA_INDEX_VERSION:
+            index = None
+    if index is None:
+        started = time.time()
+        index = _build_schema_index(raw.decode("utf-8", errors="replace"))
+        _write_text(index_path, json.dumps(index, ensure_ascii=True, separators=(",", ":")))
+        logger.info(
+            "Built schema advice index (%s chunks) in %.2fs: %s",
+            len(index["chunks"]),
+            time.time() - started,
+            index_path,
+        )
+    _SCHEMA_INDEXES[digest] = index
+    return index
+
+
+def _search_schema_index(index: dict, query: str, top_k: int) -> list[int]:
+    k1, b = 1.2, 0.75
+    chunk_count = len(index["chunks"])
+    lengths = index["lengths"]
+    avg_length = index["avg_length"] or 1.0
+    scores: dict[int, float] = {}
+    for term in set(_search_terms(query)):
+        postings = index["postings"].get(term)
+        if not postings:
+            continue
+        idf = math.log(1 + (chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for chunk_id, count in postings:
+            norm = k1 * (1 - b + b * lengths[chunk_id] / avg_length)
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * count * (k1 + 1) / (count + norm)
+    ranked = sorted(scores, key=lambda chunk_id: (-scores[chunk_id], chunk_id))
+    return ranked[:top_k]
+
+
+def _schema_advice_context(query: str) -> str:
+    path = _schema_advice_path()
+    if not path:
+        return ""
+    index = _load_schema_index(path)
+    selected: list[int] = []
+    used = 0
+    for chunk_id in _search_schema_index(index, query, SCHEMA_ADVICE_TOP_K):
+        cost = _estimate_tokens(index["chunks"][chunk_id]["text"])
+        if used + cost > SCHEMA_ADVICE_TOKEN_BUDGET:
+            continue
+        selected.append(chunk_id)
+        used += cost
+    sections = [
+        f"[{SCHEMA_ADVICE_FILE}, line {index['chunks'][chunk_id]['line']}]\n"
+        f"{index['chunks'][chunk_id]['text']}"
+        for chunk_id in sorted(selected)
+    ]
+    logging.getLogger(__name__).debug(
+        "Schema advice retrieval: %s/%s chunks, ~%s tokens.",
+        len(selected),
+        len(index["chunks"]),
+        used,
+    )
+    return "\n\n".join(sections)
 
 
 def _read_doc(path: str) -> str:
-    return _read_optional_text(os.path.join(os.getcwd(), "docs", path))
+    return _read_optional_text(os.path.join(_project_root(), "docs", path))
 
 
 def _docs_bundle(paths: list[str]) -> str:
@@ -431,6 +1924,182 @@ def _docs_bundle(paths: list[str]) -> str:
     return "\n\n".join(sections).strip()
 
 
+def _markdown_sections(text: str) -> list[tuple[int, str, str]]:
+    # (level, heading text, raw section text) for every heading; level 0 is
+    # whatever precedes the first heading. Fenced code is never a heading.
+    sections: list[tuple[int, str, list[str]]] = [(0, "", [])]
+    in_fence = False
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        match = None if in_fence else MARKDOWN_HEADING_RE.match(line)
+        if match:
+            sections.append((len(match.group(1)), match.group(2), [line]))
+        else:
+            sections[-1][2].append(line)
+    return [(level, heading, "\n".join(lines).strip()) for level, heading, lines in sections]
+
+
+def _roles_named(text: str) -> set[str]:
+    words = f" {' '.join(SEARCH_TERM_RE.findall(text.lower().replace('-', ' ')))} "
+    return {role for role, aliases in ROLE_ALIASES.items() if any(f" {alias} " in words for alias in aliases)}
+
+
+def _tagged_roles(text: str) -> set[str]:
+    # Bracketed text that is not made up of role names ("[TODO]", "[v2]",
+    # "[Test Data]") is not an owner tag.
+    roles: set[str] = set()
+    for tag in OWNER_TAG_RE.findall(text):
+        names = [" ".join(part.replace("-", " ").split()) for part in OWNER_TAG_SPLIT_RE.split(tag.lower())]
+        if names and all(name in ROLE_NAMES for name in names):
+            roles.update(ROLE_NAMES[name] for name in names)
+    return roles
+
+
+def _index_agent_tasks(text: str) -> dict[str, str]:
+    # AGENT_TASKS.md has one section per role. The role level is the heading
+    # level where most headings name a role, so a "### API notes" subsection
+    # under "## Frontend" stays with the frontend. Everything outside a role
+    # section (title, project name, shared notes) is the shared header every
+    # role receives. Roles without a section are left out of the index.
+    sections = _markdown_sections(text)
+    named = [_roles_named(heading) if level else set() for level, heading, _ in sections]
+    levels: dict[int, int] = {}
+    for (level, _, _), roles in zip(sections, named):
+        if roles:
+            levels[level] = levels.get(level, 0) + 1
+    if sum(levels.values()) < 2:
+        return {}
+    role_level = max(levels, key=lambda level: (levels[level], -level))
+    owners: list[set[str]] = []
+    current: set[str] = set()
+    for (level, _, _), roles in zip(sections, named):
+        if level and level <= role_level:
+            current = roles if level == role_level else set()
+        owners.append(current)
+    return {
+        role: "\n\n".join(
+            body for (_, _, body), owned in zip(sections, owners) if body and (not owned or role in owned)
+        )
+        for role in set().union(*owners)
+    }
+
+
+def _tags_only(line: str) -> bool:
+    # "- [Owner: Backend]" marks the section it sits in; "- [Backend] POST
+    # /api/builds returns 201" is an item of its own.
+    rest = OWNER_TAG_RE.sub(
+        lambda match: "" if _tagged_roles(match.group(0)) else match.group(0),
+        MARKDOWN_LIST_ITEM_RE.sub("", line.strip()),
+    )
+    return not re.sub(r"\bowners?\b|[\W_]+", "", rest, flags=re.IGNORECASE)
+
+
+def _test_plan_units(text: str) -> list[tuple[int, set[str], str, bool]]:
+    # (level, owner tags, text, leaf) in document order. A section is one
+    # unit unless its top-level list items carry their own owner tags (the
+    # flat "- [Backend] ..." format); then the heading and any text before
+    # the list are one unit and every item is a leaf unit one level below.
+    units: list[tuple[int, set[str], str, bool]] = []
+    for level, _, body in _markdown_sections(text):
+        head: list[str] = []
+        items: list[list[str]] = []
+        in_fence = False
+        for line in body.splitlines():
+            if not in_fence and MARKDOWN_LIST_ITEM_RE.match(line):
+                items.append([line])
+            elif items:
+                items[-1].append(line)
+            else:
+                head.append(line)
+            if line.lstrip().startswith("```"):
+                in_fence = not in_fence
+        head_text = "\n".join(head).strip()
+        tagged = [("\n".join(item).strip(), _tagged_roles("\n".join(item))) for item in items]
+        section_tags = (level and _tagged_roles(head_text)) or any(
+            roles and _tags_only(item.splitlines()[0]) for item, roles in tagged
+        )
+        if section_tags or not any(roles for _, roles in tagged):
+            units.append((level, _tagged_roles(body) if level else set(), body, False))
+            continue
+        units.append((level, set(), head_text, False))
+        units += [(level + 1, roles, item, True) for item, roles in tagged]
+    return units
+
+
+def _index_test_plan(text: str) -> dict[str, str]:
+    # TEST.md items carry [Owner] tags ("[Owner: Backend]" or "[Frontend][Tester]"),
+    # either once per section or on every item of a flat list. A tagged unit
+    # belongs to its owners, untagged subsections inherit the nearest tagged
+    # ancestor, and a role's slice keeps the headings above its items for
+    # context. Untagged sections with no tagged content below them (intro,
+    # environment notes) are shared; an untagged item in a tagged list
+    # belongs to no one. Roles that own nothing are left out.
+    units = _test_plan_units(text)
+    owners: list[set[str]] = []
+    stack: list[tuple[int, set[str]]] = []
+    for level, roles, _, leaf in units:
+        if not leaf:
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+        owners.append(roles or (stack[-1][1] if stack else set()))
+        if roles and not leaf:
+            stack.append((level, roles))
+    if not any(owners):
+        return {}
+    # Walk backwards so each heading knows whether owned items follow it
+    # before the next heading at its own level.
+    owned_below = [False] * len(units)
+    pending: list[tuple[int, bool]] = []
+    for position in range(len(units) - 1, 0, -1):
+        level, _, _, leaf = units[position]
+        below = False
+        while not leaf and pending and pending[-1][0] > level:
+            below = pending.pop()[1] or below
+        owned_below[position] = below
+        pending.append((level, below or bool(owners[position])))
+    index: dict[str, str] = {}
+    for role in set().union(*owners):
+        parts: list[tuple[str, bool]] = []
+        ancestors: list[list] = []
+        for position, (level, _, body, leaf) in enumerate(units):
+            while not leaf and ancestors and ancestors[-1][0] >= level:
+                ancestors.pop()
+            if owners[position]:
+                if role in owners[position]:
+                    parts += [(entry[1], False) for entry in ancestors if not entry[2]]
+                    for entry in ancestors:
+                        entry[2] = True
+                    parts.append((body, leaf))
+            elif owned_below[position]:
+                ancestors.append([level, body, False])
+            elif not leaf:
+                parts.append((body, leaf))
+        # Items stay one list under their heading.
+        text = ""
+        for body, leaf in parts:
+            if body:
+                text += ("\n" if leaf else "\n\n" if text else "") + body
+        index[role] = text
+    return index
+
+
+_ROLE_INDEXES: dict[str, tuple[str, dict[str, str]]] = {}
+
+
+def _role_slice(path: str, agent_id: str, indexer: Callable[[str], dict[str, str]]) -> str | None:
+    # The role's part of a PM-written file, or None when the file is not
+    # split by role (or has nothing for this role). Each file is indexed once
+    # per version rather than once per stage.
+    abs_path = os.path.join(_project_root(), path)
+    text = _read_text(abs_path)
+    cached = _ROLE_INDEXES.get(abs_path)
+    if cached is None or cached[0] != text:
+        cached = (text, indexer(text))
+        _ROLE_INDEXES[abs_path] = cached
+    return cached[1].get(agent_id)
+
+
 def _is_read_only_sql(sql: str) -> bool:
     statements = [s.strip() for s in sql.strip().split(";") if s.strip()]
     if not statements:
@@ -441,69 +2110,783 @@ def _is_read_only_sql(sql: str) -> bool:
     return head in {"select", "show", "describe", "desc", "explain", "with"}
 
 
-@function_tool
-def db_query(sql: str, max_rows: int = 200) -> str:
-    """
-    Run a read-only SQL query against the configured MySQL database.
-    Requires DB_HOST, DB_PORT, DB_USER, DB_NAME, and DB_PASSWORD (or MYSQL_PWD) in env.
-    Only SELECT/SHOW/DESCRIBE/EXPLAIN/WITH are allowed.
-    """
-    if not _is_read_only_sql(sql):
-        return "Error: only single-statement read-only SQL is allowed."
+def _db_config() -> dict:
+    # Without an explicit DB_DRIVER, a configured DB_HOST means MySQL and
+    # anything else falls back to the local migrations/seeds sandbox.
+    driver = os.environ.get("DB_DRIVER", "").strip().lower()
+    if not driver:
+        driver = "mysql" if os.environ.get("DB_HOST", "").strip() else "sandbox"
+    return {
+        "driver": driver,
+        "host": os.environ.get("DB_HOST", "").strip(),
+        "port": int(os.environ.get("DB_PORT", "").strip() or 3306),
+        "user": os.environ.get("DB_USER", "").strip(),
+        "name": os.environ.get("DB_NAME", "").strip(),
+        "password": os.environ.get("DB_PASSWORD", "").strip() or os.environ.get("MYSQL_PWD", ""),
+        "sqlite_path": os.path.join(
+            _project_root(), os.environ.get("DB_SQLITE_PATH", "").strip() or os.path.join("db", "dev.sqlite3")
+        ),
+        "sandbox_root": os.path.join(_project_root(), os.environ.get("DB_SANDBOX_ROOT", "").strip() or "db"),
+    }
 
-    host = os.environ.get("DB_HOST", "").strip()
-    port = os.environ.get("DB_PORT", "").strip() or "3306"
-    user = os.environ.get("DB_USER", "").strip()
-    name = os.environ.get("DB_NAME", "").strip()
-    password = os.environ.get("DB_PASSWORD", "").strip()
 
-    if not host or not user or not name:
+def _db_config_error(config: dict) -> str | None:
+    if config["driver"] == "sqlite":
+        if not os.path.exists(config["sqlite_path"]):
+            return f"Error: SQLite database not found at {config['sqlite_path']}."
+        return None
+    if config["driver"] == "sandbox":
+        if not _sql_sandbox(config["sandbox_root"]).sources():
+            return (
+                f"Error: no .sql files under {config['sandbox_root']}/migrations or seeds "
+                "(set DB_HOST for MySQL or generate migrations first)."
+            )
+        return None
+    if config["driver"] != "mysql":
+        return f"Error: unsupported DB_DRIVER '{config['driver']}' (use mysql, sqlite or sandbox)."
+    if not config["host"] or not config["user"] or not config["name"]:
         return "Error: missing DB_HOST, DB_USER, or DB_NAME env vars."
+    return None
 
-    env = os.environ.copy()
-    if password and not env.get("MYSQL_PWD"):
-        env["MYSQL_PWD"] = password
-
-    cmd = [
-        "mysql",
-        "-h",
-        host,
-        "-P",
-        str(port),
-        "-u",
-        user,
-        "-D",
-        name,
-        "--batch",
-        "--raw",
-        "-e",
-        sql,
-    ]
-    try:
-        result = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            env=env,
-            timeout=30,
+
+class _DbQueryError(Exception):
+    pass
+
+
+class _DbTimeoutError(_DbQueryError):
+    pass
+
+
+class _RowBuffer:
+    # Collects formatted result lines until either the row cap or the byte
+    # cap is reached; drivers stop fetching as soon as add() returns False.
+    def __init__(self, max_rows: int, max_bytes: int) -> None:
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.lines: list[str] = []
+        self.rows = 0
+        self.size = 0
+        self.truncated = False
+        self.notes: list[str] = []
+
+    def header(self, columns: list[str]) -> None:
+        if columns:
+            line = "\t".join(columns)
+            self.lines.append(line)
+            self.size += len(line) + 1
+
+    def add(self, row: tuple) -> bool:
+        if self.max_rows and self.rows >= self.max_rows:
+            self.truncated = True
+            return False
+        line = "\t".join(_format_db_value(value) for value in row)
+        if self.max_bytes and self.size + len(line) + 1 > self.max_bytes:
+            self.truncated = True
+            return False
+        self.lines.append(line)
+        self.rows += 1
+        self.size += len(line) + 1
+        return True
+
+
+def _mask_sql_literals(sql: str) -> str:
+    # Same-length copy of sql with string/identifier literals replaced by "x"
+    # and comments by spaces, so offsets still line up with the original.
+    return SQL_LITERAL_RE.sub(
+        lambda match: (" " if match.group(0)[0] in "-#/" else "x") * len(match.group(0)), sql
+    )
+
+
+def _limit_sql(sql: str, limit: int) -> str:
+    # Pushes the row cap into SELECT/WITH statements so the server never
+    # produces more rows than db_query will return: a trailing top-level
+    # LIMIT is clamped, otherwise one is appended on its own line (after any
+    # trailing comment). Locking and INTO/PROCEDURE clauses that must follow
+    # LIMIT stay at the end. SHOW/DESCRIBE/EXPLAIN are left alone.
+    statement = sql.strip().rstrip(";").rstrip()
+    if not limit or statement.split(None, 1)[0].lower() not in {"select", "with"}:
+        return statement
+    masked = _mask_sql_literals(statement)
+    end = len(statement)
+    for clause in SQL_AFTER_LIMIT_RE.finditer(masked):
+        before = masked[:clause.start()]
+        # "SELECT ... INTO @x FROM t" puts INTO before FROM, where it does
+        # not constrain LIMIT.
+        if before.count("(") == before.count(")") and not SQL_FROM_RE.search(masked, clause.end()):
+            end = clause.start()
+            break
+    head, tail = statement[:end].rstrip(), statement[end:]
+    match = SQL_TRAILING_LIMIT_RE.search(masked[:len(head)])
+    if not match:
+        return f"{head}\nLIMIT {limit}" + (f"\n{tail}" if tail else "")
+    group = 2 if match.group(2) else 1
+    if int(match.group(group)) <= limit:
+        return statement
+    return f"{statement[:match.start(group)]}{limit}{statement[match.end(group):]}"
+
+
+class _SqliteConnection:
+    # Stand-in driver so db_query can be exercised without MySQL. Queries run
+    # in a worker thread; the timeout is enforced inside SQLite through the
+    # progress handler, which aborts the statement when the deadline passes.
+    # SQLite steps lazily, so rows past the buffer caps are never produced.
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    @classmethod
+    def open(cls, path: str) -> "_SqliteConnection":
+        return cls(sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False))
+
+    def _execute(self, sql: str, timeout: float, buffer: _RowBuffer) -> None:
+        deadline = time.monotonic() + timeout
+        self._conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+        cursor = None
+        try:
+            cursor = self._conn.execute(sql)
+            buffer.header([column[0] for column in cursor.description or []])
+            while True:
+                rows = cursor.fetchmany(DB_FETCH_BATCH)
+                if not rows or not all(buffer.add(row) for row in rows):
+                    break
+        except sqlite3.OperationalError as exc:
+            if "interrupted" in str(exc):
+                raise _DbTimeoutError("query timed out.") from exc
+            raise _DbQueryError(str(exc)) from exc
+        finally:
+            if cursor is not None:
+                cursor.close()
+            self._conn.set_progress_handler(None, 0)
+
+    async def execute(self, sql: str, timeout: float, buffer: _RowBuffer) -> None:
+        await asyncio.to_thread(self._execute, sql, timeout, buffer)
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+def _split_sql_statements(text: str) -> list[tuple[int, str]]:
+    # (line number, statement) pairs; semicolons inside literals and
+    # comments do not end a statement.
+    masked = _mask_sql_literals(text)
+    statements: list[tuple[int, str]] = []
+    start = 0
+    for index, char in enumerate(masked + ";"):
+        if char != ";":
+            continue
+        if masked[start:index].strip():
+            offset = start + len(masked[start:index]) - len(masked[start:index].lstrip())
+            statements.append((text.count("\n", 0, offset) + 1, text[offset:index].strip()))
+        start = index + 1
+    return statements
+
+
+def _sqlite_string(literal: str) -> str:
+    # MySQL '...' or "..." string literal -> SQLite '...' literal.
+    escapes = {"n": "\n", "t": "\t", "r": "\r", "0": "\0", "Z": "\x1a"}
+    body = re.sub(
+        r"\\(.)|''|\"\"",
+        lambda match: escapes.get(match.group(1), match.group(1)) if match.group(1) else match.group(0)[0],
+        literal[1:-1],
+        flags=re.DOTALL,
+    )
+    return "'" + body.replace("'", "''") + "'"
+
+
+def _sqlite_table_item(
+    table: str, item: str, indexes: list[str], restore: Callable[[str], str]
+) -> str | None:
+    # One column or constraint from a MySQL CREATE TABLE body. Secondary
+    # keys become separate CREATE INDEX statements, prefixed with the table
+    # name because SQLite index names are schema-wide; FULLTEXT/SPATIAL keys
+    # have no SQLite equivalent and are dropped.
+    key = re.match(r"(UNIQUE\s+|FULLTEXT\s+|SPATIAL\s+)?(?:KEY|INDEX)\b\s*([^\s(]*)\s*\((.*)\)", item, re.I | re.S)
+    if key is None:
+        key = re.match(r"(UNIQUE)\b\s*([^\s(]*)\s*\((.*)\)", item, re.I | re.S)
+    if key is not None:
+        kind = (key.group(1) or "").strip().upper()
+        if kind in {"FULLTEXT", "SPATIAL"}:
+            return None
+        columns = re.sub(r"\(\d+\)", "", key.group(3))
+        name = restore(key.group(2)).strip('"') or f"idx{len(indexes) + 1}"
+        unique = "UNIQUE " if kind == "UNIQUE" else ""
+        indexes.append(f'CREATE {unique}INDEX IF NOT EXISTS "{table}_{name}" ON "{table}" ({columns})')
+        return None
+    item = re.sub(r"\s+USING\s+(BTREE|HASH)\b", "", item, flags=re.I)
+    if re.match(r"(PRIMARY|CONSTRAINT|FOREIGN|CHECK)\b", item, re.I):
+        return item
+    item = re.sub(r"^(\S+\s+)(?:ENUM|SET)\s*\([^)]*\)", r"\1TEXT", item, flags=re.I)
+    if re.search(r"\bAUTO_INCREMENT\b", item, re.I):
+        item = re.sub(r"^(\S+\s+)\w+(\s*\(\d+\))?", r"\1INTEGER", item)
+        item = re.sub(r"\s*\bAUTO_INCREMENT\b", "", item, flags=re.I)
+    for pattern in (
+        r"\s+(UNSIGNED|ZEROFILL|SIGNED)\b",
+        r"\s+(CHARACTER\s+SET|CHARSET|COLLATE)\s+\w+",
+        r"\s+COMMENT\s+\0\d+\0",
+        r"\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP(\s*\(\d*\))?",
+    ):
+        item = re.sub(pattern, "", item, flags=re.I)
+    return re.sub(r"\b(CURRENT_TIMESTAMP)\s*\(\d*\)", r"\1", item, flags=re.I)
+
+
+def _mysql_to_sqlite(statement: str) -> list[str]:
+    # Best-effort translation of the MySQL DDL/DML the Data Modeler writes
+    # into SQLite statements. Literals are set aside first so the rewrites
+    # below only ever see SQL text. Session/database statements are dropped.
+    literals: list[str] = []
+
+    def stash(match: re.Match) -> str:
+        text = match.group(0)
+        if text[0] in "-#/":
+            return " "
+        if text[0] == "`":
+            literals.append('"' + text[1:-1].replace('"', '""') + '"')
+        else:
+            literals.append(_sqlite_string(text))
+        return f"\0{len(literals) - 1}\0"
+
+    def restore(text: str) -> str:
+        return re.sub("\0(\\d+)\0", lambda match: literals[int(match.group(1))], text)
+
+    code = " ".join(SQL_LITERAL_RE.sub(stash, statement).split())
+    words = code.lower().split()
+    if not words or words[0] in {"set", "use", "lock", "unlock", "delimiter"}:
+        return []
+    if words[0] in {"create", "drop"} and len(words) > 1 and words[1] in {"database", "schema"}:
+        return []
+    code = re.sub(r"\b(NOW|UTC_TIMESTAMP|CURRENT_TIMESTAMP)\s*\(\s*\d*\s*\)", "CURRENT_TIMESTAMP", code, flags=re.I)
+    code = re.sub(r"^TRUNCATE\s+(TABLE\s+)?", "DELETE FROM ", code, flags=re.I)
+    code = re.sub(r"^INSERT\s+IGNORE\b", "INSERT OR IGNORE", code, flags=re.I)
+    upsert = re.search(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", code, re.I)
+    if upsert is not None:
+        assignments = re.sub(r"\bVALUES\s*\(\s*([^()\s]+)\s*\)", r"excluded.\1", code[upsert.end():], flags=re.I)
+        code = f"{code[:upsert.start()]}ON CONFLICT DO UPDATE SET{assignments}"
+    code = re.sub(r"\s+USING\s+(BTREE|HASH)\b", "", code, flags=re.I)
+    statements = [code]
+    drop = re.match(r"DROP\s+TABLE\s+(IF\s+EXISTS\s+)?(.*)$", code, re.I)
+    if drop is not None:
+        statements = [f"DROP TABLE {drop.group(1) or ''}{name.strip()}" for name in drop.group(2).split(",")]
+    add_index = re.match(r"ALTER\s+TABLE\s+(\S+)\s+ADD\s+(UNIQUE\s+)?(?:INDEX|KEY)\s+(\S+)\s*\((.*)\)$", code, re.I)
+    if add_index is not None:
+        table, unique, name, columns = (restore(group or "").strip('"') for group in add_index.groups())
+        columns = re.sub(r"\(\d+\)", "", columns)
+        statements = [f'CREATE {unique}INDEX "{table}_{name}" ON "{table}" ({columns})']
+    create = re.match(r"(CREATE\s+(?:TEMPORARY\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\S+)\s*)\(", code, re.I)
+    if create is not None:
+        items: list[str] = []
+        depth, start, end = 0, create.end(), len(code)
+        for index in range(create.end() - 1, len(code)):
+            if code[index] == "(":
+                depth += 1
+            elif code[index] == ")":
+                depth -= 1
+                if depth == 0:
+                    end = index
+                    break
+            if code[index] == "," and depth == 1:
+                items.append(code[start:index].strip())
+                start = index + 1
+        items.append(code[start:end].strip())
+        # Table options after the closing paren (ENGINE=, CHARSET=, ...) are dropped.
+        indexes: list[str] = []
+        table = restore(create.group(2)).strip('"')
+        body = [item for item in (_sqlite_table_item(table, item, indexes, restore) for item in items) if item]
+        statements = [f"{create.group(1)}({', '.join(body)})"] + indexes
+    return [restore(statement) for statement in statements]
+
+
+def _sandbox_query(sql: str) -> str:
+    # MySQL introspection statements agents commonly issue, answered from
+    # the SQLite catalog so they work unchanged against the sandbox.
+    statement = " ".join(sql.strip().rstrip(";").split())
+    name = r"[`\"]?([\w$]+)[`\"]?"
+    if re.fullmatch(r"SHOW\s+(FULL\s+)?TABLES", statement, re.I):
+        return "SELECT name AS Tables FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    match = re.fullmatch(rf"(?:DESCRIBE|DESC|SHOW\s+(?:FULL\s+)?COLUMNS\s+FROM|EXPLAIN)\s+{name}", statement, re.I)
+    if match:
+        return (
+            "SELECT name AS Field, type AS Type, CASE \"notnull\" WHEN 1 THEN 'NO' ELSE 'YES' END AS \"Null\", "
+            "CASE WHEN pk > 0 THEN 'PRI' ELSE '' END AS \"Key\", dflt_value AS \"Default\" "
+            f"FROM pragma_table_info('{match.group(1)}') ORDER BY cid"
         )
-    except FileNotFoundError:
-        return "Error: mysql client not found. Install mysql-client in WSL."
-    except subprocess.TimeoutExpired:
-        return "Error: query timed out."
+    match = re.fullmatch(rf"SHOW\s+CREATE\s+TABLE\s+{name}", statement, re.I)
+    if match:
+        return f"SELECT name AS \"Table\", sql AS \"Create Table\" FROM sqlite_master WHERE type = 'table' AND name = '{match.group(1)}'"
+    match = re.fullmatch(rf"SHOW\s+(?:INDEX|INDEXES|KEYS)\s+FROM\s+{name}", statement, re.I)
+    if match:
+        return (
+            "SELECT l.name AS Key_name, CASE l.\"unique\" WHEN 1 THEN 0 ELSE 1 END AS Non_unique, "
+            "i.seqno + 1 AS Seq_in_index, i.name AS Column_name "
+            f"FROM pragma_index_list('{match.group(1)}') AS l, pragma_index_info(l.name) AS i "
+            "ORDER BY l.name, i.seqno"
+        )
+    if re.match(r"EXPLAIN\s+(SELECT|WITH)\b", statement, re.I):
+        return "EXPLAIN QUERY PLAN " + statement[len("EXPLAIN"):].lstrip()
+    return sql
+
+
+class _SqlSandbox(_SqliteConnection):
+    # In-memory SQLite database built from db/migrations/*.sql followed by
+    # db/seeds/*.sql, translated from MySQL. Before every query the source
+    # files are re-stat'ed: new files are applied on top of the existing
+    # database, while an edited or removed file triggers a full rebuild.
+    # user_version is bumped on every reload so schema fingerprints (and
+    # with them cached db_query results) change even for seed-only edits.
+    # Statements that fail to load are reported alongside query results.
+    def __init__(self, root: str) -> None:
+        super().__init__(sqlite3.connect(":memory:", check_same_thread=False))
+        self.root = root
+        self.generation = 0
+        self.errors: list[str] = []
+        self._applied: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def sources(self) -> list[tuple[str, tuple[int, int]]]:
+        found: list[tuple[str, tuple[int, int]]] = []
+        for folder in ("migrations", "seeds"):
+            directory = os.path.join(self.root, folder)
+            if not os.path.isdir(directory):
+                continue
+            for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+                if entry.is_file() and entry.name.lower().endswith(".sql"):
+                    stat = entry.stat()
+                    found.append((f"{folder}/{entry.name}", (stat.st_mtime_ns, stat.st_size)))
+        return found
+
+    def _load(self, relative_path: str) -> None:
+        with open(os.path.join(self.root, relative_path), "r", encoding="utf-8", errors="replace") as handle:
+            text = handle.read()
+        for line, statement in _split_sql_statements(text):
+            for translated in _mysql_to_sqlite(statement):
+                try:
+                    self._conn.execute(translated)
+                except sqlite3.Error as exc:
+                    self.errors.append(f"{relative_path}:{line}: {exc}")
+
+    def refresh(self) -> None:
+        sources = self.sources()
+        current = dict(sources)
+        if any(current.get(path) != stamp for path, stamp in self._applied.items()):
+            self._conn.close()
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._applied = {}
+            self.errors = []
+        pending = [(path, stamp) for path, stamp in sources if path not in self._applied]
+        if not pending:
+            return
+        self._conn.execute("PRAGMA query_only = OFF")
+        try:
+            for path, stamp in pending:
+                self._load(path)
+                self._applied[path] = stamp
+            self._conn.commit()
+            self.generation += 1
+            self._conn.execute(f"PRAGMA user_version = {self.generation}")
+        finally:
+            self._conn.execute("PRAGMA query_only = ON")
+
+    def _execute(self, sql: str, timeout: float, buffer: _RowBuffer) -> None:
+        with self._lock:
+            self.refresh()
+            super()._execute(_sandbox_query(sql), timeout, buffer)
+            if self.errors:
+                buffer.notes.append(
+                    f"(sandbox: {len(self.errors)} statement(s) failed to load: "
+                    + "; ".join(self.errors[:3])
+                    + (" ..." if len(self.errors) > 3 else "")
+                    + ")"
+                )
+
+    async def close(self) -> None:
+        # Shared by every pooled handle; lives as long as the process.
+        return None
+
+
+_SQL_SANDBOXES: dict[str, _SqlSandbox] = {}
+
 
-    if result.returncode != 0:
-        return f"Error: {result.stderr.strip() or 'query failed'}"
+def _sql_sandbox(root: str) -> _SqlSandbox:
+    sandbox = _SQL_SANDBOXES.get(root)
+    if sandbox is None:
+        sandbox = _SQL_SANDBOXES[root] = _SqlSandbox(root)
+    return sandbox
+
+
+class _MySqlConnection:
+    # aiomysql connection. MAX_EXECUTION_TIME makes the server abort slow
+    # read-only statements itself instead of leaving them running after the
+    # client gives up. Results are read through an unbuffered server-side
+    # cursor, a batch at a time.
+    def __init__(self, conn) -> None:
+        self._conn = conn
+
+    @classmethod
+    async def open(cls, config: dict, timeout: float) -> "_MySqlConnection":
+        conn = await aiomysql.connect(
+            host=config["host"],
+            port=config["port"],
+            user=config["user"],
+            password=config["password"],
+            db=config["name"],
+            connect_timeout=timeout,
+            autocommit=True,
+        )
+        async with conn.cursor() as cursor:
+            await cursor.execute(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout * 1000)}")
+        return cls(conn)
+
+    async def _stream(self, sql: str, buffer: _RowBuffer) -> None:
+        async with self._conn.cursor(aiomysql.SSCursor) as cursor:
+            await cursor.execute(sql)
+            buffer.header([column[0] for column in cursor.description or []])
+            while True:
+                rows = await cursor.fetchmany(DB_FETCH_BATCH)
+                if not rows or not all(buffer.add(row) for row in rows):
+                    break
+
+    async def execute(self, sql: str, timeout: float, buffer: _RowBuffer) -> None:
+        try:
+            await asyncio.wait_for(self._stream(sql, buffer), timeout=timeout + 5)
+        except asyncio.TimeoutError as exc:
+            raise _DbTimeoutError("query timed out.") from exc
+        except aiomysql.Error as exc:
+            raise _DbQueryError(str(exc)) from exc
+
+    async def close(self) -> None:
+        self._conn.close()
+
+
+class _MySqlCliConnection:
+    # Fallback when aiomysql is not installed: one mysql client process per
+    # query, spawned asynchronously. Output is read line by line and the
+    # process is killed once the buffer is full.
+    def __init__(self, config: dict) -> None:
+        self._config = config
+
+    async def execute(self, sql: str, timeout: float, buffer: _RowBuffer) -> None:
+        config = self._config
+        env = os.environ.copy()
+        if config["password"] and not env.get("MYSQL_PWD"):
+            env["MYSQL_PWD"] = config["password"]
+        cmd = [
+            "mysql",
+            "-h",
+            config["host"],
+            "-P",
+            str(config["port"]),
+            "-u",
+            config["user"],
+            "-D",
+            config["name"],
+            "--batch",
+            "--raw",
+            "-e",
+            sql,
+        ]
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=env,
+            )
+        except FileNotFoundError as exc:
+            raise _DbQueryError("mysql client not found. Install mysql-client in WSL.") from exc
+
+        async def read_rows() -> None:
+            header = await process.stdout.readline()
+            if header:
+                buffer.header(header.decode("utf-8", errors="replace").rstrip("\n").split("\t"))
+            while line := await process.stdout.readline():
+                row = line.decode("utf-8", errors="replace").rstrip("\n").split("\t")
+                if not buffer.add(tuple(row)):
+                    process.kill()
+                    break
+
+        try:
+            await asyncio.wait_for(read_rows(), timeout=timeout)
+            stderr = await process.stderr.read()
+            await process.wait()
+        except asyncio.TimeoutError as exc:
+            process.kill()
+            await process.wait()
+            raise _DbTimeoutError("query timed out.") from exc
+        if process.returncode != 0 and not buffer.truncated:
+            raise _DbQueryError(stderr.decode("utf-8", errors="replace").strip() or "query failed")
+
+    async def close(self) -> None:
+        return None
+
+
+class _DbPool:
+    # Bounded pool of open connections for one DB configuration. Idle
+    # connections older than idle_seconds are closed lazily on acquire.
+    def __init__(self, config: dict, size: int, idle_seconds: float, timeout: float) -> None:
+        self.config = config
+        self.size = max(1, size)
+        self.idle_seconds = idle_seconds
+        self.timeout = timeout
+        self._idle: list[tuple[object, float]] = []
+        self._open = 0
+        self._available = asyncio.Condition()
+
+    async def _connect(self):
+        if self.config["driver"] == "sqlite":
+            return await asyncio.to_thread(_SqliteConnection.open, self.config["sqlite_path"])
+        if self.config["driver"] == "sandbox":
+            return _sql_sandbox(self.config["sandbox_root"])
+        if aiomysql is None:
+            return _MySqlCliConnection(self.config)
+        return await _MySqlConnection.open(self.config, self.timeout)
+
+    async def acquire(self):
+        async with self._available:
+            while True:
+                now = time.monotonic()
+                while self._idle:
+                    conn, idle_since = self._idle.pop()
+                    if now - idle_since <= self.idle_seconds:
+                        return conn
+                    self._open -= 1
+                    await conn.close()
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                await self._available.wait()
+        try:
+            return await self._connect()
+        except BaseException:
+            async with self._available:
+                self._open -= 1
+                self._available.notify()
+            raise
+
+    async def release(self, conn, reusable: bool = True) -> None:
+        async with self._available:
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._open -= 1
+                await conn.close()
+            self._available.notify()
+
+    async def execute(self, sql: str, buffer: _RowBuffer) -> None:
+        conn = await self.acquire()
+        reusable = True
+        try:
+            await conn.execute(sql, self.timeout, buffer)
+        except _DbTimeoutError:
+            reusable = self.config["driver"] in {"sqlite", "sandbox"}
+            raise
+        except _DbQueryError:
+            raise
+        except BaseException:
+            reusable = False
+            raise
+        finally:
+            await self.release(conn, reusable)
+
+
+_DB_POOLS: dict[tuple, _DbPool] = {}
+
+
+def _db_pool(config: dict) -> _DbPool:
+    # Pools are bound to the event loop they were created on.
+    loop = asyncio.get_running_loop()
+    key = (id(loop),) + tuple(sorted((k, v) for k, v in config.items() if k != "password"))
+    pool = _DB_POOLS.get(key)
+    if pool is None:
+        pool = _DbPool(
+            config,
+            size=int(os.environ.get("DB_POOL_SIZE", "4") or 4),
+            idle_seconds=float(os.environ.get("DB_POOL_IDLE_SECONDS", "300") or 300),
+            timeout=float(os.environ.get("DB_QUERY_TIMEOUT_SECONDS", "30") or 30),
+        )
+        _DB_POOLS[key] = pool
+    return pool
+
+
+def _normalize_sql(sql: str) -> str:
+    # Cache key form of a statement: comments dropped, whitespace outside
+    # literals collapsed, trailing semicolon removed. Case is kept: MySQL
+    # table names are case-sensitive on most Linux servers.
+    parts: list[str] = []
+    last = 0
+    for match in SQL_LITERAL_RE.finditer(sql):
+        parts.append(" ".join(sql[last:match.start()].split()))
+        if match.group(0)[0] not in "-#/":
+            parts.append(match.group(0))
+        last = match.end()
+    parts.append(" ".join(sql[last:].split()))
+    return " ".join(part for part in parts if part).rstrip(";").strip()
+
+
+def _is_introspection_sql(sql: str) -> bool:
+    # SHOW/DESCRIBE/EXPLAIN, or a SELECT that reads only schema tables. Their
+    # results change with the schema, which the result cache watches; rows
+    # of ordinary tables can change at any time.
+    text = SQL_LITERAL_RE.sub(
+        lambda match: match.group(0) if match.group(0)[0] == "`" else " ", sql
+    ).strip()
+    if not text:
+        return False
+    if text.split(None, 1)[0].lower() in {"show", "describe", "desc", "explain"}:
+        return True
+    tables = [
+        part.split()[0]
+        for match in SQL_TABLE_LIST_RE.finditer(text)
+        for part in match.group(1).split(",")
+        if part.split()
+    ]
+    return bool(tables) and all(SQL_SCHEMA_TABLE_RE.match(table) for table in tables)
+
+
+class _DbResultCache:
+    # Process-wide cache of formatted db_query results. Entries expire after
+    # ttl seconds, the total size is capped with LRU eviction, and all entries
+    # for a connection are dropped when its schema fingerprint changes. The
+    # fingerprint is re-read at most every check_seconds, so repeated
+    # introspection queries are answered without touching the database.
+    # Only schema changes are seen, so db_query caches data queries only for
+    # the sandbox, which nothing outside this process writes to.
+    def __init__(self, ttl: float, max_bytes: int, check_seconds: float) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.check_seconds = check_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict[tuple, tuple[str, float]] = {}
+        self._size = 0
+        self._fingerprints: dict[tuple, tuple[str, float]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+
+    async def _fingerprint(self, identity: tuple, pool: _DbPool) -> str:
+        known = self._fingerprints.get(identity)
+        now = time.monotonic()
+        if known and now - known[1] < self.check_seconds:
+            return known[0]
+        sql = {
+            "sqlite": SQLITE_SCHEMA_FINGERPRINT_SQL,
+            "sandbox": SANDBOX_SCHEMA_FINGERPRINT_SQL,
+        }.get(pool.config["driver"], MYSQL_SCHEMA_FINGERPRINT_SQL)
+        buffer = _RowBuffer(1, 0)
+        await pool.execute(sql, buffer)
+        fingerprint = "\n".join(buffer.lines)
+        if known and known[0] != fingerprint:
+            self._drop(identity)
+        self._fingerprints[identity] = (fingerprint, now)
+        return fingerprint
+
+    def _drop(self, identity: tuple) -> None:
+        for key in [key for key in self._entries if key[0] == identity]:
+            self._size -= len(self._entries.pop(key)[0])
+
+    async def get(self, identity: tuple, pool: _DbPool, sql: str, max_rows: int) -> str | None:
+        if not self.enabled:
+            return None
+        await self._fingerprint(identity, pool)
+        key = (identity, _normalize_sql(sql), max_rows)
+        entry = self._entries.pop(key, None)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            if entry is not None:
+                self._size -= len(entry[0])
+            self.misses += 1
+            return None
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, identity: tuple, sql: str, max_rows: int, text: str) -> None:
+        if not self.enabled or len(text) > self.max_bytes:
+            return
+        key = (identity, _normalize_sql(sql), max_rows)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous[0])
+        self._entries[key] = (text, time.monotonic())
+        self._size += len(text)
+        while self._size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._size -= len(self._entries.pop(oldest)[0])
+
+
+_DB_RESULTS = _DbResultCache(
+    ttl=float(os.environ.get("DB_CACHE_TTL_SECONDS", "300") or 0),
+    max_bytes=int(float(os.environ.get("DB_CACHE_MB", "16") or 0) * 1024 * 1024),
+    check_seconds=float(os.environ.get("DB_SCHEMA_CHECK_SECONDS", "2") or 0),
+)
+
+
+def _format_db_value(value: object) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+@function_tool
+async def db_query(sql: str, max_rows: int = 200) -> str:
+    """
+    Run a read-only SQL query against the configured database.
+    MySQL requires DB_HOST, DB_PORT, DB_USER, DB_NAME, and DB_PASSWORD (or MYSQL_PWD) in env.
+    Without DB_HOST, queries run against an in-memory sandbox loaded from db/migrations and db/seeds.
+    DB_DRIVER=sqlite queries the file at DB_SQLITE_PATH instead.
+    Only SELECT/SHOW/DESCRIBE/EXPLAIN/WITH are allowed.
+    At most max_rows rows (0 = no row limit) and DB_QUERY_MAX_BYTES of output are returned.
+    """
+    if not _is_read_only_sql(sql):
+        return "Error: only single-statement read-only SQL is allowed."
 
-    lines = result.stdout.splitlines()
-    if max_rows and len(lines) > max_rows + 1:
-        lines = lines[: max_rows + 1]
-        lines.append("... (truncated)")
-    return "\n".join(lines).strip() or "(no rows)"
+    config = _db_config()
+    error = _db_config_error(config)
+    if error:
+        return error
+
+    max_rows = max(0, max_rows)
+    pool = _db_pool(config)
+    identity = tuple(sorted((k, v) for k, v in config.items() if k != "password"))
+    buffer = _RowBuffer(max_rows, DB_QUERY_MAX_BYTES)
+    # One extra row is requested so truncation can be reported.
+    limited_sql = _limit_sql(sql, max_rows + 1 if max_rows else 0)
+    cacheable = config["driver"] == "sandbox" or _is_introspection_sql(sql)
+    with _span("db_query", "db", driver=config["driver"]) as span:
+        try:
+            cached = await _DB_RESULTS.get(identity, pool, sql, max_rows) if cacheable else None
+            if cached is not None:
+                if span is not None:
+                    span["attrs"]["cache_hit"] = True
+                return cached
+            await pool.execute(limited_sql, buffer)
+        except _DbQueryError as exc:
+            if span is not None:
+                span["error"] = type(exc).__name__
+            return f"Error: {exc}"
+        if span is not None:
+            span["attrs"].update(cache_hit=False, rows=buffer.rows, truncated=buffer.truncated)
+
+    lines = buffer.lines
+    if buffer.truncated:
+        lines = lines + ["... (truncated)"]
+    text = "\n".join(lines).strip() or "(no rows)"
+    if buffer.notes:
+        text = "\n".join([text] + buffer.notes)
+    if cacheable:
+        _DB_RESULTS.put(identity, sql, max_rows, text)
+    return text
 
 
 def _find_repo_root(start_path: str) -> str | None:
-    current = os.path.abspath(start_path)
+    start = os.path.abspath(start_path)
+    if start not in _DOCUMENTS.repo_roots:
+        _DOCUMENTS.repo_roots[start] = _search_repo_root(start)
+    return _DOCUMENTS.repo_roots[start]
+
+
+def _search_repo_root(start: str) -> str | None:
+    current = start
     for _ in range(6):
         if os.path.isdir(os.path.join(current, "tasks")) and os.path.isdir(
             os.path.join(current, "docs")
@@ -517,7 +2900,7 @@ def _find_repo_root(start_path: str) -> str | None:
 
 
 def _append_changelog(note: str) -> None:
-    repo_root = _find_repo_root(os.getcwd())
+    repo_root = _find_repo_root(_project_root())
     if not repo_root:
         return
     changelog_path = os.path.join(repo_root, "logs", "CHANGELOG.md")
@@ -527,14 +2910,212 @@ def _append_changelog(note: str) -> None:
         _write_text(changelog_path, "# Changelog\n\n## Unreleased\n")
     with open(changelog_path, "a", encoding="utf-8") as handle:
         handle.write(line)
+    _DOCUMENTS.invalidate(changelog_path)
 
 
-def _require_approval(agent_id: str, role: str, written: list[str]) -> None:
-    if not APPROVAL_REQUIRED:
-        return
-    mode = os.environ.get("APPROVAL_MODE", "cli").strip().lower()
-    if mode == "dashboard":
+def _inotify_fd(directory: str) -> int | None:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_decision(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            decision = json.load(handle)
+    except Exception:
+        return ""
+    return str(decision.get("status", "")).lower()
+
+
+async def _wait_for_decision_file(path: str) -> str:
+    # Wakes on inotify events for the approvals directory. Polling stays on as
+    # a slow safety net (and is the only mechanism where inotify is missing).
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    fd = _inotify_fd(os.path.dirname(path))
+
+    def drain() -> None:
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        changed.set()
+
+    poll_seconds = APPROVAL_POLL_SECONDS
+    if fd is not None:
+        loop.add_reader(fd, drain)
+        poll_seconds = max(poll_seconds, 5.0)
+    try:
+        while True:
+            changed.clear()
+            status = _read_decision(path)
+            if status in {"approved", "rejected"}:
+                return status
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if fd is not None:
+            loop.remove_reader(fd)
+            os.close(fd)
+
+
+class _ApprovalRejected(SystemExit):
+    pass
+
+
+class _ApprovalGate:
+    # Approval gates that never block the event loop. Dashboard decisions
+    # arrive as approvals/<id>.json; CLI answers are read from stdin; and,
+    # when APPROVAL_SOCKET is set, "approve <id>" / "reject <id>" lines on that
+    # Unix socket resolve any pending gate in either mode.
+    def __init__(self) -> None:
+        self._pending: dict[str, asyncio.Future] = {}
+        self._cli_lock = asyncio.Lock()
+        self._stdin: asyncio.StreamReader | None = None
+        self._server: asyncio.AbstractServer | None = None
+        self.wait_seconds: dict[tuple[str, str], float] = {}
+
+    async def start(self) -> None:
+        socket_path = os.environ.get("APPROVAL_SOCKET", "").strip()
+        if not APPROVAL_REQUIRED or not socket_path:
+            return
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=socket_path)
+        logging.getLogger(__name__).info("Approval socket listening on %s", socket_path)
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            socket_path = os.environ.get("APPROVAL_SOCKET", "").strip()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
+
+    def waits(self, project_root: str) -> dict[str, float]:
+        return {agent_id: waited for (root, agent_id), waited in self.wait_seconds.items() if root == project_root}
+
+    def resolve(self, approval_id: str, status: str) -> bool:
+        future = self._pending.get(approval_id)
+        if future is None or future.done():
+            return False
+        future.set_result(status)
+        return True
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while line := await reader.readline():
+                parts = line.decode("utf-8", errors="replace").split()
+                if len(parts) == 2 and parts[0].lower() in {"approve", "reject"}:
+                    status = "approved" if parts[0].lower() == "approve" else "rejected"
+                    reply = "ok" if self.resolve(parts[1], status) else "unknown"
+                elif parts and parts[0].lower() == "pending":
+                    reply = " ".join(sorted(self._pending)) or "none"
+                else:
+                    reply = "error: expected 'approve <id>', 'reject <id>' or 'pending'"
+                writer.write(f"{reply}\n".encode("utf-8"))
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def _readline(self, prompt: str) -> str:
+        _EVENTS.flush()
+        print(prompt, end="", flush=True)
+        if self._stdin is None:
+            loop = asyncio.get_running_loop()
+            reader = asyncio.StreamReader()
+            try:
+                await loop.connect_read_pipe(
+                    lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+                )
+            except (OSError, ValueError, NotImplementedError):
+                line = await asyncio.to_thread(sys.stdin.readline)
+                if not line:
+                    raise SystemExit("Approval input closed. Exiting workflow.")
+                return line
+            self._stdin = reader
+        line = await self._stdin.readline()
+        if not line:
+            raise SystemExit("Approval input closed. Exiting workflow.")
+        return line.decode("utf-8", errors="replace")
+
+    async def _prompt_cli(self, role: str, written: list[str], decision: asyncio.Future) -> None:
+        label = _PROJECT_LABEL.get()
+        print(f"\nApproval gate: {role}" + (f" ({label})" if label else ""))
+        if written:
+            for path in written:
+                print(f"- {path}")
+        while not decision.done():
+            response = (await self._readline("Approve this output? (y/n): ")).strip().lower()
+            if response in {"y", "yes"}:
+                status = "approved"
+            elif response in {"n", "no"}:
+                status = "rejected"
+            else:
+                print("Please enter y or n.")
+                continue
+            if not decision.done():
+                decision.set_result(status)
+
+    async def request(self, agent_id: str, role: str, written: list[str]) -> None:
+        if not APPROVAL_REQUIRED:
+            return
+        mode = os.environ.get("APPROVAL_MODE", "cli").strip().lower()
         approval_id = uuid.uuid4().hex
+        decision = asyncio.get_running_loop().create_future()
+        self._pending[approval_id] = decision
+        started = time.monotonic()
+        try:
+            if mode == "dashboard":
+                status = await self._wait_dashboard(approval_id, agent_id, role, written, decision)
+            else:
+                async with self._cli_lock:
+                    started = time.monotonic()
+                    prompt = asyncio.create_task(self._prompt_cli(role, written, decision))
+                    try:
+                        status = await decision
+                    finally:
+                        prompt.cancel()
+        finally:
+            self._pending.pop(approval_id, None)
+            waited = time.monotonic() - started
+            key = (_project_root(), agent_id)
+            self.wait_seconds[key] = self.wait_seconds.get(key, 0.0) + waited
+            _agent_log(agent_id, f"Approval gate waited {waited:.1f}s.")
+        if status == "approved":
+            if mode == "dashboard":
+                _agent_log(agent_id, "Approval granted.")
+                _agent_status(agent_id, "idle", "Approved")
+            return
+        if mode == "dashboard":
+            _agent_log(agent_id, "Approval rejected.")
+        raise _ApprovalRejected("Approval rejected. Exiting workflow.")
+
+    async def _wait_dashboard(
+        self,
+        approval_id: str,
+        agent_id: str,
+        role: str,
+        written: list[str],
+        decision: asyncio.Future,
+    ) -> str:
         payload = {
             "id": approval_id,
             "agentId": agent_id,
@@ -543,67 +3124,172 @@ def _require_approval(agent_id: str, role: str, written: list[str]) -> None:
             "summary": f"{role} produced {len(written)} file(s).",
             "createdAt": datetime.utcnow().isoformat() + "Z",
         }
-        print(f"APPROVAL_REQUEST|{json.dumps(payload, ensure_ascii=True)}", flush=True)
-        _agent_status(agent_id, "waiting_approval", "Awaiting approval")
-        _agent_log(agent_id, f"Approval requested ({approval_id}).")
-
-        approvals_dir = os.path.join(os.getcwd(), "approvals")
+        approvals_dir = os.path.join(_project_root(), "approvals")
         os.makedirs(approvals_dir, exist_ok=True)
         decision_path = os.path.join(approvals_dir, f"{approval_id}.json")
+        watcher = asyncio.create_task(_wait_for_decision_file(decision_path))
+        watcher.add_done_callback(
+            lambda task: task.cancelled() or task.exception() or self.resolve(approval_id, task.result())
+        )
+
+        _EVENTS.emit("approval_request", agent_id, payload, urgent=True)
+        _agent_status(agent_id, "waiting_approval", "Awaiting approval")
+        _agent_log(agent_id, f"Approval requested ({approval_id}).")
 
         timeout = int(os.environ.get("APPROVAL_TIMEOUT_SECONDS", "0") or 0)
-        started = time.time()
-        while True:
-            if os.path.exists(decision_path):
-                try:
-                    with open(decision_path, "r", encoding="utf-8") as handle:
-                        decision = json.load(handle)
-                except Exception:
-                    decision = {}
-                status = str(decision.get("status", "")).lower()
-                if status == "approved":
-                    _agent_log(agent_id, "Approval granted.")
-                    _agent_status(agent_id, "idle", "Approved")
-                    return
-                if status == "rejected":
-                    _agent_log(agent_id, "Approval rejected.")
-                    raise SystemExit("Approval rejected. Exiting workflow.")
-            if timeout and time.time() - started > timeout:
-                raise SystemExit("Approval timed out. Exiting workflow.")
-            time.sleep(2)
-
-    print(f"\nApproval gate: {role}")
-    if written:
-        for path in written:
-            print(f"- {path}")
-    while True:
-        response = input("Approve this output? (y/n): ").strip().lower()
-        if response in {"y", "yes"}:
+        try:
+            return await asyncio.wait_for(asyncio.shield(decision), timeout=timeout or None)
+        except asyncio.TimeoutError:
+            raise SystemExit("Approval timed out. Exiting workflow.")
+        finally:
+            watcher.cancel()
+
+
+class _EventEmitter:
+    # Versioned JSON-lines event stream for the dashboard. Events are queued
+    # and written in batches by a periodic flusher; a full queue is flushed
+    # inline (back-pressure instead of dropping). The sink is stdout unless
+    # AGENT_EVENTS_FD (an inherited file descriptor) or AGENT_EVENTS_SOCKET
+    # (a Unix socket path) is set. AGENT_EVENT_PROTOCOL=legacy restores the
+    # old pipe-delimited AGENT_* lines.
+    def __init__(self) -> None:
+        self.protocol = os.environ.get("AGENT_EVENT_PROTOCOL", "jsonl").strip().lower()
+        self.max_queue = int(os.environ.get("AGENT_EVENTS_MAX_QUEUE", "256") or 256)
+        self.flush_seconds = int(os.environ.get("AGENT_EVENTS_FLUSH_MS", "50") or 50) / 1000.0
+        self._seq = 0
+        self._queue: list[str] = []
+        self._write: Callable[[bytes], None] | None = None
+        self._flusher: asyncio.Task | None = None
+
+    def emit(self, event_type: str, stage: str | None, payload: dict, urgent: bool = False) -> None:
+        if self.protocol == "legacy":
+            line = self._legacy_line(event_type, stage, payload)
+            if line:
+                print(line, flush=True)
             return
-        if response in {"n", "no"}:
-            raise SystemExit("Approval rejected. Exiting workflow.")
-        print("Please enter y or n.")
+        self._seq += 1
+        event = {
+            "v": EVENT_PROTOCOL_VERSION,
+            "seq": self._seq,
+            "ts": round(time.time() * 1000),
+            "stage": stage,
+            "type": event_type,
+            "payload": payload,
+        }
+        label = _PROJECT_LABEL.get()
+        if label:
+            event["project"] = label
+        self._queue.append(json.dumps(event, ensure_ascii=True, separators=(",", ":")))
+        if urgent or self._flusher is None or len(self._queue) >= self.max_queue:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._queue:
+            return
+        data = ("\n".join(self._queue) + "\n").encode("utf-8")
+        self._queue = []
+        if self._write is None:
+            self._write = self._open_sink()
+        self._write(data)
+
+    async def start(self) -> None:
+        if self.protocol != "legacy" and self._flusher is None:
+            self._flusher = asyncio.create_task(self._run_flusher(), name="event-flusher")
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        self.flush()
+
+    async def _run_flusher(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.flush()
+
+    def _open_sink(self) -> Callable[[bytes], None]:
+        fd_value = os.environ.get("AGENT_EVENTS_FD", "").strip()
+        socket_path = os.environ.get("AGENT_EVENTS_SOCKET", "").strip()
+        if fd_value:
+            fd = int(fd_value)
+
+            def write_fd(data: bytes) -> None:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+
+            return write_fd
+        if socket_path:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(socket_path)
+            return client.sendall
+
+        def write_stdout(data: bytes) -> None:
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+
+        return write_stdout
+
+    @staticmethod
+    def _legacy_line(event_type: str, stage: str | None, payload: dict) -> str | None:
+        if event_type == "status":
+            return f"AGENT_STATUS|{stage}|{payload['status']}|{payload['step']}"
+        if event_type == "log":
+            return f"AGENT_LOG|{stage}|{payload['message']}"
+        if event_type == "tokens":
+            return f"AGENT_TOKENS|{stage}|{payload['tokens']}"
+        if event_type == "approval_request":
+            return f"APPROVAL_REQUEST|{json.dumps(payload, ensure_ascii=True)}"
+        if event_type == "file":
+            return f"AGENT_LOG|{stage}|Wrote {payload['path']}"
+        return None
+
+
+_EVENTS = _EventEmitter()
 
 
 def _agent_status(agent_id: str, status: str, step: str) -> None:
-    print(f"AGENT_STATUS|{agent_id}|{status}|{step}", flush=True)
+    _EVENTS.emit("status", agent_id, {"status": status, "step": step})
 
 
 def _agent_log(agent_id: str, message: str) -> None:
-    print(f"AGENT_LOG|{agent_id}|{message}", flush=True)
+    _EVENTS.emit("log", agent_id, {"message": message})
 
 
 def _agent_tokens(agent_id: str, tokens: int) -> None:
-    print(f"AGENT_TOKENS|{agent_id}|{tokens}", flush=True)
+    _EVENTS.emit("tokens", agent_id, {"tokens": tokens})
 
 
-def _sum_tokens(result) -> int:
-    total = 0
-    for response in getattr(result, "raw_responses", []) or []:
-        usage = getattr(response, "usage", None)
-        if usage is not None:
-            total += int(getattr(usage, "total_tokens", 0) or 0)
-    return total
+def _agent_file(agent_id: str, path: str, size: int) -> None:
+    _EVENTS.emit("file", agent_id, {"path": path, "bytes": size})
+
+
+def _cache_hit_rate(cached: int, input_tokens: int) -> str:
+    if not input_tokens:
+        return "n/a"
+    return f"{100.0 * cached / input_tokens:.1f}%"
+
+
+def _log_prompt_cache_summary(usage_by_stage: dict[str, tuple[int, int]]) -> None:
+    logger = logging.getLogger(__name__)
+    cached = sum(stage_cached for stage_cached, _ in usage_by_stage.values())
+    input_tokens = sum(stage_input for _, stage_input in usage_by_stage.values())
+    for agent_id, (stage_cached, stage_input) in usage_by_stage.items():
+        logger.info(
+            "Prompt cache %s: cached=%s uncached=%s hit=%s",
+            agent_id,
+            stage_cached,
+            stage_input - stage_cached,
+            _cache_hit_rate(stage_cached, stage_input),
+        )
+    logger.info(
+        "Prompt cache total: cached=%s uncached=%s hit=%s",
+        cached,
+        input_tokens - cached,
+        _cache_hit_rate(cached, input_tokens),
+    )
 
 
 def _blazor_constraints() -> str:
@@ -627,16 +3313,977 @@ def _common_file_instructions() -> str:
     return "Do not include any extra text outside the file blocks. Do not wrap file contents in triple backticks."
 
 
+class _ResponseCache:
+    # Content-addressed store of stage results under .agent_cache/responses.
+    # File mtimes double as the LRU clock: hits touch the entry, and writes
+    # evict the least recently used entries once the directory exceeds
+    # max_bytes.
+    def __init__(self, root: str, max_bytes: int, enabled: bool, refresh: set[str]) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.refresh = refresh
+        # agent_id -> (key, entry) of the output each stage used this run.
+        self.produced: dict[str, tuple[str, dict]] = {}
+
+    def key(self, agent: Agent, run_config: RunConfig, input_items: list[dict]) -> str:
+        model_settings = agent.model_settings.resolve(run_config.model_settings)
+        instructions = agent.instructions
+        material = {
+            "instructions": instructions if isinstance(instructions, str) else repr(instructions),
+            "model": str(run_config.model or agent.model),
+            "model_settings": model_settings.to_json_dict(),
+            "tools": [getattr(tool, "name", type(tool).__name__) for tool in agent.tools],
+            "input": input_items,
+        }
+        encoded = json.dumps(material, sort_keys=True, ensure_ascii=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, agent_id: str, key: str) -> dict | None:
+        if not self.enabled or agent_id in self.refresh:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                entry = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, entry: dict) -> None:
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(self.root, exist_ok=True)
+        _replace_file(path, json.dumps(entry, ensure_ascii=True))
+        self._evict(keep=path)
+
+    def discard(self, key: str | None) -> None:
+        if key is None:
+            return
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+        self.produced = {agent_id: entry for agent_id, entry in self.produced.items() if entry[0] != key}
+
+    def _evict(self, keep: str) -> None:
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def _hash_paths(paths: tuple[str, ...] | list[str]) -> dict[str, str | None]:
+    # Content hashes of project-relative files; a trailing "/" hashes every
+    # file below it. Missing files hash to None so their appearance counts
+    # as a change.
+    root = _project_root()
+    hashes: dict[str, str | None] = {}
+    for rel_path in paths:
+        if rel_path.endswith("/"):
+            base = os.path.join(root, rel_path)
+            for directory, subdirs, names in os.walk(base):
+                subdirs[:] = sorted(name for name in subdirs if name not in MANIFEST_SKIP_DIRS)
+                for name in sorted(names):
+                    path = os.path.join(directory, name)
+                    hashes[os.path.relpath(path, root)] = _hash_file(path)
+            continue
+        hashes[rel_path] = _hash_file(os.path.join(root, rel_path))
+    return hashes
+
+
+def _hash_file(path: str) -> str | None:
+    digest = hashlib.sha256()
+    try:
+        with open(path, "rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def _stage_fingerprint(stage: "_Stage", run_config: RunConfig, response_cache: _ResponseCache) -> str:
+    # Everything that decides a stage's output: the exact request (as keyed
+    # by the response cache) plus its declared inputs, including directory
+    # inputs that never reach the payload.
+    stage_config = _stage_run_config(run_config, stage.agent_id)
+    stage_input = _base_input_items() + _user_message(stage.build_payload())
+    material = {
+        "request": response_cache.key(stage.agent, stage_config, stage_input),
+        "inputs": _hash_paths(stage.inputs),
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class _StageManifest:
+    # Build-system view of the last run in .agent_cache/manifest.json: per
+    # stage, its fingerprint and the hashes of the files it wrote. Both are
+    # taken when the run ends, after downstream stages and the workflow
+    # itself (CHANGELOG, README) have touched shared files, so an untouched
+    # project fingerprints the same next time. With --incremental a stage
+    # whose fingerprint matches and whose files are unchanged on disk is
+    # skipped; a stage that does run changes the input hashes of the stages
+    # reading its files, which is how real changes cascade downstream.
+    VERSION = 1
+
+    def __init__(self, path: str, enabled: bool, refresh: set[str]) -> None:
+        self.path = path
+        self.enabled = enabled
+        self.refresh = refresh
+        self.finished: dict[str, list[str]] = {}
+        self.skipped: list[str] = []
+        self.stages: dict[str, dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                manifest = json.load(handle)
+            if manifest.get("version") == self.VERSION:
+                self.stages = manifest["stages"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def up_to_date(self, agent_id: str, fingerprint: str) -> bool:
+        entry = self.stages.get(agent_id)
+        if not self.enabled or agent_id in self.refresh or entry is None:
+            return False
+        if entry["fingerprint"] != fingerprint:
+            return False
+        return _hash_paths(list(entry["outputs"])) == entry["outputs"]
+
+    def outputs(self, agent_id: str) -> list[str]:
+        return list(self.stages[agent_id]["outputs"])
+
+    def finish(self, agent_id: str, written: list[str], skipped: bool = False) -> None:
+        if skipped:
+            self.skipped.append(agent_id)
+        self.finished[agent_id] = written
+
+    def save(self, fingerprints: dict[str, str]) -> None:
+        for agent_id, written in self.finished.items():
+            self.stages[agent_id] = {
+                "fingerprint": fingerprints[agent_id],
+                "outputs": _hash_paths(written),
+                "builtAt": self.stages.get(agent_id, {}).get("builtAt")
+                if agent_id in self.skipped
+                else datetime.utcnow().isoformat() + "Z",
+            }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _replace_file(self.path, json.dumps({"version": self.VERSION, "stages": self.stages}, indent=2))
+
+
+class _RunJournal:
+    # Crash-safe checkpoint of one run in .agent_cache/runs/<run_id>.json.
+    # The file is replaced atomically when a stage commits its files (output
+    # hashes and usage) and again when it is approved, so a run killed at
+    # any point leaves a consistent record of every stage that got that far.
+    # --resume restores the stages of the newest run if it did not complete;
+    # --resume-from <stage> restores the stages declared before <stage> from
+    # the newest run of any kind. A stage is only restored while its files
+    # on disk still match the journal; one that was committed but never
+    # approved goes straight back to approval without regenerating, and one
+    # that was rejected is never restored.
+    def __init__(self, root: str, run_id: str) -> None:
+        self.directory = os.path.join(root, CACHE_DIR, "runs")
+        self.path = os.path.join(self.directory, f"{run_id}.json")
+        self.state: dict = {
+            "runId": run_id,
+            "status": "running",
+            "startedAt": datetime.utcnow().isoformat() + "Z",
+            "resumedFrom": None,
+            "stages": {},
+        }
+        self.restored: dict[str, dict] = {}
+
+    def restore(self, stage_ids: list[str], resume_from: str | None = None) -> None:
+        logger = logging.getLogger(__name__)
+        previous = self._latest()
+        if previous is None:
+            logger.warning("No earlier run journal in %s; running every stage.", self.directory)
+            return
+        if resume_from is None and previous["status"] == "completed":
+            logger.warning("Run %s completed; nothing to resume.", previous["runId"])
+            return
+        keep = stage_ids[: stage_ids.index(resume_from)] if resume_from else stage_ids
+        for agent_id in keep:
+            entry = previous["stages"].get(agent_id)
+            if entry is None:
+                continue
+            if entry.get("rejected"):
+                logger.info("Not restoring %s: its output was rejected in run %s.", agent_id, previous["runId"])
+                continue
+            if _hash_paths(list(entry["outputs"])) != entry["outputs"]:
+                logger.warning("Not restoring %s: its files changed since run %s.", agent_id, previous["runId"])
+                continue
+            self.restored[agent_id] = entry
+            self.state["stages"][agent_id] = entry | {"restoredFrom": previous["runId"]}
+        self.state["resumedFrom"] = previous["runId"]
+        saved = sum((entry.get("usage") or {}).get("cost_usd") or 0.0 for entry in self.restored.values())
+        logger.info(
+            "Resuming run %s (%s): restored %s; about $%.4f of model spend reused.",
+            previous["runId"],
+            previous["status"],
+            ", ".join(self.restored) or "no stages",
+            saved,
+        )
+        self._save()
+
+    def committed(
+        self,
+        agent_id: str,
+        written: list[str],
+        usage: dict | None,
+        skipped: bool = False,
+        cache_key: str | None = None,
+    ) -> None:
+        self.state["stages"][agent_id] = {
+            "outputs": _hash_paths(written),
+            "usage": usage,
+            "approved": False,
+            "rejected": False,
+            "skipped": skipped,
+            "cacheKey": cache_key,
+            "committedAt": datetime.utcnow().isoformat() + "Z",
+        }
+        self._rehash()
+        self._save()
+
+    def approved(self, agent_id: str) -> None:
+        self.state["stages"][agent_id]["approved"] = True
+        self._save()
+
+    def rejected(self, agent_id: str) -> None:
+        self.state["stages"][agent_id]["rejected"] = True
+        self._save()
+
+    def close(self, status: str, error: str | None = None) -> None:
+        self.state["status"] = status
+        self.state["error"] = error
+        self.state["endedAt"] = datetime.utcnow().isoformat() + "Z"
+        self._rehash()
+        self._save()
+        journals = sorted(name for name in os.listdir(self.directory) if name.endswith(".json"))
+        for name in journals[:-RUN_JOURNAL_KEEP]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def _rehash(self) -> None:
+        # Later stages and the workflow itself (CHANGELOG, README) rewrite
+        # files an earlier stage committed; the journal tracks the tree as the
+        # run left it, not as each stage first wrote it.
+        for entry in self.state["stages"].values():
+            entry["outputs"] = _hash_paths(list(entry["outputs"]))
+
+    def _latest(self) -> dict | None:
+        try:
+            names = sorted((name for name in os.listdir(self.directory) if name.endswith(".json")), reverse=True)
+        except OSError:
+            return None
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if path == self.path:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as handle:
+                    return json.load(handle)
+            except (OSError, ValueError):
+                continue
+        return None
+
+    def _save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        _replace_file(self.path, json.dumps(self.state, indent=2))
+
+
+def _usage_summary(result) -> dict:
+    summary = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+    for response in getattr(result, "raw_responses", []) or []:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            continue
+        summary["input_tokens"] += int(getattr(usage, "input_tokens", 0) or 0)
+        summary["output_tokens"] += int(getattr(usage, "output_tokens", 0) or 0)
+        summary["total_tokens"] += int(getattr(usage, "total_tokens", 0) or 0)
+        details = getattr(usage, "input_tokens_details", None)
+        summary["cached_tokens"] += int(getattr(details, "cached_tokens", 0) or 0)
+    return summary
+
+
+def _item_field(item: object, name: str) -> object:
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+def _model_cost(
+    prices: dict[str, dict[str, float]], model: str, input_tokens: int, cached_tokens: int, output_tokens: int
+) -> float | None:
+    rates = prices.get(model)
+    if rates is None:
+        return None
+    cached_rate = rates.get("cached_input", rates.get("input", 0.0))
+    return (
+        (input_tokens - cached_tokens) * rates.get("input", 0.0)
+        + cached_tokens * cached_rate
+        + output_tokens * rates.get("output", 0.0)
+    ) / 1_000_000
+
+
+def _load_model_prices() -> dict[str, dict[str, float]]:
+    prices = {model: dict(rates) for model, rates in MODEL_PRICES.items()}
+    path = os.environ.get("AGENT_PRICE_TABLE", "").strip()
+    if path:
+        try:
+            with open(path, "r", encoding="utf-8") as handle:
+                overrides = json.load(handle)
+        except (OSError, ValueError) as exc:
+            logging.getLogger(__name__).warning("Ignoring price table %s: %s", path, exc)
+        else:
+            for model, rates in overrides.items():
+                prices.setdefault(model, {}).update(rates)
+    return prices
+
+
+class _UsageLedger:
+    # Per-run token and cost accounting. Every model turn is recorded with
+    # its input, cached-input, output and reasoning tokens; every tool call
+    # with the turn that issued it, its duration and the size of the result
+    # fed back into the next turn. Costs come from the price table; models
+    # missing from it are reported with a null cost.
+    def __init__(self, run_id: str, prices: dict[str, dict[str, float]]) -> None:
+        self.run_id = run_id
+        self.prices = prices
+        self.started_at = datetime.utcnow().isoformat() + "Z"
+        self.turns: list[dict] = []
+        self.tool_calls: list[dict] = []
+        self.stages: dict[str, dict] = {}
+        self._pending_tools: dict[tuple[str, str], tuple[dict, float]] = {}
+
+    def cost(self, model: str, input_tokens: int, cached_tokens: int, output_tokens: int) -> float | None:
+        return _model_cost(self.prices, model, input_tokens, cached_tokens, output_tokens)
+
+    def tool_called(self, agent_id: str, item: object) -> None:
+        call_id = str(_item_field(item, "call_id") or _item_field(item, "id") or "")
+        call = {
+            "stage": agent_id,
+            "turn": None,
+            "call_id": call_id,
+            "tool": _item_field(item, "name") or _item_field(item, "type") or "tool",
+            "seconds": None,
+            "result_chars": 0,
+            "result_tokens": 0,
+        }
+        self.tool_calls.append(call)
+        self._pending_tools[(agent_id, call_id)] = (call, time.monotonic())
+
+    def tool_output(self, agent_id: str, item: object, output: object) -> None:
+        call_id = str(_item_field(item, "call_id") or "")
+        pending = self._pending_tools.pop((agent_id, call_id), None)
+        if pending is None:
+            return
+        call, started = pending
+        text = output if isinstance(output, str) else json.dumps(output, default=str)
+        call["seconds"] = round(time.monotonic() - started, 3)
+        call["result_chars"] = len(text)
+        call["result_tokens"] = _estimate_tokens(text)
+
+    def record_result(self, agent_id: str, model: str, result) -> None:
+        # Turn numbers count from 1 within a stage. Tool calls are matched to
+        # the turn whose output issued them; hosted tools (web search) never
+        # produce a tool_output event and are only recorded here.
+        first = sum(1 for turn in self.turns if turn["stage"] == agent_id)
+        for offset, response in enumerate(getattr(result, "raw_responses", []) or []):
+            usage = getattr(response, "usage", None)
+            input_tokens = int(getattr(usage, "input_tokens", 0) or 0)
+            output_tokens = int(getattr(usage, "output_tokens", 0) or 0)
+            cached_tokens = int(getattr(getattr(usage, "input_tokens_details", None), "cached_tokens", 0) or 0)
+            reasoning_tokens = int(
+                getattr(getattr(usage, "output_tokens_details", None), "reasoning_tokens", 0) or 0
+            )
+            call_ids = [
+                str(_item_field(item, "call_id") or _item_field(item, "id"))
+                for item in getattr(response, "output", []) or []
+                if str(_item_field(item, "type") or "").endswith("_call")
+            ]
+            turn = {
+                "stage": agent_id,
+                "turn": first + offset + 1,
+                "model": model,
+                "response_id": getattr(response, "response_id", None),
+                "input_tokens": input_tokens,
+                "cached_tokens": cached_tokens,
+                "output_tokens": output_tokens,
+                "reasoning_tokens": reasoning_tokens,
+                "cost_usd": self.cost(model, input_tokens, cached_tokens, output_tokens),
+                "tool_calls": call_ids,
+            }
+            self.turns.append(turn)
+            known = {call["call_id"] for call in self.tool_calls if call["stage"] == agent_id}
+            for item in getattr(response, "output", []) or []:
+                call_id = str(_item_field(item, "call_id") or _item_field(item, "id"))
+                if call_id in call_ids and call_id not in known:
+                    self.tool_called(agent_id, item)
+            for call in self.tool_calls:
+                if call["stage"] == agent_id and call["call_id"] in call_ids:
+                    call["turn"] = turn["turn"]
+            _EVENTS.emit("usage", agent_id, turn)
+        self._pending_tools = {
+            key: value for key, value in self._pending_tools.items() if key[0] != agent_id
+        }
+
+    def record_cached_response(self, agent_id: str, saved: dict) -> None:
+        self.stages.setdefault(agent_id, {})["response_cache_saved_tokens"] = int(
+            saved.get("total_tokens", 0) or 0
+        )
+
+    def stage_totals(self) -> dict[str, dict]:
+        totals: dict[str, dict] = {}
+        for record in [{"stage": agent_id} for agent_id in self.stages] + self.turns + self.tool_calls:
+            totals.setdefault(
+                record["stage"],
+                {
+                    "turns": 0,
+                    "tool_calls": 0,
+                    "input_tokens": 0,
+                    "cached_tokens": 0,
+                    "output_tokens": 0,
+                    "reasoning_tokens": 0,
+                    "cost_usd": 0.0,
+                    **self.stages.get(record["stage"], {}),
+                },
+            )
+        for turn in self.turns:
+            stage = totals[turn["stage"]]
+            stage["turns"] += 1
+            for key in ("input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens"):
+                stage[key] += turn[key]
+            if turn["cost_usd"] is None or stage["cost_usd"] is None:
+                stage["cost_usd"] = None
+            else:
+                stage["cost_usd"] += turn["cost_usd"]
+        for call in self.tool_calls:
+            totals[call["stage"]]["tool_calls"] += 1
+        for stage in totals.values():
+            if stage["cost_usd"] is not None:
+                stage["cost_usd"] = round(stage["cost_usd"], 6)
+        return totals
+
+    def cache_usage(self) -> dict[str, tuple[int, int]]:
+        return {
+            agent_id: (stage["cached_tokens"], stage["input_tokens"])
+            for agent_id, stage in self.stage_totals().items()
+        }
+
+    def report(self) -> dict:
+        stages = self.stage_totals()
+        costs = [stage.get("cost_usd") for stage in stages.values()]
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": datetime.utcnow().isoformat() + "Z",
+            "prices": self.prices,
+            "totals": {
+                key: sum(stage[key] for stage in stages.values())
+                for key in ("turns", "tool_calls", "input_tokens", "cached_tokens", "output_tokens", "reasoning_tokens")
+            }
+            | {"cost_usd": None if None in costs else round(sum(costs), 6)},
+            "stages": stages,
+            "turns": self.turns,
+            "tool_calls": self.tool_calls,
+        }
+
+    def write(self, root: str) -> str:
+        report = self.report()
+        directory = os.path.join(root, CACHE_DIR, "usage")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.run_id}.json")
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2)
+        _EVENTS.emit("usage_summary", None, report["totals"] | {"report": path})
+        return path
+
+
+@dataclass
+class _Stage:
+    agent_id: str
+    role: str
+    agent: Agent
+    running_step: str
+    start_message: str
+    done_message: str
+    # Project-relative paths the stage reads and writes. A trailing "/" marks a
+    # whole directory. The scheduler derives the dependency graph from these.
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+    build_payload: Callable[[], str]
+
+
+def _doc_inputs(paths: list[str]) -> tuple[str, ...]:
+    return tuple(f"docs/{doc}" for doc in paths)
+
+
+def _paths_overlap(left: str, right: str) -> bool:
+    if left == right:
+        return True
+    if left.endswith("/") and right.startswith(left):
+        return True
+    return right.endswith("/") and left.startswith(right)
+
+
+def _any_paths_overlap(left: tuple[str, ...], right: tuple[str, ...]) -> bool:
+    return any(_paths_overlap(a, b) for a in left for b in right)
+
+
+def _stage_dependencies(stages: list[_Stage]) -> dict[str, set[str]]:
+    # Declaration order is the reference order. A later stage depends on an
+    # earlier one when it reads what the earlier stage writes, writes what the
+    # earlier stage writes, or overwrites something the earlier stage reads.
+    dependencies: dict[str, set[str]] = {stage.agent_id: set() for stage in stages}
+    for index, stage in enumerate(stages):
+        for earlier in stages[:index]:
+            if (
+                _any_paths_overlap(stage.inputs, earlier.outputs)
+                or _any_paths_overlap(stage.outputs, earlier.outputs)
+                or _any_paths_overlap(stage.outputs, earlier.inputs)
+            ):
+                dependencies[stage.agent_id].add(earlier.agent_id)
+    return dependencies
+
+
+def _critical_path(stages: list[_Stage], dependencies: dict[str, set[str]]) -> list[str]:
+    longest: dict[str, list[str]] = {}
+    for stage in stages:
+        best: list[str] = []
+        for dep in dependencies[stage.agent_id]:
+            if len(longest[dep]) > len(best):
+                best = longest[dep]
+        longest[stage.agent_id] = best + [stage.agent_id]
+    return max(longest.values(), key=len, default=[])
+
+
+def _stage_run_config(run_config: RunConfig, agent_id: str) -> RunConfig:
+    # Requests that share a prompt_cache_key are routed to the same cache
+    # shard. Instructions differ per role, so the key is per role.
+    model_settings = (run_config.model_settings or ModelSettings()).resolve(
+        ModelSettings(extra_args={"prompt_cache_key": f"{MODEL_NAME}:{agent_id}"})
+    )
+    return replace(run_config, model_settings=model_settings)
+
+
+class _StageControl:
+    # Handed to each stage by the scheduler. `slot` bounds concurrent model
+    # calls. A speculative stage starts before its upstream stages are
+    # approved; it writes into shadow_dir, waits in upstream_approved() and
+    # moves its files into the project only once every upstream gate passed.
+    def __init__(
+        self,
+        slot: asyncio.Semaphore,
+        shadow_dir: str | None,
+        upstream: list[asyncio.Future],
+        on_committed: Callable[[], None],
+    ) -> None:
+        self.slot = slot
+        self.shadow_dir = shadow_dir
+        self._upstream = upstream
+        self._on_committed = on_committed
+
+    @property
+    def speculative(self) -> bool:
+        return self.shadow_dir is not None
+
+    async def upstream_approved(self) -> None:
+        if self._upstream:
+            await asyncio.gather(*(asyncio.shield(future) for future in self._upstream))
+
+    def committed(self) -> None:
+        self._on_committed()
+
+
+def _commit_shadow(shadow_dir: str, written: list[str]) -> None:
+    for rel_path in written:
+        target = os.path.join(_project_root(), rel_path)
+        parent = os.path.dirname(target)
+        if parent:
+            _DOCUMENTS.invalidate_dir(parent)
+            os.makedirs(parent, exist_ok=True)
+        os.replace(os.path.join(shadow_dir, rel_path), target)
+        _DOCUMENTS.invalidate(target)
+    shutil.rmtree(shadow_dir, ignore_errors=True)
+
+
+async def _run_stage(
+    stage: _Stage,
+    run_config: RunConfig,
+    approvals: _ApprovalGate,
+    response_cache: _ResponseCache,
+    control: _StageControl,
+    ledger: _UsageLedger,
+    manifest: _StageManifest,
+    journal: _RunJournal,
+) -> None:
+    with _span(stage.agent_id, "stage", track=stage.agent_id, role=stage.role, speculative=control.speculative):
+        restored = journal.restored.get(stage.agent_id)
+        if restored is not None:
+            outputs = list(restored["outputs"])
+            if control.speculative:
+                await control.upstream_approved()
+            control.committed()
+            _agent_log(stage.agent_id, f"Restored {len(outputs)} file(s) from run {journal.state['resumedFrom']}.")
+            if not restored["approved"]:
+                await _approve_stage(stage, outputs, approvals, response_cache, journal, restored=True)
+            manifest.finish(stage.agent_id, outputs, skipped=True)
+            _agent_status(stage.agent_id, "idle", "Restored")
+            return
+        if manifest.enabled and manifest.up_to_date(
+            stage.agent_id, _stage_fingerprint(stage, run_config, response_cache)
+        ):
+            # Nothing this stage reads or wrote has changed since the last
+            # build, so there is nothing new to generate or approve.
+            if control.speculative:
+                await control.upstream_approved()
+            outputs = manifest.outputs(stage.agent_id)
+            manifest.finish(stage.agent_id, outputs, skipped=True)
+            journal.committed(stage.agent_id, outputs, None, skipped=True)
+            journal.approved(stage.agent_id)
+            control.committed()
+            _agent_status(stage.agent_id, "idle", "Up to date")
+            _agent_log(stage.agent_id, "Inputs and outputs unchanged since the last build; skipped.")
+            return
+        try:
+            with _span("queued", "scheduler"):
+                await control.slot.acquire()
+            try:
+                with _span("generate", "model"):
+                    written = await _generate_stage(stage, run_config, response_cache, control, ledger)
+            finally:
+                control.slot.release()
+            if control.speculative:
+                _agent_status(stage.agent_id, "waiting_upstream", "Waiting for upstream approval")
+                with _span("wait_upstream", "scheduler"):
+                    await control.upstream_approved()
+                with _span("commit_shadow", "io", files=len(written)):
+                    _commit_shadow(control.shadow_dir, written)
+                _agent_log(stage.agent_id, f"Committed {len(written)} speculative file(s).")
+        except BaseException:
+            if control.speculative:
+                shutil.rmtree(control.shadow_dir, ignore_errors=True)
+            raise
+        if os.path.relpath(_memory_path(stage.agent_id), _project_root()) in written:
+            _MEMORY.ingest(stage.agent_id)
+        journal.committed(
+            stage.agent_id,
+            written,
+            ledger.stage_totals().get(stage.agent_id),
+            cache_key=response_cache.produced.get(stage.agent_id, (None,))[0],
+        )
+        control.committed()
+        _agent_status(stage.agent_id, "idle", "Done")
+        _agent_log(stage.agent_id, stage.done_message)
+        await _approve_stage(stage, written, approvals, response_cache, journal)
+        manifest.finish(stage.agent_id, written)
+
+
+async def _approve_stage(
+    stage: _Stage,
+    files: list[str],
+    approvals: _ApprovalGate,
+    response_cache: _ResponseCache,
+    journal: _RunJournal,
+    **attrs,
+) -> None:
+    try:
+        with _span("approval", "approval", files=len(files), **attrs):
+            await approvals.request(stage.agent_id, stage.role, files)
+    except _ApprovalRejected:
+        # A rejected output has to be generated afresh: --resume must not
+        # restore it and the response cache must not replay it.
+        journal.rejected(stage.agent_id)
+        response_cache.discard(journal.state["stages"][stage.agent_id].get("cacheKey"))
+        raise
+    journal.approved(stage.agent_id)
+
+
+async def _generate_stage(
+    stage: _Stage,
+    run_config: RunConfig,
+    response_cache: _ResponseCache,
+    control: _StageControl,
+    ledger: _UsageLedger,
+) -> list[str]:
+    stage_config = _stage_run_config(run_config, stage.agent_id)
+    stage_input = _base_input_items() + _user_message(stage.build_payload())
+    cache_key = response_cache.key(stage.agent, stage_config, stage_input)
+    _agent_status(stage.agent_id, "running", stage.running_step)
+    if control.speculative:
+        _agent_log(stage.agent_id, "Starting speculatively on unapproved upstream output.")
+    _agent_log(stage.agent_id, stage.start_message)
+    written: list[str] = []
+    # What each written path held before this stage touched it (None if it
+    # did not exist), so files from a discarded turn can be put back.
+    originals: dict[str, bytes | None] = {}
+    root = control.shadow_dir or _project_root()
+
+    def write_file(path: str, content: str) -> None:
+        rel_path = _clean_rel_path(path)
+        if rel_path and rel_path not in originals:
+            abs_path = os.path.join(root, rel_path)
+            originals[rel_path] = None
+            if os.path.isfile(abs_path):
+                with open(abs_path, "rb") as handle:
+                    originals[rel_path] = handle.read()
+        for rel_path in _write_files({path: content}, root=control.shadow_dir):
+            if rel_path not in written:
+                written.append(rel_path)
+            _agent_file(stage.agent_id, rel_path, len(content.encode("utf-8")))
+
+    def discard_written() -> None:
+        for rel_path, previous in originals.items():
+            abs_path = os.path.join(root, rel_path)
+            if previous is None:
+                try:
+                    os.remove(abs_path)
+                except FileNotFoundError:
+                    pass
+            else:
+                with open(abs_path, "wb") as handle:
+                    handle.write(previous)
+            _DOCUMENTS.invalidate(abs_path)
+        if originals:
+            _agent_log(stage.agent_id, f"Discarded {len(originals)} file(s) written before a tool call.")
+        originals.clear()
+        written.clear()
+
+    parser = _FileStreamParser(write_file)
+    cached_entry = response_cache.get(stage.agent_id, cache_key)
+    entry = cached_entry
+    if cached_entry is not None:
+        parser.feed(cached_entry["final_output"])
+        parser.close()
+        usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+        ledger.record_cached_response(stage.agent_id, cached_entry["usage"])
+        _agent_log(
+            stage.agent_id,
+            "Response cache hit; reused output from "
+            f"{cached_entry.get('createdAt', 'a previous run')} "
+            f"(saved {cached_entry['usage'].get('total_tokens', 0)} tokens).",
+        )
+    else:
+        result = Runner.run_streamed(
+            stage.agent, stage_input, max_turns=20, run_config=stage_config
+        )
+        turn_span = None
+        tool_spans: dict[str, tuple[_Tracer, dict] | None] = {}
+        turns = 0
+        async for event in result.stream_events():
+            if event.type == "run_item_stream_event":
+                raw_item = event.item.raw_item
+                if event.name == "tool_called":
+                    ledger.tool_called(stage.agent_id, raw_item)
+                    call_id = _item_field(raw_item, "call_id")
+                    # Hosted tools (web search) run inside the model turn and
+                    # have no call_id or output event; their time is the turn's.
+                    if call_id:
+                        tool_spans[str(call_id)] = _trace_start(
+                            f"tool:{_item_field(raw_item, 'name')}", "tool", call_id=str(call_id)
+                        )
+                elif event.name == "tool_output":
+                    ledger.tool_output(stage.agent_id, raw_item, event.item.output)
+                    _trace_end(tool_spans.pop(str(_item_field(raw_item, "call_id") or ""), None))
+                continue
+            if event.type != "raw_response_event":
+                continue
+            if event.data.type == "response.created":
+                # Text from an earlier turn that ended in a tool call is not
+                # the final answer; drop any block still in progress and undo
+                # the files that turn already wrote.
+                parser.reset()
+                discard_written()
+                _trace_end(turn_span)
+                turns += 1
+                turn_span = _trace_start(f"turn {turns}", "model", turn=turns)
+            elif event.data.type == "response.completed":
+                _trace_end(turn_span)
+            elif event.data.type == "response.output_text.delta":
+                parser.feed(event.data.delta)
+        _trace_end(turn_span)
+        for handle in tool_spans.values():
+            _trace_end(handle)
+        parser.close()
+        model = stage_config.model if isinstance(stage_config.model, str) else MODEL_NAME
+        ledger.record_result(stage.agent_id, model, result)
+        usage = _usage_summary(result)
+        entry = {
+            "agentId": stage.agent_id,
+            "createdAt": datetime.utcnow().isoformat() + "Z",
+            "final_output": result.final_output,
+            "usage": usage,
+        }
+        response_cache.put(cache_key, entry)
+    _agent_tokens(stage.agent_id, usage["total_tokens"])
+    cached, input_tokens = usage["cached_tokens"], usage["input_tokens"]
+    _agent_log(
+        stage.agent_id,
+        f"Prompt cache: {cached}/{input_tokens} input tokens cached "
+        f"({_cache_hit_rate(cached, input_tokens)}).",
+    )
+    response_cache.produced[stage.agent_id] = (cache_key, entry)
+    return written
+
+
+def _settle_responses(stages: list[_Stage], run_config: RunConfig, response_cache: _ResponseCache) -> None:
+    # Agents rewrite their own memory and later stages (and the workflow's
+    # changelog) touch files earlier ones read, so an unchanged re-run would
+    # never see the payloads this run started with. Once the run is complete
+    # each stage's output is also stored under the payload it will build next
+    # time if nothing changes in between.
+    if not response_cache.enabled:
+        return
+    for stage in stages:
+        produced = response_cache.produced.get(stage.agent_id)
+        if produced is None:
+            continue
+        cache_key, entry = produced
+        stage_config = _stage_run_config(run_config, stage.agent_id)
+        settled_input = _base_input_items() + _user_message(stage.build_payload())
+        settled_key = response_cache.key(stage.agent, stage_config, settled_input)
+        if settled_key != cache_key:
+            response_cache.put(settled_key, entry)
+
+
+async def _run_stage_graph(
+    stages: list[_Stage],
+    run_stage: Callable[[_Stage, _StageControl], Awaitable[None]],
+    max_parallel: int,
+    speculative: bool = False,
+) -> None:
+    logger = logging.getLogger(__name__)
+    dependencies = _stage_dependencies(stages)
+    by_id = {stage.agent_id: stage for stage in stages}
+    logger.info(
+        "Stage graph: %s (critical path: %s, max parallel: %s, speculative: %s)",
+        ", ".join(
+            f"{agent_id}<-[{','.join(sorted(deps))}]" for agent_id, deps in dependencies.items()
+        ),
+        " -> ".join(_critical_path(stages, dependencies)),
+        max_parallel,
+        speculative,
+    )
+
+    loop = asyncio.get_running_loop()
+    slot = asyncio.Semaphore(max(1, max_parallel))
+    changed = asyncio.Event()
+    committed: set[str] = set()
+    approved = {stage.agent_id: loop.create_future() for stage in stages}
+
+    def on_committed(agent_id: str) -> Callable[[], None]:
+        def mark() -> None:
+            committed.add(agent_id)
+            changed.set()
+
+        return mark
+
+    def start(stage: _Stage) -> asyncio.Task:
+        deps = dependencies[stage.agent_id]
+        unapproved = [approved[dep] for dep in deps if not approved[dep].done()]
+        shadow_dir = None
+        if unapproved:
+            shadow_dir = os.path.join(
+                _project_root(), CACHE_DIR, "speculative", f"{stage.agent_id}-{uuid.uuid4().hex[:8]}"
+            )
+        control = _StageControl(slot, shadow_dir, unapproved, on_committed(stage.agent_id))
+        task = asyncio.create_task(guarded(stage, control), name=f"stage:{stage.agent_id}")
+        task.add_done_callback(lambda _: changed.set())
+        return task
+
+    def ready(agent_id: str) -> bool:
+        # Without speculation a stage waits for its upstream gates; with it, a
+        # stage only waits until upstream files are in the project tree.
+        deps = dependencies[agent_id]
+        if speculative:
+            return deps <= committed
+        return all(approved[dep].done() for dep in deps)
+
+    async def guarded(stage: _Stage, control: _StageControl) -> SystemExit | None:
+        try:
+            await run_stage(stage, control)
+        except SystemExit as exc:
+            # A SystemExit escaping a task tears the loop down without
+            # stopping sibling stages, so hand it back to the scheduler.
+            return exc
+        return None
+
+    pending = [stage.agent_id for stage in stages]
+    running: dict[asyncio.Task, str] = {}
+    try:
+        while pending or running:
+            for agent_id in [agent_id for agent_id in pending if ready(agent_id)]:
+                pending.remove(agent_id)
+                running[start(by_id[agent_id])] = agent_id
+            if not running:
+                raise RuntimeError(f"Stage graph has unsatisfiable dependencies: {pending}")
+            await changed.wait()
+            changed.clear()
+            for task in [task for task in running if task.done()]:
+                agent_id = running.pop(task)
+                error = task.exception() or task.result()
+                if error is not None:
+                    raise error
+                committed.add(agent_id)
+                approved[agent_id].set_result(None)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for future in approved.values():
+            future.cancel()
+
+
 # Uncomment to suppress logging
 #logging.getLogger().addFilter(_SuppressMcpValidationWarnings())
 
 load_dotenv(override=True)
-_setup_logging()
 
 
 async def main() -> None:
+    # Not at import: benchmarks and tools import this module for its helpers
+    # and must not leave a run log in whatever directory they start from.
+    _setup_logging()
     parser = argparse.ArgumentParser(description="Run multi-agent workflow.")
-    parser.add_argument("--project-root", default=None, help="Project root to run in.")
+    parser.add_argument(
+        "--project-root",
+        action="append",
+        default=None,
+        help="Project root to run in. Repeat to run several projects concurrently in this process.",
+    )
     parser.add_argument(
         "--task-from-agents",
         action="store_true",
@@ -647,13 +4294,247 @@ async def main() -> None:
         default=None,
         help="Use a task template file from the repo tasks/ folder.",
     )
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        default=MAX_PARALLEL_STAGES,
+        help="Maximum number of stages running at once (per project).",
+    )
+    parser.add_argument(
+        "--max-model-calls",
+        type=int,
+        default=MAX_MODEL_CALLS,
+        help="Maximum number of model requests in flight at once across all projects.",
+    )
+    parser.add_argument(
+        "--priority",
+        choices=sorted(MODEL_PRIORITY_WEIGHTS),
+        default=MODEL_PRIORITY,
+        help="Priority class for model calls when projects compete for them.",
+    )
+    parser.add_argument(
+        "--project-priority",
+        action="append",
+        default=[],
+        metavar="PROJECT=CLASS",
+        help="Priority class for one project of a batch, by directory name (repeatable).",
+    )
+    parser.add_argument(
+        "--token-budget",
+        type=int,
+        default=PROJECT_TOKEN_BUDGET,
+        help="Stop a project once its model calls would use more than this many tokens (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--cost-budget",
+        type=float,
+        default=PROJECT_COST_BUDGET,
+        help="Stop a project once its model calls would cost more than this many USD (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--global-token-budget",
+        type=int,
+        default=GLOBAL_TOKEN_BUDGET,
+        help="Token cap shared by every project in this process (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--global-cost-budget",
+        type=float,
+        default=GLOBAL_COST_BUDGET,
+        help="USD cap shared by every project in this process (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Start downstream stages on unapproved output; their files are staged until approval.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the last run that did not complete, reusing the stages it finished.",
+    )
+    parser.add_argument(
+        "--resume-from",
+        default=None,
+        metavar="AGENT_ID",
+        help="Reuse the last run's stages before AGENT_ID and rerun AGENT_ID and everything after it.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Skip stages whose inputs and outputs are unchanged since the last build.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the stage response cache.",
+    )
+    parser.add_argument(
+        "--fake-model",
+        action="store_true",
+        default=FAKE_MODEL_ENABLED,
+        help="Answer every model call with canned offline output (see AGENT_FAKE_* settings).",
+    )
+    parser.add_argument(
+        "--refresh-stage",
+        action="append",
+        default=[],
+        metavar="AGENT_ID",
+        help="Ignore cached output for this stage (repeatable, e.g. --refresh-stage tester).",
+    )
     args, _ = parser.parse_known_args()
+    if args.priority not in MODEL_PRIORITY_WEIGHTS:
+        parser.error(f"unknown priority class {args.priority!r} (AGENT_PRIORITY)")
+    priorities = {}
+    for entry in args.project_priority:
+        name, _, priority = entry.rpartition("=")
+        if not name or priority not in MODEL_PRIORITY_WEIGHTS:
+            parser.error(f"--project-priority expects PROJECT=CLASS with CLASS one of {sorted(MODEL_PRIORITY_WEIGHTS)}")
+        priorities[name] = priority
+    args.project_priority = priorities
+
+    roots = [os.path.abspath(root) for root in args.project_root or [os.getcwd()]]
+    approvals = _ApprovalGate()
+    scheduler = _ModelScheduler(
+        args.max_model_calls,
+        _load_model_prices(),
+        token_budget=args.global_token_budget,
+        cost_budget=args.global_cost_budget,
+    )
+    # The dashboard's stop button sends SIGTERM; cancelling lets the finally
+    # blocks record the interrupted run instead of dying mid-write.
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    await _EVENTS.start()
+    await approvals.start()
+    try:
+        if len(roots) == 1:
+            _PROJECT_ROOT.set(roots[0])
+            try:
+                await _run_project(args, approvals, scheduler)
+            except _BudgetExceeded as exc:
+                raise SystemExit(str(exc)) from None
+        else:
+            await _run_batch(args, roots, approvals, scheduler)
+    finally:
+        _log_scheduler(scheduler)
+        await approvals.close()
+        await _EVENTS.close()
+    logging.getLogger(__name__).debug(
+        "Document cache: %d hit(s), %d read(s) from disk", _DOCUMENTS.hits, _DOCUMENTS.reads
+    )
+    if _DB_RESULTS.hits or _DB_RESULTS.misses:
+        logging.getLogger(__name__).info(
+            "db_query cache: %d hit(s), %d miss(es)", _DB_RESULTS.hits, _DB_RESULTS.misses
+        )
 
-    if args.project_root:
-        os.chdir(args.project_root)
+
+def _log_scheduler(scheduler: "_ModelScheduler") -> None:
+    logger = logging.getLogger(__name__)
+    rows = scheduler.report()
+    if not rows:
+        return
+    level = logging.INFO if scheduler.max_depth or len(rows) > 1 else logging.DEBUG
+    for row in rows:
+        logger.log(
+            level,
+            "Scheduler: %s (%s): %d call(s), %d tokens, $%.4f; slot wait p50 %.0fms, p95 %.0fms, max %.0fms",
+            row["project"],
+            row["priority"],
+            row["calls"],
+            row["tokens"],
+            row["cost_usd"],
+            row["wait_p50_ms"],
+            row["wait_p95_ms"],
+            row["wait_max_ms"],
+        )
+    logger.log(level, "Scheduler: max queue depth %d for %d slot(s)", scheduler.max_depth, scheduler.max_slots)
+    if scheduler.throttled or scheduler.retries or scheduler.limits.waited >= 1:
+        logger.info(
+            "Rate limiting: %d throttled response(s), %d retry(ies), %.1fs of request time waiting for quota, "
+            "model calls in flight dropped to %d of %d",
+            scheduler.throttled,
+            scheduler.retries,
+            scheduler.limits.waited,
+            int(scheduler.min_window),
+            scheduler.max_slots,
+        )
+    _EVENTS.emit(
+        "scheduler_summary",
+        None,
+        {
+            "slots": scheduler.max_slots,
+            "maxQueueDepth": scheduler.max_depth,
+            "throttled": scheduler.throttled,
+            "retries": scheduler.retries,
+            "quotaWaitSeconds": round(scheduler.limits.waited, 3),
+            "minSlots": int(scheduler.min_window),
+            "projects": rows,
+        },
+    )
+
+
+async def _run_batch(
+    args: argparse.Namespace,
+    roots: list[str],
+    approvals: "_ApprovalGate",
+    scheduler: "_ModelScheduler",
+) -> None:
+    # Every project runs in its own task with its own _PROJECT_ROOT; they
+    # share the event loop, the dashboard event stream, the approval gate and
+    # the model-call scheduler. One project failing does not stop the others.
+    logger = logging.getLogger(__name__)
+    labels = [os.path.basename(root) or root for root in roots]
+    for index, label in enumerate(labels):
+        if labels.count(label) > 1:
+            labels[index] = f"{label}#{index + 1}"
+
+    async def run(root: str, label: str) -> BaseException | None:
+        _PROJECT_ROOT.set(root)
+        _PROJECT_LABEL.set(label)
+        try:
+            await _run_project(args, approvals, scheduler)
+        except (Exception, SystemExit) as exc:
+            # SystemExit (a rejected approval) must not escape the task: asyncio
+            # would tear the whole loop down with it.
+            logger.error(
+                "Project %s failed: %s", label, exc, exc_info=not isinstance(exc, (SystemExit, _BudgetExceeded))
+            )
+            return exc
+        return None
+
+    started = time.monotonic()
+    logger.info("Batch: %d project(s), at most %d model call(s) in flight", len(roots), args.max_model_calls)
+    results = await asyncio.gather(*(run(root, label) for root, label in zip(roots, labels)))
+    failed = [label for label, error in zip(labels, results) if error is not None]
+    logger.info(
+        "Batch finished in %.1fs: %d succeeded, %d failed%s",
+        time.monotonic() - started,
+        len(roots) - len(failed),
+        len(failed),
+        f" ({', '.join(failed)})" if failed else "",
+    )
+    if failed:
+        raise SystemExit(f"{len(failed)} of {len(roots)} project(s) failed: {', '.join(failed)}")
+
+
+async def _run_project(
+    args: argparse.Namespace,
+    approvals: "_ApprovalGate",
+    scheduler: "_ModelScheduler",
+) -> None:
     _ensure_memory_dir()
 
-    run_config = _build_run_config()
+    label = _PROJECT_LABEL.get() or os.path.basename(_project_root())
+    scheduler.register(
+        args.project_priority.get(label, args.priority),
+        token_budget=args.token_budget,
+        cost_budget=args.cost_budget,
+    )
+    run_config = _build_run_config(fake_model=args.fake_model, scheduler=scheduler)
     shared_tools = [WebSearchTool(), db_query]
 
     documentation_agent = Agent(
@@ -664,7 +4545,7 @@ async def main() -> None:
             "You are the Documentation Curator.\n"
             "Your job is to create a complete, minimal doc pack so other agents can execute without guessing.\n"
             "Use the provided REQUIREMENTS.md, AGENT_TASKS.md, and existing docs/ references.\n\n"
-            "If memory content is provided, keep it and append a new dated entry in memory/doc.md.\n\n"
+            "Write only this run's dated entry to memory/doc.md; earlier entries are kept and summarized for you.\n\n"
             "Deliverables (keep concise, bullet-based):\n"
             "- docs/MVP.md (MVP scope + success criteria)\n"
             "- docs/CONCEPTS.md (system concept map + glossary links)\n"
@@ -682,7 +4563,7 @@ async def main() -> None:
             "- logs/CHANGELOG.md (append a line for this run)\n"
             "- logs/DAILY_LOG_TEMPLATE.md\n"
             "- logs/INCIDENTS.md\n"
-            "- memory/doc.md (summary + open questions)\n\n"
+            "- memory/doc.md (this run's entry: summary + open questions)\n\n"
             "Output format (required):\n"
             "### FILE: docs/MVP.md\n"
             "<content>\n"
@@ -731,11 +4612,11 @@ async def main() -> None:
             "You are the Domain Expert.\n"
             "Summarize core rotary engine domain knowledge for the project.\n"
             "Use web search if needed.\n\n"
-            "If memory content is provided, keep it and append a new dated entry in memory/domain.md.\n\n"
+            "Write only this run's dated entry to memory/domain.md; earlier entries are kept and summarized for you.\n\n"
             "Deliverables:\n"
             "- docs/DOMAIN_ROTARY.md (subsystems, required parts, failure modes)\n"
             "- docs/WARNINGS.md (user-facing warning copy)\n"
-            "- memory/domain.md (summary + open questions)\n\n"
+            "- memory/domain.md (this run's entry: summary + open questions)\n\n"
             "Output format (required):\n"
             "### FILE: docs/DOMAIN_ROTARY.md\n"
             "<content>\n"
@@ -756,7 +4637,7 @@ async def main() -> None:
             "You are the Data Modeler.\n"
             "Use the Database Schema Advice and REQUIREMENTS.md to create a runnable schema.\n"
             "Do not run commands; output SQL and docs only.\n\n"
-            "If memory content is provided, keep it and append a new dated entry in memory/data.md.\n\n"
+            "Write only this run's dated entry to memory/data.md; earlier entries are kept and summarized for you.\n\n"
             "You may use the db_query tool to inspect the DB if env vars are configured (read-only).\n\n"
             "Deliverables:\n"
             "- db/migrations/001_init.sql (core tables)\n"
@@ -764,7 +4645,7 @@ async def main() -> None:
             "- docs/DATA_MODEL.md (update with columns + indexes)\n"
             "- docs/RULES_ENGINE.md (update with DSL examples)\n"
             "- docs/DB_SETUP.md (requirements: MySQL version, env vars, connection needs)\n"
-            "- memory/data.md (summary + open questions)\n\n"
+            "- memory/data.md (this run's entry: summary + open questions)\n\n"
             "Output format (required):\n"
             "### FILE: db/migrations/001_init.sql\n"
             "<content>\n"
@@ -794,7 +4675,7 @@ async def main() -> None:
             "Deliverables:\n"
             "- design/design_spec.md - UI/UX layout, screens, and visual notes.\n"
             "- design/wireframe.md - text or ASCII wireframe if specified.\n\n"
-            "Also update memory for this role. If memory content is provided, keep it and append a new dated entry.\n\n"
+            "Also update memory for this role: write only this run's dated entry; earlier entries are kept and summarized for you.\n\n"
             "Output format (required):\n"
             "### FILE: design/design_spec.md\n"
             "<content>\n"
@@ -817,7 +4698,7 @@ async def main() -> None:
             "Deliverables:\n"
             "- If this is a Blazor project: update files inside app/ (Pages, Shared, wwwroot).\n"
             "- Otherwise: create frontend/index.html, frontend/styles.css, frontend/main.js.\n\n"
-            "Also update memory for this role. If memory content is provided, keep it and append a new dated entry.\n\n"
+            "Also update memory for this role: write only this run's dated entry; earlier entries are kept and summarized for you.\n\n"
             "Output format (required):\n"
             "### FILE: app/Pages/Home.razor\n"
             "<content>\n"
@@ -848,7 +4729,7 @@ async def main() -> None:
             "- backend/package.json - include a start script if requested\n"
             "- backend/server.js - implement the API endpoints and logic exactly as specified\n\n"
             "If this is a Blazor project and no backend is needed, state that in README.md and do not create backend files.\n\n"
-            "Also update memory for this role. If memory content is provided, keep it and append a new dated entry.\n\n"
+            "Also update memory for this role: write only this run's dated entry; earlier entries are kept and summarized for you.\n\n"
             "You may use the db_query tool to inspect the DB if env vars are configured (read-only).\n\n"
             "Output format (required):\n"
             "### FILE: backend/package.json\n"
@@ -872,7 +4753,7 @@ async def main() -> None:
             "Deliverables:\n"
             "- tests/TEST_PLAN.md - bullet list of manual checks or automated steps as requested\n"
             "- tests/test.sh or a simple automated script if specified\n\n"
-            "Also update memory for this role. If memory content is provided, keep it and append a new dated entry.\n\n"
+            "Also update memory for this role: write only this run's dated entry; earlier entries are kept and summarized for you.\n\n"
             "Output format (required):\n"
             "### FILE: tests/TEST_PLAN.md\n"
             "<content>\n"
@@ -901,7 +4782,7 @@ async def main() -> None:
             "  - Required deliverables (exact file names and purpose)\n"
             "  - Key technical notes and constraints\n\n"
             "Reference any existing docs/ files as sources of truth when available.\n\n"
-            "Also maintain memory for this role. If memory content is provided, keep it and append a new dated entry.\n\n"
+            "Also maintain memory for this role: write only this run's dated entry; earlier entries are kept and summarized for you.\n\n"
             "Output format (required):\n"
             "### FILE: REQUIREMENTS.md\n"
             "<content>\n"
@@ -947,7 +4828,7 @@ Constraints:
 """
 
     if args.task_file:
-        repo_root = _find_repo_root(os.getcwd())
+        repo_root = _find_repo_root(_project_root())
         task_name = os.path.basename(args.task_file)
         task_path = (
             os.path.join(repo_root, "tasks", task_name) if repo_root else None
@@ -964,7 +4845,7 @@ Constraints:
                 f"{_blazor_constraints()}\n"
             )
     elif args.task_from_agents:
-        agents_path = os.path.join(os.getcwd(), "AGENTS.md")
+        agents_path = os.path.join(_project_root(), "AGENTS.md")
         if os.path.exists(agents_path):
             agents_text = _read_text(agents_path)
             if agents_text:
@@ -979,269 +4860,296 @@ Constraints:
                     f"{_blazor_constraints()}\n"
                 )
 
-    schema_advice = _read_schema_advice()
-    if schema_advice:
+    pm_schema_advice = _schema_advice_context(f"{task_list}\n{SCHEMA_QUERY_HINTS['pm']}")
+    if pm_schema_advice:
         task_list = (
             f"{task_list}\n"
-            "\nDatabase Schema Advice (reference only):\n"
-            f"{schema_advice}\n"
+            "\nDatabase Schema Advice (reference only, most relevant excerpts):\n"
+            f"{pm_schema_advice}\n"
         )
 
-    pm_docs = _docs_bundle(
-        [
-            "VISION.md",
-            "ROADMAP.md",
-            "SCOPE_GUARDRAILS.md",
-            "RISKS.md",
-            "GLOSSARY.md",
-        ]
-    )
-    pm_payload = f"{_memory_block('pm')}\n{task_list}"
-    if pm_docs:
-        pm_payload = f"{pm_payload}\n\nProject Docs:\n{pm_docs}\n"
-    pm_input = _base_input_items() + _user_message(pm_payload)
-    _agent_status("pm", "running", "Planning requirements")
-    _agent_log("pm", "Starting requirements and task breakdown.")
-    pm_result = await Runner.run(project_manager_agent, pm_input, max_turns=20, run_config=run_config)
-    pm_files = _parse_files_from_output(pm_result.final_output)
-    pm_tokens = _sum_tokens(pm_result)
-    _agent_tokens("pm", pm_tokens)
-    pm_written = _write_files(pm_files)
-    _agent_status("pm", "idle", "Done")
-    _agent_log("pm", "Requirements written.")
-    _require_approval("pm", "Project Manager", pm_written)
-
-    requirements = _read_text("REQUIREMENTS.md")
-    agent_tasks = _read_text("AGENT_TASKS.md")
-    test_plan = _read_text("TEST.md")
-
-    doc_docs = _docs_bundle(
-        [
-            "VISION.md",
-            "ROADMAP.md",
-            "SCOPE_GUARDRAILS.md",
-            "RISKS.md",
-            "GLOSSARY.md",
-            "DATA_MODEL.md",
-            "RULES_ENGINE.md",
-            "API.md",
-            "REALTIME.md",
-            "UI_UX.md",
-            "DOMAIN_ROTARY.md",
-            "INGESTION.md",
-            "MONETIZATION.md",
-            "RUNBOOK.md",
-        ]
-    )
-    doc_payload = (
-        f"{_memory_block('doc')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n\n"
-        "Database Schema Advice:\n"
-        f"{schema_advice or 'No schema advice file found.'}\n"
-    )
-    if doc_docs:
-        doc_payload = f"{doc_payload}\n\nProject Docs:\n{doc_docs}\n"
-    doc_input = _base_input_items() + _user_message(doc_payload)
-    _agent_status("doc", "running", "Writing documentation pack")
-    _agent_log("doc", "Generating docs and task templates.")
-    doc_result = await Runner.run(documentation_agent, doc_input, max_turns=20, run_config=run_config)
-    doc_written = _write_files(_parse_files_from_output(doc_result.final_output))
-    doc_tokens = _sum_tokens(doc_result)
-    _agent_tokens("doc", doc_tokens)
-    _agent_status("doc", "idle", "Done")
-    _agent_log("doc", "Documentation pack written.")
-    _require_approval("doc", "Documentation Curator", doc_written)
-
-    domain_docs = _docs_bundle(
-        [
-            "DOMAIN_ROTARY.md",
-            "WARNINGS.md",
-            "GLOSSARY.md",
-            "SCOPE_GUARDRAILS.md",
-        ]
-    )
-    domain_payload = (
-        f"{_memory_block('domain')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n"
-    )
-    if domain_docs:
-        domain_payload = f"{domain_payload}\n\nProject Docs:\n{domain_docs}\n"
-    domain_input = _base_input_items() + _user_message(domain_payload)
-    _agent_status("domain", "running", "Summarizing domain knowledge")
-    _agent_log("domain", "Creating domain notes.")
-    domain_result = await Runner.run(domain_agent, domain_input, max_turns=20, run_config=run_config)
-    domain_written = _write_files(_parse_files_from_output(domain_result.final_output))
-    domain_tokens = _sum_tokens(domain_result)
-    _agent_tokens("domain", domain_tokens)
-    _agent_status("domain", "idle", "Done")
-    _agent_log("domain", "Domain notes written.")
-    _require_approval("domain", "Domain Expert", domain_written)
-
-    data_docs = _docs_bundle(
-        [
-            "DATA_MODEL.md",
-            "RULES_ENGINE.md",
-            "DOMAIN_ROTARY.md",
-            "SCOPE_GUARDRAILS.md",
-        ]
-    )
-    data_payload = (
-        f"{_memory_block('data')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n\n"
-        "Database Schema Advice:\n"
-        f"{schema_advice or 'No schema advice file found.'}\n"
-    )
-    if data_docs:
-        data_payload = f"{data_payload}\n\nProject Docs:\n{data_docs}\n"
-    data_input = _base_input_items() + _user_message(data_payload)
-    _agent_status("data", "running", "Building data model")
-    _agent_log("data", "Creating migrations and seeds.")
-    data_result = await Runner.run(data_modeler_agent, data_input, max_turns=20, run_config=run_config)
-    data_written = _write_files(_parse_files_from_output(data_result.final_output))
-    data_tokens = _sum_tokens(data_result)
-    _agent_tokens("data", data_tokens)
-    _agent_status("data", "idle", "Done")
-    _agent_log("data", "Data model written.")
-    _require_approval("data", "Data Modeler", data_written)
-
-    designer_docs = _docs_bundle(
-        [
-            "VISION.md",
-            "UI_UX.md",
-            "REALTIME.md",
-            "SCOPE_GUARDRAILS.md",
-        ]
-    )
-    designer_payload = (
-        f"{_memory_block('designer')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n"
-    )
-    if designer_docs:
-        designer_payload = f"{designer_payload}\n\nProject Docs:\n{designer_docs}\n"
-    designer_input = _base_input_items() + _user_message(designer_payload)
-    _agent_status("designer", "running", "Designing UI")
-    _agent_log("designer", "Creating design spec.")
-    designer_result = await Runner.run(designer_agent, designer_input, max_turns=20, run_config=run_config)
-    designer_written = _write_files(_parse_files_from_output(designer_result.final_output))
-    designer_tokens = _sum_tokens(designer_result)
-    _agent_tokens("designer", designer_tokens)
-    _agent_status("designer", "idle", "Done")
-    _agent_log("designer", "Design spec written.")
-    _require_approval("designer", "Designer", designer_written)
-
-    design_spec = _read_text("design/design_spec.md")
-
-    blazor_guard = ""
-    if _is_blazor_project():
-        blazor_guard = (
-            "\nBlazor Guardrails:\n"
-            "- ONLY write files under app/.\n"
-            "- Do NOT write to frontend/.\n"
-            "- Update app/Pages/* and app/wwwroot/* for UI.\n"
+    def pm_payload() -> str:
+        prompt = _PromptLayout("pm")
+        prompt.static(None, task_list, priority=3, name="Task List")
+        prompt.semi_static("Project Docs", _docs_bundle(PM_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def task_prompt(agent_id: str) -> _PromptLayout:
+        # Every stage after the PM opens with REQUIREMENTS.md, the longest
+        # prefix the stages can share, then only its own part of
+        # AGENT_TASKS.md and of TEST.md. A file the PM did not split by role
+        # is sent whole.
+        prompt = _PromptLayout(agent_id)
+        prompt.static("REQUIREMENTS.md", _read_text("REQUIREMENTS.md"), priority=3)
+        tasks = _role_slice("AGENT_TASKS.md", agent_id, _index_agent_tasks)
+        prompt.static(
+            "AGENT_TASKS.md",
+            tasks if tasks is not None else _read_text("AGENT_TASKS.md"),
+            priority=3,
         )
-    frontend_docs = _docs_bundle(
-        [
-            "UI_UX.md",
-            "API.md",
-            "REALTIME.md",
-            "GLOSSARY.md",
-        ]
-    )
-    frontend_payload = (
-        f"{_memory_block('frontend')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n\n"
-        "design/design_spec.md:\n"
-        f"{design_spec}\n"
-        f"{blazor_guard}\n"
-    )
-    if frontend_docs:
-        frontend_payload = f"{frontend_payload}\n\nProject Docs:\n{frontend_docs}\n"
-    frontend_input = _base_input_items() + _user_message(frontend_payload)
-    _agent_status("frontend", "running", "Building UI")
-    _agent_log("frontend", "Implementing frontend.")
-    frontend_result = await Runner.run(frontend_developer_agent, frontend_input, max_turns=20, run_config=run_config)
-    frontend_written = _write_files(_parse_files_from_output(frontend_result.final_output))
-    frontend_tokens = _sum_tokens(frontend_result)
-    _agent_tokens("frontend", frontend_tokens)
-    _agent_status("frontend", "idle", "Done")
-    _agent_log("frontend", "Frontend written.")
-    _require_approval("frontend", "Frontend Developer", frontend_written)
-
-    backend_docs = _docs_bundle(
-        [
-            "API.md",
-            "DATA_MODEL.md",
-            "RULES_ENGINE.md",
-            "REALTIME.md",
-            "DOMAIN_ROTARY.md",
-        ]
-    )
-    backend_payload = (
-        f"{_memory_block('backend')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n"
+        if agent_id != "tester":
+            prompt.static(
+                "TEST.md (acceptance criteria you own)",
+                _role_slice("TEST.md", agent_id, _index_test_plan) or "",
+                priority=2,
+                name="TEST.md",
+            )
+        return prompt
+
+    def schema_advice_section(prompt: _PromptLayout, agent_id: str) -> None:
+        schema_advice = _schema_advice_context(
+            f"{prompt.text('REQUIREMENTS.md')}\n{prompt.text('AGENT_TASKS.md')}\n"
+            f"{SCHEMA_QUERY_HINTS[agent_id]}"
+        )
+        prompt.static(
+            "Database Schema Advice (most relevant excerpts)",
+            schema_advice or "No schema advice file found.",
+            priority=1,
+            name="Schema Advice",
+        )
+
+    def doc_payload() -> str:
+        prompt = task_prompt("doc")
+        schema_advice_section(prompt, "doc")
+        prompt.semi_static("Project Docs", _docs_bundle(DOC_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def domain_payload() -> str:
+        prompt = task_prompt("domain")
+        prompt.semi_static("Project Docs", _docs_bundle(DOMAIN_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def data_payload() -> str:
+        prompt = task_prompt("data")
+        schema_advice_section(prompt, "data")
+        prompt.semi_static("Project Docs", _docs_bundle(DATA_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def designer_payload() -> str:
+        prompt = task_prompt("designer")
+        prompt.semi_static("Project Docs", _docs_bundle(DESIGNER_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def frontend_payload() -> str:
+        prompt = task_prompt("frontend")
+        if _is_blazor_project():
+            prompt.static(
+                "Blazor Guardrails",
+                "- ONLY write files under app/.\n"
+                "- Do NOT write to frontend/.\n"
+                "- Update app/Pages/* and app/wwwroot/* for UI.",
+                priority=3,
+            )
+        prompt.semi_static("design/design_spec.md", _read_text("design/design_spec.md"))
+        prompt.semi_static("Project Docs", _docs_bundle(FRONTEND_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def backend_payload() -> str:
+        prompt = task_prompt("backend")
+        prompt.semi_static("Project Docs", _docs_bundle(BACKEND_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    def tester_payload() -> str:
+        # The tester verifies every item, so it gets the whole test plan.
+        prompt = task_prompt("tester")
+        prompt.static("TEST.md", _read_text("TEST.md"), priority=3)
+        prompt.semi_static("Project Docs", _docs_bundle(TESTER_DOCS), priority=0, shrink=_outline_text)
+        return prompt.render()
+
+    task_inputs = ("REQUIREMENTS.md", "AGENT_TASKS.md", "TEST.md")
+    stages = [
+        _Stage(
+            agent_id="pm",
+            role="Project Manager",
+            agent=project_manager_agent,
+            running_step="Planning requirements",
+            start_message="Starting requirements and task breakdown.",
+            done_message="Requirements written.",
+            inputs=_doc_inputs(PM_DOCS),
+            outputs=("REQUIREMENTS.md", "TEST.md", "AGENT_TASKS.md", "memory/pm.md"),
+            build_payload=pm_payload,
+        ),
+        _Stage(
+            agent_id="doc",
+            role="Documentation Curator",
+            agent=documentation_agent,
+            running_step="Writing documentation pack",
+            start_message="Generating docs and task templates.",
+            done_message="Documentation pack written.",
+            inputs=task_inputs + _doc_inputs(DOC_DOCS),
+            outputs=(
+                "docs/MVP.md",
+                "docs/CONCEPTS.md",
+                "docs/DATA_MODEL.md",
+                "docs/RULES_ENGINE.md",
+                "docs/API.md",
+                "docs/REALTIME.md",
+                "docs/DB_SETUP.md",
+                "docs/OPERATIONS.md",
+                "docs/DECISIONS.md",
+                "docs/GLOSSARY.md",
+                "tasks/",
+                "logs/CHANGELOG.md",
+                "logs/DAILY_LOG_TEMPLATE.md",
+                "logs/INCIDENTS.md",
+                "memory/doc.md",
+            ),
+            build_payload=doc_payload,
+        ),
+        _Stage(
+            agent_id="domain",
+            role="Domain Expert",
+            agent=domain_agent,
+            running_step="Summarizing domain knowledge",
+            start_message="Creating domain notes.",
+            done_message="Domain notes written.",
+            inputs=task_inputs + _doc_inputs(DOMAIN_DOCS),
+            outputs=("docs/DOMAIN_ROTARY.md", "docs/WARNINGS.md", "memory/domain.md"),
+            build_payload=domain_payload,
+        ),
+        _Stage(
+            agent_id="data",
+            role="Data Modeler",
+            agent=data_modeler_agent,
+            running_step="Building data model",
+            start_message="Creating migrations and seeds.",
+            done_message="Data model written.",
+            inputs=task_inputs + _doc_inputs(DATA_DOCS),
+            outputs=(
+                "db/migrations/",
+                "db/seeds/",
+                "docs/DATA_MODEL.md",
+                "docs/RULES_ENGINE.md",
+                "docs/DB_SETUP.md",
+                "memory/data.md",
+            ),
+            build_payload=data_payload,
+        ),
+        _Stage(
+            agent_id="designer",
+            role="Designer",
+            agent=designer_agent,
+            running_step="Designing UI",
+            start_message="Creating design spec.",
+            done_message="Design spec written.",
+            inputs=task_inputs + _doc_inputs(DESIGNER_DOCS),
+            outputs=("design/", "memory/designer.md"),
+            build_payload=designer_payload,
+        ),
+        _Stage(
+            agent_id="frontend",
+            role="Frontend Developer",
+            agent=frontend_developer_agent,
+            running_step="Building UI",
+            start_message="Implementing frontend.",
+            done_message="Frontend written.",
+            inputs=task_inputs + ("design/design_spec.md",) + _doc_inputs(FRONTEND_DOCS),
+            outputs=("frontend/", "app/", "memory/frontend.md"),
+            build_payload=frontend_payload,
+        ),
+        _Stage(
+            agent_id="backend",
+            role="Backend Developer",
+            agent=backend_developer_agent,
+            running_step="Building backend",
+            start_message="Implementing backend.",
+            done_message="Backend written.",
+            inputs=task_inputs + _doc_inputs(BACKEND_DOCS),
+            outputs=("backend/", "README.md", "memory/backend.md"),
+            build_payload=backend_payload,
+        ),
+        _Stage(
+            agent_id="tester",
+            role="Tester",
+            agent=tester_agent,
+            running_step="Testing outputs",
+            start_message="Creating test plan.",
+            done_message="Test plan written.",
+            inputs=task_inputs
+            + ("frontend/", "app/", "backend/")
+            + _doc_inputs(TESTER_DOCS),
+            outputs=("tests/", "memory/tester.md"),
+            build_payload=tester_payload,
+        ),
+    ]
+
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + "-" + uuid.uuid4().hex[:8]
+    ledger = _UsageLedger(run_id, _load_model_prices())
+    tracer = _Tracer() if TRACE_ENABLED else None
+    if tracer is not None:
+        _TRACE_SPAN.set((tracer, None))
+
+    response_cache = _ResponseCache(
+        os.path.join(_project_root(), CACHE_DIR, "responses"),
+        max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        enabled=not args.no_cache,
+        refresh=set(args.refresh_stage),
     )
-    if backend_docs:
-        backend_payload = f"{backend_payload}\n\nProject Docs:\n{backend_docs}\n"
-    backend_input = _base_input_items() + _user_message(backend_payload)
-    _agent_status("backend", "running", "Building backend")
-    _agent_log("backend", "Implementing backend.")
-    backend_result = await Runner.run(backend_developer_agent, backend_input, max_turns=20, run_config=run_config)
-    backend_written = _write_files(_parse_files_from_output(backend_result.final_output))
-    backend_tokens = _sum_tokens(backend_result)
-    _agent_tokens("backend", backend_tokens)
-    _agent_status("backend", "idle", "Done")
-    _agent_log("backend", "Backend written.")
-    _require_approval("backend", "Backend Developer", backend_written)
-
-    tester_docs = _docs_bundle(
-        [
-            "RUNBOOK.md",
-            "API.md",
-            "REALTIME.md",
-            "UI_UX.md",
-        ]
+
+    manifest = _StageManifest(
+        os.path.join(_project_root(), CACHE_DIR, "manifest.json"),
+        enabled=args.incremental,
+        refresh=set(args.refresh_stage),
     )
-    tester_payload = (
-        f"{_memory_block('tester')}\n"
-        "REQUIREMENTS.md:\n"
-        f"{requirements}\n\n"
-        "AGENT_TASKS.md:\n"
-        f"{agent_tasks}\n\n"
-        "TEST.md:\n"
-        f"{test_plan}\n"
+
+    def save_manifest() -> None:
+        # Fingerprinting renders every payload and hashes whole output trees;
+        # only --incremental runs ever read the result.
+        if not manifest.enabled:
+            return
+        by_id = {stage.agent_id: stage for stage in stages}
+        manifest.save(
+            {
+                agent_id: _stage_fingerprint(by_id[agent_id], run_config, response_cache)
+                for agent_id in manifest.finished
+            }
+        )
+
+    journal = _RunJournal(_project_root(), run_id)
+    stage_ids = [stage.agent_id for stage in stages]
+    if args.resume_from and args.resume_from not in stage_ids:
+        raise SystemExit(f"--resume-from must be one of: {', '.join(stage_ids)}")
+    if args.resume or args.resume_from:
+        journal.restore(stage_ids, args.resume_from)
+
+    async def run_stage(stage: _Stage, control: _StageControl) -> None:
+        await _run_stage(stage, run_config, approvals, response_cache, control, ledger, manifest, journal)
+
+    try:
+        with _span("run", "run", project=_project_root()):
+            await _run_stage_graph(stages, run_stage, args.max_parallel, args.speculative)
+    except BaseException as exc:
+        # Stages that finished before the failure stay up to date.
+        save_manifest()
+        interrupted = isinstance(exc, (asyncio.CancelledError, KeyboardInterrupt))
+        journal.close("interrupted" if interrupted else "failed", str(exc) or type(exc).__name__)
+        raise
+    finally:
+        report_path = ledger.write(_project_root())
+        if tracer is not None:
+            logging.getLogger(__name__).info("Trace written to %s", ", ".join(tracer.write(_project_root(), run_id)))
+    waits = approvals.waits(_project_root())
+    if waits:
+        logging.getLogger(__name__).info(
+            "Approval wait: %s (total %.1fs)",
+            ", ".join(f"{agent_id}={waited:.1f}s" for agent_id, waited in waits.items()),
+            sum(waits.values()),
+        )
+    _log_prompt_cache_summary(ledger.cache_usage())
+    totals = ledger.report()["totals"]
+    logging.getLogger(__name__).info(
+        "Usage: %d turn(s), %d tool call(s), input=%d (cached %d) output=%d (reasoning %d), cost=%s; report %s",
+        totals["turns"],
+        totals["tool_calls"],
+        totals["input_tokens"],
+        totals["cached_tokens"],
+        totals["output_tokens"],
+        totals["reasoning_tokens"],
+        "n/a" if totals["cost_usd"] is None else f"${totals['cost_usd']:.4f}",
+        report_path,
     )
-    if tester_docs:
-        tester_payload = f"{tester_payload}\n\nProject Docs:\n{tester_docs}\n"
-    tester_input = _base_input_items() + _user_message(tester_payload)
-    _agent_status("tester", "running", "Testing outputs")
-    _agent_log("tester", "Creating test plan.")
-    tester_result = await Runner.run(tester_agent, tester_input, max_turns=20, run_config=run_config)
-    tester_written = _write_files(_parse_files_from_output(tester_result.final_output))
-    tester_tokens = _sum_tokens(tester_result)
-    _agent_tokens("tester", tester_tokens)
-    _agent_status("tester", "idle", "Done")
-    _agent_log("tester", "Test plan written.")
-    _require_approval("tester", "Tester", tester_written)
-
-    readme_path = os.path.join(os.getcwd(), "README.md")
+
+    readme_path = os.path.join(_project_root(), "README.md")
     if not os.path.exists(readme_path):
         project_type = os.environ.get("PROJECT_TYPE", "web").strip().lower()
         readme_lines = [
@@ -1281,8 +5189,18 @@ Constraints:
             ]
         _write_text(readme_path, "\n".join(readme_lines) + "\n")
 
-    project_id = os.environ.get("PROJECT_ID", os.path.basename(os.getcwd()))
+    project_id = _PROJECT_LABEL.get() or os.environ.get("PROJECT_ID", os.path.basename(_project_root()))
     _append_changelog(f"Run completed for {project_id}.")
+    _settle_responses(stages, run_config, response_cache)
+    save_manifest()
+    journal.close("completed")
+    if manifest.skipped:
+        logging.getLogger(__name__).info(
+            "Incremental build: skipped %d of %d stage(s) (%s)",
+            len(manifest.skipped),
+            len(stages),
+            ", ".join(manifest.skipped),
+        )
 
 
 if __name__ == "__main__":
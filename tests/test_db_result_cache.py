@@ -0,0 +1,76 @@
+# Which db_query results may be cached, and under what key.
+
+import asyncio
+import json
+import sqlite3
+
+from agents.tool_context import ToolContext
+
+import multi_agent_workflow as workflow
+
+
+def _query(sql):
+    arguments = json.dumps({"sql": sql})
+    context = ToolContext(context=None, tool_name="db_query", tool_call_id="call", tool_arguments=arguments)
+    return workflow.db_query.on_invoke_tool(context, arguments)
+
+
+def test_normalize_sql_keeps_case():
+    assert workflow._normalize_sql("SELECT * FROM Users") != workflow._normalize_sql("SELECT * FROM users")
+    assert workflow._normalize_sql("SELECT * FROM `Users`") != workflow._normalize_sql("SELECT * FROM `users`")
+
+
+def test_normalize_sql_collapses_whitespace_and_drops_comments():
+    assert workflow._normalize_sql("SELECT  *\n  FROM users -- note\n;") == "SELECT * FROM users"
+    assert workflow._normalize_sql("SELECT 'a  b'") == "SELECT 'a  b'"
+
+
+def test_introspection_statements_are_cacheable():
+    for sql in (
+        "SHOW TABLES",
+        "DESCRIBE users",
+        "EXPLAIN SELECT * FROM users",
+        "SELECT table_name FROM information_schema.tables WHERE table_schema = DATABASE()",
+        "SELECT * FROM `information_schema`.`columns` c JOIN information_schema.tables t ON c.table_name = t.table_name",
+        "SELECT name FROM sqlite_master WHERE type = 'table'",
+    ):
+        assert workflow._is_introspection_sql(sql), sql
+
+
+def test_data_queries_are_not_cacheable():
+    for sql in (
+        "SELECT * FROM users",
+        "SELECT 1",
+        "SELECT * FROM information_schema.tables t, users u",
+        "SELECT * FROM users u JOIN information_schema.tables t ON t.table_name = 'users'",
+        "SELECT 'FROM information_schema.tables' FROM users",
+        "WITH recent AS (SELECT * FROM orders) SELECT * FROM recent",
+    ):
+        assert not workflow._is_introspection_sql(sql), sql
+
+
+def test_db_query_sees_rows_written_by_other_connections(tmp_path, monkeypatch):
+    path = tmp_path / "dev.sqlite3"
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE items (id INTEGER)")
+    connection.execute("INSERT INTO items VALUES (1)")
+    connection.commit()
+    monkeypatch.setenv("DB_DRIVER", "sqlite")
+    monkeypatch.setenv("DB_SQLITE_PATH", str(path))
+    results = workflow._DbResultCache(ttl=300, max_bytes=1 << 20, check_seconds=60)
+    monkeypatch.setattr(workflow, "_DB_RESULTS", results)
+
+    async def scenario():
+        first = await _query("SELECT id FROM items ORDER BY id")
+        connection.execute("INSERT INTO items VALUES (2)")
+        connection.commit()
+        second = await _query("SELECT id FROM items ORDER BY id")
+        await _query("SELECT name FROM sqlite_master WHERE type = 'table'")
+        await _query("SELECT name FROM sqlite_master WHERE type = 'table'")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    connection.close()
+    assert first.split() == ["id", "1"]
+    assert second.split() == ["id", "1", "2"]
+    assert (results.hits, results.misses) == (1, 1)
@@ -0,0 +1,67 @@
+# db_query pushes its row cap into the statement with _limit_sql.
+
+import multi_agent_workflow as workflow
+
+
+def test_appends_limit_when_missing():
+    assert workflow._limit_sql("SELECT * FROM users;", 201) == "SELECT * FROM users\nLIMIT 201"
+    assert workflow._limit_sql("SELECT * FROM users -- all", 5) == "SELECT * FROM users -- all\nLIMIT 5"
+
+
+def test_no_limit_or_non_select_is_left_alone():
+    assert workflow._limit_sql("SELECT * FROM users", 0) == "SELECT * FROM users"
+    assert workflow._limit_sql("SHOW TABLES", 5) == "SHOW TABLES"
+    assert workflow._limit_sql("EXPLAIN SELECT * FROM users", 5) == "EXPLAIN SELECT * FROM users"
+
+
+def test_clamps_larger_trailing_limit_and_keeps_smaller():
+    assert workflow._limit_sql("SELECT * FROM users LIMIT 1000", 201) == "SELECT * FROM users LIMIT 201"
+    assert workflow._limit_sql("SELECT * FROM users LIMIT 10", 201) == "SELECT * FROM users LIMIT 10"
+
+
+def test_offset_forms_clamp_the_row_count():
+    assert workflow._limit_sql("SELECT * FROM users LIMIT 500 OFFSET 20", 50) == "SELECT * FROM users LIMIT 50 OFFSET 20"
+    assert workflow._limit_sql("SELECT * FROM users LIMIT 20, 500", 50) == "SELECT * FROM users LIMIT 20, 50"
+    assert workflow._limit_sql("SELECT * FROM users LIMIT 20, 5", 50) == "SELECT * FROM users LIMIT 20, 5"
+
+
+def test_limit_inside_literal_or_comment_is_not_a_limit():
+    assert workflow._limit_sql("SELECT 'LIMIT 5'", 10) == "SELECT 'LIMIT 5'\nLIMIT 10"
+    assert workflow._limit_sql("SELECT * FROM users /* LIMIT 5 */", 10) == "SELECT * FROM users /* LIMIT 5 */\nLIMIT 10"
+    assert workflow._limit_sql("SELECT * FROM users -- LIMIT 5", 10) == "SELECT * FROM users -- LIMIT 5\nLIMIT 10"
+
+
+def test_subquery_limit_is_not_the_statement_limit():
+    assert (
+        workflow._limit_sql("SELECT * FROM (SELECT * FROM users LIMIT 5) u", 10)
+        == "SELECT * FROM (SELECT * FROM users LIMIT 5) u\nLIMIT 10"
+    )
+
+
+def test_union_limit_applies_to_the_whole_result():
+    sql = "SELECT id FROM users UNION SELECT id FROM admins"
+    assert workflow._limit_sql(sql, 10) == f"{sql}\nLIMIT 10"
+    assert workflow._limit_sql(f"{sql} LIMIT 100", 10) == f"{sql} LIMIT 10"
+
+
+def test_limit_goes_before_locking_and_into_clauses():
+    cases = {
+        "SELECT * FROM users FOR UPDATE": "SELECT * FROM users\nLIMIT 10\nFOR UPDATE",
+        "SELECT * FROM users FOR SHARE SKIP LOCKED": "SELECT * FROM users\nLIMIT 10\nFOR SHARE SKIP LOCKED",
+        "SELECT * FROM users LOCK IN SHARE MODE": "SELECT * FROM users\nLIMIT 10\nLOCK IN SHARE MODE",
+        "SELECT * FROM users INTO OUTFILE '/tmp/u.csv'": "SELECT * FROM users\nLIMIT 10\nINTO OUTFILE '/tmp/u.csv'",
+        "SELECT id FROM users PROCEDURE ANALYSE()": "SELECT id FROM users\nLIMIT 10\nPROCEDURE ANALYSE()",
+        "SELECT * FROM users LIMIT 500 FOR UPDATE": "SELECT * FROM users LIMIT 10 FOR UPDATE",
+        "SELECT * FROM users LIMIT 5 FOR UPDATE": "SELECT * FROM users LIMIT 5 FOR UPDATE",
+    }
+    for sql, expected in cases.items():
+        assert workflow._limit_sql(sql, 10) == expected, sql
+
+
+def test_into_before_from_and_quoted_clauses_are_not_moved():
+    assert workflow._limit_sql("SELECT id INTO @x FROM users", 10) == "SELECT id INTO @x FROM users\nLIMIT 10"
+    assert workflow._limit_sql("SELECT 'for update' FROM users", 10) == "SELECT 'for update' FROM users\nLIMIT 10"
+    assert (
+        workflow._limit_sql("SELECT * FROM users WHERE id IN (SELECT id FROM t FOR UPDATE)", 10)
+        == "SELECT * FROM users WHERE id IN (SELECT id FROM t FOR UPDATE)\nLIMIT 10"
+    )
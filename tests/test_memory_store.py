@@ -0,0 +1,120 @@
+# Bounded agent memory: ingesting entries, compaction into the summary, and
+# the one-time migration of a free-form memory/<role>.md.
+
+import json
+import os
+
+import pytest
+
+import multi_agent_workflow as workflow
+
+AGENT = "backend"
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(workflow, "MEMORY_WINDOW_ENTRIES", 3)
+    monkeypatch.setattr(workflow, "MEMORY_COMPACT_ENTRIES", 5)
+    os.makedirs(tmp_path / workflow.MEMORY_DIR)
+    token = workflow._PROJECT_ROOT.set(str(tmp_path))
+    yield workflow._MemoryStore()
+    workflow._PROJECT_ROOT.reset(token)
+
+
+def _write_memory(text):
+    workflow._write_text(workflow._memory_path(AGENT), text)
+
+
+def _memory_file():
+    with open(workflow._memory_path(AGENT), "r", encoding="utf-8") as handle:
+        return handle.read()
+
+
+def _log():
+    with open(workflow._memory_path(AGENT, ".jsonl"), "r", encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle]
+
+
+def _index():
+    with open(workflow._memory_path(AGENT, ".index.json"), "r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def test_compaction_folds_old_entries_into_the_summary(store):
+    for run in range(1, 8):
+        _write_memory(f"Run {run}: added endpoint {run}.\n- details of run {run}")
+        store.ingest(AGENT)
+
+    # Compacted at 5 entries and again at 7: four folded, three kept.
+    assert [entry["text"].splitlines()[0] for entry in _log()] == [
+        "Run 5: added endpoint 5.",
+        "Run 6: added endpoint 6.",
+        "Run 7: added endpoint 7.",
+    ]
+    index = _index()
+    assert index["folded"] == 4
+    assert [line.split(": ", 1)[1] for line in index["summary"]] == [
+        f"Run {run}: added endpoint {run}." for run in range(1, 5)
+    ]
+
+    view = store.view(AGENT)
+    assert view.startswith("Summary of 4 earlier entries (oldest first):\n- ")
+    assert view.count("### ") == 3 and view.endswith("Run 7: added endpoint 7.\n- details of run 7")
+    assert _memory_file() == view + "\n"
+    # The index is read back from disk, not kept in memory.
+    assert workflow._MemoryStore().view(AGENT) == view
+
+
+def test_echoed_view_is_stripped_and_repeats_are_skipped(store):
+    _write_memory("Run 1: created schema.")
+    store.ingest(AGENT)
+    view = store.view(AGENT)
+
+    # Unchanged file, and the last entry written again on its own.
+    store.ingest(AGENT)
+    _write_memory("Run 1: created schema.")
+    store.ingest(AGENT)
+    assert len(_log()) == 1
+
+    # An agent that copies the view back before its new entry.
+    _write_memory(f"{view}\n\nRun 2: added seeds.")
+    store.ingest(AGENT)
+    assert [entry["text"] for entry in _log()] == ["Run 1: created schema.", "Run 2: added seeds."]
+    assert _memory_file() == store.view(AGENT) + "\n"
+
+
+def test_empty_placeholder_is_not_an_entry(store):
+    _write_memory("<empty>")
+    store.ingest(AGENT)
+    assert not os.path.exists(workflow._memory_path(AGENT, ".jsonl"))
+
+
+def test_legacy_memory_file_is_migrated_once(store):
+    legacy = (
+        "# Backend memory\n\n"
+        "## 2024-01-02 Run\n- Built the builds API.\n\n"
+        "## 2024-01-05 Run\n- Added auth.\n"
+    )
+    _write_memory(legacy)
+    assert store.view(AGENT) == legacy.strip()
+    assert _log() == [
+        {"ts": "legacy", "text": "# Backend memory"},
+        {"ts": "2024-01-02", "text": "## 2024-01-02 Run\n- Built the builds API."},
+        {"ts": "2024-01-05", "text": "## 2024-01-05 Run\n- Added auth."},
+    ]
+
+    # The unchanged legacy text is the view itself, so nothing is added.
+    store.ingest(AGENT)
+    assert len(_log()) == 3
+    assert _memory_file() == legacy.strip() + "\n"
+
+
+def test_long_legacy_memory_is_compacted_on_migration(store):
+    _write_memory(
+        "\n\n".join(f"## 2024-01-0{day} Run\nShipped feature {day}.\n- notes" for day in range(1, 7))
+    )
+    view = store.view(AGENT)
+    assert [entry["ts"] for entry in _log()] == ["2024-01-04", "2024-01-05", "2024-01-06"]
+    assert _index()["summary"] == [f"- 2024-01-0{day}: Shipped feature {day}." for day in range(1, 4)]
+    assert view.startswith("Summary of 3 earlier entries (oldest first):\n- 2024-01-01: Shipped feature 1.")
+    assert view.endswith("## 2024-01-06 Run\nShipped feature 6.\n- notes")
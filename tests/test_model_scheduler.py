@@ -0,0 +1,134 @@
+# Fair-share order, budgets and the AIMD window of _ModelScheduler, driven
+# directly without a model behind it.
+
+import asyncio
+
+import pytest
+from openai import RateLimitError
+
+import multi_agent_workflow as workflow
+
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+
+def _register(scheduler, root, priority, **budgets):
+    token = workflow._PROJECT_ROOT.set(root)
+    try:
+        scheduler.register(priority, **budgets)
+    finally:
+        workflow._PROJECT_ROOT.reset(token)
+    return scheduler._flows[root]
+
+
+async def _acquire(scheduler, root, estimate):
+    workflow._PROJECT_ROOT.set(root)
+    return await scheduler.acquire("test-model", estimate)
+
+
+def _throttle_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/responses")
+    return RateLimitError("Rate limit reached.", response=httpx.Response(429, request=request), body=None)
+
+
+def test_queued_requests_are_granted_by_weighted_finish_time():
+    async def scenario():
+        scheduler = workflow._ModelScheduler(slots=1, prices={})
+        for root, priority in (("/hold", "normal"), ("/batch", "batch"), ("/interactive", "interactive")):
+            _register(scheduler, root, priority)
+        holder = await _acquire(scheduler, "/hold", 1000)
+        granted = []
+
+        async def request(root):
+            ticket = await _acquire(scheduler, root, 1000)
+            granted.append(root)
+            scheduler.release(ticket, None)
+
+        # The batch project queues first, but each of its requests costs 16
+        # times as much virtual time as an interactive one.
+        tasks = [asyncio.create_task(request(root)) for root in ["/batch", "/interactive"] * 3]
+        await asyncio.sleep(0)
+        assert len(scheduler._queue) == 6
+        scheduler.release(holder, None)
+        await asyncio.gather(*tasks)
+        return granted
+
+    assert asyncio.run(scenario()) == ["/interactive"] * 3 + ["/batch"] * 3
+
+
+def test_budget_rejection_does_not_advance_the_flow():
+    async def scenario():
+        scheduler = workflow._ModelScheduler(slots=2, prices={})
+        flow = _register(scheduler, "/project", "normal", token_budget=1500)
+        _register(scheduler, "/other", "normal")
+        ticket = await _acquire(scheduler, "/project", 1000)
+        finish = flow.finish
+        with pytest.raises(workflow._BudgetExceeded):
+            await _acquire(scheduler, "/project", 1000)
+        assert flow.finish == finish
+        assert flow.reserved_tokens == 1000
+
+        # Rejected from the queue once a slot is handed on.
+        other = await _acquire(scheduler, "/other", 1000)
+        queued = asyncio.create_task(_acquire(scheduler, "/project", 1000))
+        await asyncio.sleep(0)
+        assert flow.finish > finish
+        scheduler.release(other, None)
+        with pytest.raises(workflow._BudgetExceeded):
+            await queued
+        assert flow.finish == finish
+        assert scheduler.in_flight == 1
+        scheduler.release(ticket, None)
+
+    asyncio.run(scenario())
+
+
+def test_total_budget_applies_across_projects():
+    async def scenario():
+        scheduler = workflow._ModelScheduler(slots=4, prices={}, token_budget=1500)
+        _register(scheduler, "/a", "normal")
+        _register(scheduler, "/b", "normal")
+        await _acquire(scheduler, "/a", 1000)
+        with pytest.raises(workflow._BudgetExceeded, match="all projects"):
+            await _acquire(scheduler, "/b", 1000)
+
+    asyncio.run(scenario())
+
+
+def test_window_halves_once_per_throttling_episode():
+    async def scenario():
+        scheduler = workflow._ModelScheduler(slots=8, prices={})
+        _register(scheduler, "/project", "normal")
+        tickets = [await _acquire(scheduler, "/project", 10) for _ in range(4)]
+        assert scheduler.slots == 8
+
+        # Requests sent before the first decrease say nothing new.
+        for ticket in tickets:
+            scheduler.release(ticket, None, _throttle_error())
+        assert scheduler.slots == 4
+        assert scheduler.throttled == 4
+
+        # A request granted at the reduced window halves it again.
+        ticket = await _acquire(scheduler, "/project", 10)
+        scheduler.release(ticket, None, _throttle_error())
+        assert scheduler.slots == 2
+        assert scheduler.min_window == 2
+
+    asyncio.run(scenario())
+
+
+def test_window_grows_back_with_successes():
+    async def scenario():
+        scheduler = workflow._ModelScheduler(slots=4, prices={})
+        _register(scheduler, "/project", "normal")
+        scheduler.release(await _acquire(scheduler, "/project", 10), None, _throttle_error())
+        assert scheduler.slots == 2
+        usage = workflow.Usage(requests=1, input_tokens=10, output_tokens=5, total_tokens=15)
+        # 2 -> 2.5 -> 2.9 -> 3.24: each success adds 1/window.
+        for expected in (2, 2, 3):
+            scheduler.release(await _acquire(scheduler, "/project", 10), usage)
+            assert scheduler.slots == expected
+
+    asyncio.run(scenario())
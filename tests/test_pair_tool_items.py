@@ -0,0 +1,98 @@
+# Which tool calls, outputs and reasoning items survive the handoff filter.
+# Every case runs on Responses input dicts and on the equivalent SDK run
+# items.
+
+import pytest
+from agents import Agent
+from agents.items import ReasoningItem, ToolCallItem, ToolCallOutputItem
+from openai.types.responses import ResponseFunctionToolCall, ResponseReasoningItem
+
+import multi_agent_workflow as workflow
+
+AGENT = Agent(name="test")
+
+
+def reasoning(name):
+    return {"type": "reasoning", "id": f"rs_{name}", "summary": []}
+
+
+def call(call_id):
+    return {"type": "function_call", "call_id": call_id, "name": "db_query", "arguments": "{}"}
+
+
+def output(call_id, text="ok"):
+    return {"type": "function_call_output", "call_id": call_id, "output": text}
+
+
+def message(text):
+    return {"role": "assistant", "content": text}
+
+
+def _run_item(item):
+    item_type = item.get("type")
+    if item_type == "reasoning":
+        return ReasoningItem(agent=AGENT, raw_item=ResponseReasoningItem(**item))
+    if item_type == "function_call":
+        return ToolCallItem(agent=AGENT, raw_item=ResponseFunctionToolCall(**item))
+    return ToolCallOutputItem(agent=AGENT, raw_item=item, output=item["output"])
+
+
+def _pair(history, form):
+    # Returns the surviving positions in history, and the removed count.
+    items = list(history) if form == "dict" else [_run_item(item) for item in history]
+    kept, removed = workflow._pair_tool_items(items)
+    positions = [next(index for index, item in enumerate(items) if item is survivor) for survivor in kept]
+    return positions, removed
+
+
+FORMS = pytest.mark.parametrize("form", ["dict", "run_item"])
+
+
+@FORMS
+def test_sequential_and_interleaved_parallel_calls_are_kept(form):
+    history = [call("a"), output("a"), call("b"), call("c"), output("c"), output("b")]
+    assert _pair(history, form) == ([0, 1, 2, 3, 4, 5], 0)
+
+
+@FORMS
+def test_orphan_calls_and_outputs_are_dropped(form):
+    history = [call("a"), output("a"), call("orphan"), output("missing")]
+    assert _pair(history, form) == ([0, 1], 2)
+
+
+@FORMS
+def test_output_before_its_call_does_not_pair(form):
+    history = [output("early"), call("early"), call("a"), output("a")]
+    assert _pair(history, form) == ([2, 3], 2)
+
+
+@FORMS
+def test_output_before_and_after_its_call_keeps_the_later_one(form):
+    history = [output("a", "stale"), call("a"), output("a")]
+    assert _pair(history, form) == ([1, 2], 1)
+
+
+@FORMS
+def test_duplicate_outputs_keep_only_the_first(form):
+    history = [call("a"), output("a", "first"), output("a", "second")]
+    assert _pair(history, form) == ([0, 1], 1)
+
+
+@FORMS
+def test_reasoning_is_kept_only_right_before_a_kept_call(form):
+    history = [
+        reasoning("kept"),
+        call("a"),
+        output("a"),
+        reasoning("before_orphan"),
+        call("orphan"),
+        reasoning("before_output"),
+        output("stray"),
+        reasoning("trailing"),
+    ]
+    assert _pair(history, form) == ([0, 1, 2], 5)
+
+
+def test_other_items_are_always_kept():
+    history = [message("hello"), call("orphan"), message("done"), reasoning("last")]
+    assert _pair(history, "dict") == ([0, 2], 2)
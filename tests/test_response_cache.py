@@ -0,0 +1,56 @@
+# End-to-end check of the response cache against the offline fake model:
+# unchanged reruns replay stored outputs, and editing an input makes the
+# stages that read it generate afresh. (The fake model answers from the
+# instructions alone, so stages downstream of a regenerated one still see
+# the same files.)
+
+import json
+import os
+import subprocess
+import sys
+
+WORKFLOW = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multi_agent_workflow.py")
+STAGES = ("pm", "doc", "domain", "data", "designer", "frontend", "backend", "tester")
+
+
+def _run(project_root):
+    env = os.environ.copy()
+    env.pop("OPENAI_API_KEY", None)
+    env.update(
+        AGENT_FAKE_MODEL="1",
+        AGENT_FAKE_LATENCY_MS="0",
+        AGENT_FAKE_OUTPUT_KB="1",
+        AGENT_TRACE="0",
+        AGENT_APPROVAL_REQUIRED="0",
+    )
+    result = subprocess.run(
+        [sys.executable, WORKFLOW, "--project-root", str(project_root), "--max-parallel", "1"],
+        cwd=project_root,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    hits = set()
+    for line in result.stdout.splitlines():
+        if line.startswith("{"):
+            event = json.loads(line)
+            if event["type"] == "log" and event["payload"]["message"].startswith("Response cache hit"):
+                hits.add(event["stage"])
+    return hits
+
+
+def test_upstream_edit_misses_the_settled_cache(tmp_path):
+    assert _run(tmp_path) == set()
+    # Outputs are also stored under the inputs the run left behind, so
+    # unchanged reruns settle on replaying every stage.
+    _run(tmp_path)
+    assert _run(tmp_path) == set(STAGES)
+
+    # docs/UI_UX.md is written by no stage; the stages that read it must
+    # not be served outputs generated from its old text.
+    with open(tmp_path / "docs" / "UI_UX.md", "w", encoding="utf-8") as handle:
+        handle.write("# UI/UX\n\nThe builder page uses a dark theme.\n")
+    readers = {"doc", "designer", "frontend", "tester"}
+    assert _run(tmp_path) == set(STAGES) - readers
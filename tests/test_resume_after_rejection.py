@@ -0,0 +1,81 @@
+# End-to-end check of --resume after a rejected approval, against the
+# offline fake model: the stages approved before the rejection are restored,
+# the rejected stage is generated again rather than restored or replayed
+# from the response cache.
+
+import glob
+import json
+import os
+import subprocess
+import sys
+
+WORKFLOW = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "multi_agent_workflow.py")
+APPROVED_BEFORE_REJECTION = 3
+
+
+def _run(project_root, *args, approvals=None):
+    env = os.environ.copy()
+    env.pop("OPENAI_API_KEY", None)
+    env.update(
+        AGENT_FAKE_MODEL="1",
+        AGENT_FAKE_LATENCY_MS="0",
+        AGENT_FAKE_OUTPUT_KB="1",
+        AGENT_TRACE="0",
+        AGENT_APPROVAL_REQUIRED="1" if approvals is not None else "0",
+        APPROVAL_MODE="cli",
+    )
+    return subprocess.run(
+        [sys.executable, WORKFLOW, "--project-root", str(project_root), "--max-parallel", "1", *args],
+        cwd=project_root,
+        env=env,
+        input=approvals or "",
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+
+
+def _journals(project_root):
+    paths = sorted(glob.glob(os.path.join(str(project_root), ".agent_cache", "runs", "*.json")))
+    journals = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as handle:
+            journals.append(json.load(handle))
+    return journals
+
+
+def _logged(output, agent_id, prefix):
+    for line in output.splitlines():
+        if line.startswith("{") and f'"stage":"{agent_id}"' in line:
+            event = json.loads(line)
+            if event["type"] == "log" and event["payload"]["message"].startswith(prefix):
+                return True
+    return False
+
+
+def test_resume_regenerates_rejected_stage(tmp_path):
+    rejected_run = _run(tmp_path, approvals="y\n" * APPROVED_BEFORE_REJECTION + "n\n")
+    assert rejected_run.returncode != 0
+
+    (journal,) = _journals(tmp_path)
+    assert journal["status"] == "failed"
+    approved = [agent_id for agent_id, entry in journal["stages"].items() if entry["approved"]]
+    rejected = [agent_id for agent_id, entry in journal["stages"].items() if entry["rejected"]]
+    assert len(approved) == APPROVED_BEFORE_REJECTION
+    assert len(rejected) == 1
+    rejected_id = rejected[0]
+
+    resumed = _run(tmp_path, "--resume")
+    assert resumed.returncode == 0, resumed.stderr[-2000:]
+    output = resumed.stdout + resumed.stderr
+
+    resumed_journal = _journals(tmp_path)[-1]
+    assert resumed_journal["status"] == "completed"
+    assert resumed_journal["resumedFrom"] == journal["runId"]
+    for agent_id in approved:
+        assert resumed_journal["stages"][agent_id]["restoredFrom"] == journal["runId"]
+        assert _logged(output, agent_id, "Restored ")
+    assert "restoredFrom" not in resumed_journal["stages"][rejected_id]
+    assert not _logged(output, rejected_id, "Restored ")
+    assert not _logged(output, rejected_id, "Response cache hit")
+    assert resumed_journal["stages"][rejected_id]["approved"]
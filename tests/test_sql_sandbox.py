@@ -0,0 +1,132 @@
+# The db_query sandbox: MySQL migrations and seeds translated into an
+# in-memory SQLite database, and MySQL introspection answered from it.
+
+import os
+
+import multi_agent_workflow as workflow
+
+USERS_TABLE = """CREATE TABLE IF NOT EXISTS `users` (
+  `id` INT(10) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `email` VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci NOT NULL COMMENT 'login, unique',
+  `role` ENUM('admin','member') NOT NULL DEFAULT 'member',
+  `flags` SET('beta','staff') DEFAULT NULL,
+  `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_email` (`email`),
+  KEY `idx_role` (`role`) USING BTREE,
+  FULLTEXT KEY `ft_email` (`email`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='people';
+"""
+
+
+def _write(root, relative_path, text):
+    path = os.path.join(root, relative_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(text)
+
+
+def _query(sandbox, sql):
+    buffer = workflow._RowBuffer(0, 0)
+    sandbox._execute(sql, 5, buffer)
+    return [line.split("\t") for line in buffer.lines], buffer.notes
+
+
+def test_create_table_translation():
+    create, unique, index = workflow._mysql_to_sqlite(USERS_TABLE.rstrip(";\n"))
+    assert create == (
+        'CREATE TABLE IF NOT EXISTS "users" ("id" INTEGER NOT NULL, "email" VARCHAR(255) NOT NULL, '
+        '"role" TEXT NOT NULL DEFAULT \'member\', "flags" TEXT DEFAULT NULL, '
+        '"created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY ("id"))'
+    )
+    assert unique == 'CREATE UNIQUE INDEX IF NOT EXISTS "users_uq_email" ON "users" ("email")'
+    assert index == 'CREATE INDEX IF NOT EXISTS "users_idx_role" ON "users" ("role")'
+
+
+def test_dml_translation():
+    assert workflow._mysql_to_sqlite("INSERT IGNORE INTO `users` (`email`) VALUES ('a@example.com')") == [
+        "INSERT OR IGNORE INTO \"users\" (\"email\") VALUES ('a@example.com')"
+    ]
+    assert workflow._mysql_to_sqlite(
+        "INSERT INTO users (email, role) VALUES ('a@example.com', 'admin') ON DUPLICATE KEY UPDATE role = VALUES(role)"
+    ) == [
+        "INSERT INTO users (email, role) VALUES ('a@example.com', 'admin') "
+        "ON CONFLICT DO UPDATE SET role = excluded.role"
+    ]
+    assert workflow._mysql_to_sqlite("INSERT INTO notes (body) VALUES ('it''s `quoted`; -- not a comment')") == [
+        "INSERT INTO notes (body) VALUES ('it''s `quoted`; -- not a comment')"
+    ]
+
+
+def test_session_and_database_statements_are_dropped():
+    for statement in ("SET NAMES utf8mb4", "USE app", "CREATE DATABASE app", "DROP SCHEMA IF EXISTS app"):
+        assert workflow._mysql_to_sqlite(statement) == []
+    assert workflow._mysql_to_sqlite("DROP TABLE IF EXISTS a, `b`") == ["DROP TABLE IF EXISTS a", 'DROP TABLE IF EXISTS "b"']
+
+
+def test_migrations_and_seeds_load_and_answer_introspection(tmp_path):
+    _write(tmp_path, "migrations/001_users.sql", "SET NAMES utf8mb4;\n" + USERS_TABLE)
+    _write(
+        tmp_path,
+        "seeds/001_users.sql",
+        "INSERT INTO `users` (`email`) VALUES ('a@example.com'), ('b@example.com');\n"
+        "INSERT IGNORE INTO `users` (`email`, `role`) VALUES ('a@example.com', 'admin');\n"
+        "INSERT INTO `users` (`email`, `role`) VALUES ('b@example.com', 'admin') "
+        "ON DUPLICATE KEY UPDATE `role` = VALUES(`role`);\n",
+    )
+    sandbox = workflow._SqlSandbox(str(tmp_path))
+
+    rows, notes = _query(sandbox, "SELECT id, email, role FROM users ORDER BY id")
+    assert notes == []
+    assert rows == [["id", "email", "role"], ["1", "a@example.com", "member"], ["2", "b@example.com", "admin"]]
+
+    assert _query(sandbox, "SHOW TABLES")[0] == [["Tables"], ["users"]]
+    describe = _query(sandbox, "DESCRIBE `users`")[0]
+    assert describe[0] == ["Field", "Type", "Null", "Key", "Default"]
+    assert describe[1] == ["id", "INTEGER", "NO", "PRI", "NULL"]
+    assert describe[3] == ["role", "TEXT", "NO", "", "'member'"]
+    indexes = _query(sandbox, "SHOW INDEX FROM users")[0]
+    assert ["users_uq_email", "0", "1", "email"] in indexes
+    assert ["users_idx_role", "1", "1", "role"] in indexes
+    create = _query(sandbox, "SHOW CREATE TABLE users")[0]
+    assert create[1][0] == "users" and create[1][1].startswith('CREATE TABLE "users"')
+    plan = _query(sandbox, "EXPLAIN SELECT * FROM users WHERE email = 'a@example.com'")[0]
+    assert any("users_uq_email" in cell for row in plan for cell in row)
+
+
+def test_new_files_are_applied_and_edits_rebuild(tmp_path):
+    _write(tmp_path, "migrations/001_users.sql", "CREATE TABLE users (id INT PRIMARY KEY);\n")
+    sandbox = workflow._SqlSandbox(str(tmp_path))
+    assert _query(sandbox, "SHOW TABLES")[0] == [["Tables"], ["users"]]
+    generation = sandbox.generation
+
+    _write(tmp_path, "migrations/002_posts.sql", "CREATE TABLE posts (id INT PRIMARY KEY);\n")
+    assert _query(sandbox, "SHOW TABLES")[0] == [["Tables"], ["posts"], ["users"]]
+    assert sandbox.generation == generation + 1
+
+    # An edited migration cannot be applied on top; the database is rebuilt.
+    _write(tmp_path, "migrations/001_users.sql", "CREATE TABLE members (id INT PRIMARY KEY, name TEXT);\n")
+    assert _query(sandbox, "SHOW TABLES")[0] == [["Tables"], ["members"], ["posts"]]
+
+    os.remove(os.path.join(tmp_path, "migrations", "002_posts.sql"))
+    assert _query(sandbox, "SHOW TABLES")[0] == [["Tables"], ["members"]]
+    version = _query(sandbox, "PRAGMA user_version")[0][1][0]
+    assert int(version) == sandbox.generation == generation + 3
+
+
+def test_failed_statements_are_listed_with_the_results(tmp_path):
+    _write(
+        tmp_path,
+        "migrations/001_users.sql",
+        "CREATE TABLE users (id INT PRIMARY KEY);\n\nINSERT INTO missing VALUES (1);\nCREATE TABLE users (id INT);\n",
+    )
+    sandbox = workflow._SqlSandbox(str(tmp_path))
+    rows, notes = _query(sandbox, "SELECT COUNT(*) AS n FROM users")
+    assert rows == [["n"], ["0"]]
+    assert len(notes) == 1
+    assert notes[0].startswith("(sandbox: 2 statement(s) failed to load: migrations/001_users.sql:3: no such table: missing")
+    assert "migrations/001_users.sql:4: table users already exists" in notes[0]
+
+    # A rebuild starts the list afresh.
+    _write(tmp_path, "migrations/001_users.sql", "CREATE TABLE users (id INT PRIMARY KEY);\n")
+    assert _query(sandbox, "SELECT COUNT(*) AS n FROM users")[1] == []
@@ -0,0 +1,92 @@
+# Role slices of TEST.md: each non-tester stage only gets the acceptance
+# criteria it owns.
+
+import multi_agent_workflow as workflow
+
+HEADING_PLAN = """# Test Plan – EPIC 00
+
+Run every check on a fresh clone.
+
+## 1. Repository Structure
+
+### 1.1 Root folders exist
+- [Owner: Backend]
+
+**Acceptance Criteria**
+- `docs/`, `agents/` and `db/` exist at the root.
+
+### 1.2 README
+- [Designer][Tester]
+
+**Acceptance Criteria**
+- README.md explains the layout.
+
+#### 1.2.1 Screenshots
+- The README shows the landing page.
+
+## 2. Environment
+- .NET 8 SDK installed.
+"""
+
+FLAT_PLAN = """# EPIC 03 – Test Plan
+
+Run against a fresh database.
+
+## Acceptance criteria
+- [Backend] POST /api/builds returns 201 with the new build id.
+  - The id is a GUID.
+- [Frontend] The Create Build button navigates to /builds/{id}.
+- [Frontend, Tester] The builder page shows the engine family.
+- [TODO] Decide on pagination.
+
+## Notes
+Browsers: Chrome and Firefox.
+"""
+
+
+def test_heading_split_plan_gives_each_role_its_sections():
+    index = workflow._index_test_plan(HEADING_PLAN)
+    assert set(index) == {"backend", "designer", "tester"}
+    backend = index["backend"]
+    assert "### 1.1 Root folders exist" in backend and "`docs/`" in backend
+    assert "1.2 README" not in backend and "Screenshots" not in backend
+    designer = index["designer"]
+    assert "## 1. Repository Structure" in designer and "#### 1.2.1 Screenshots" in designer
+    assert "1.1 Root folders" not in designer
+    for text in index.values():
+        assert text.startswith("# Test Plan – EPIC 00\n\nRun every check on a fresh clone.")
+        assert "## 2. Environment" in text
+
+
+def test_flat_tagged_list_is_split_by_item():
+    index = workflow._index_test_plan(FLAT_PLAN)
+    assert set(index) == {"backend", "frontend", "tester"}
+    assert index["backend"] == (
+        "# EPIC 03 – Test Plan\n\nRun against a fresh database.\n\n"
+        "## Acceptance criteria\n"
+        "- [Backend] POST /api/builds returns 201 with the new build id.\n"
+        "  - The id is a GUID.\n\n"
+        "## Notes\nBrowsers: Chrome and Firefox."
+    )
+    frontend = index["frontend"]
+    assert "- [Frontend] The Create Build button" in frontend
+    assert "- [Frontend, Tester] The builder page" in frontend
+    assert "[Backend]" not in frontend and "[TODO]" not in frontend
+    assert "[Frontend] The Create Build" not in index["tester"]
+
+
+def test_roles_without_items_get_no_slice():
+    index = workflow._index_test_plan(FLAT_PLAN)
+    for role in ("doc", "domain", "data", "designer"):
+        assert role not in index
+
+
+def test_untagged_plan_is_not_indexed():
+    assert workflow._index_test_plan("# Plan\n\n## Login\n- Log in with a valid user.\n- [ ] Log out.\n") == {}
+
+
+def test_tags_only_items_mark_their_section():
+    assert workflow._tags_only("- [Owner: Backend]")
+    assert workflow._tags_only("- **Owner:** [Frontend][Tester]")
+    assert not workflow._tags_only("- [Backend] POST /api/builds returns 201")
+    assert not workflow._tags_only("- [TODO]")